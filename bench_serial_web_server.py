@@ -0,0 +1,865 @@
+"""serial_web_server 성능 벤치마크 (보드 없이 오프라인 실행)
+
+사용법: python bench_serial_web_server.py [--mb 8] [--chunk 256] [--seconds 3] [--transport pty|loop]
+                                        [--serving [--workers 4]] [--resets 20] [--out bench_output.json] [--compare 이전.json]
+
+결과는 --out JSON 파일(커밋 해시 포함)로 저장되며, --compare로 이전 결과와 비교해 변화가 큰 항목을 출력
+"""
+import argparse
+import gzip
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tty
+
+import serial_web_server as sws
+
+
+def _make_stream(total_bytes, line_len):
+    """line_len 길이 줄로 구성된 바이트 스트림 (line_len=0이면 개행 없는 바이너리 덤프)"""
+    if line_len <= 0:
+        return bytes(range(32, 127)) * (total_bytes // 95 + 1)
+    line = b"I (1234) bench: " + b"x" * max(line_len - 17, 0) + b"\n"
+    return line * (total_bytes // len(line) + 1)
+
+
+def _chunks(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+def _legacy_split(chunks):
+    """기존 serial_listener 방식 (bytes 누적 후 매번 전체 split) - 비교용"""
+    buffer = b""
+    count = 0
+    for chunk in chunks:
+        buffer += chunk
+        if b"\n" in buffer:
+            lines = buffer.split(b"\n")
+            buffer = lines.pop()
+            count += len(lines)
+    return count
+
+
+def _framer_split(chunks):
+    framer = sws.LineFramer()
+    count = 0
+    for chunk in chunks:
+        count += len(framer.feed(chunk, now=0))
+    return count
+
+
+def bench_framer(total_bytes, chunk_size, line_len, legacy=True):
+    """LineFramer 처리량(MB/s) 측정, legacy=True면 기존 방식과 비교"""
+    chunks = _chunks(_make_stream(total_bytes, line_len), chunk_size)
+    size_mb = sum(len(c) for c in chunks) / 1e6
+    result = {"line_len": line_len, "chunk": chunk_size, "mb": round(size_mb, 2)}
+    for name, fn in (("framer", _framer_split), ("legacy", _legacy_split)):
+        if name == "legacy" and not legacy:
+            continue
+        start = time.perf_counter()
+        lines = fn(chunks)
+        elapsed = time.perf_counter() - start
+        result[f"{name}_mb_s"] = round(size_mb / elapsed, 1)
+        result[f"{name}_lines"] = lines
+    return result
+
+
+def _make_frames(total_bytes, frame_len, framing):
+    """frame_len 바이트 바이너리 레코드(0x00/0xC0/0xDB 포함)를 SLIP/COBS로 인코딩한 스트림"""
+    payload = bytes(range(256)) * (frame_len // 256 + 1)
+    encode = sws.slip_encode if framing == "slip" else sws.cobs_encode
+    frames = [encode(payload[i % 256:i % 256 + frame_len]) for i in range(256)]
+    one_cycle = b"".join(frames)
+    return one_cycle * (total_bytes // len(one_cycle) + 1)
+
+
+def bench_frame_decode(total_bytes, chunk_size, frame_len, framing):
+    """FrameSplitter 처리량(MB/s, frames/s) - 3 Mbaud 링크는 300 KB/s"""
+    chunks = _chunks(_make_frames(total_bytes, frame_len, framing), chunk_size)
+    size_mb = sum(len(c) for c in chunks) / 1e6
+    splitter = sws.FrameSplitter(framing)
+    frames = 0
+    start = time.perf_counter()
+    for chunk in chunks:
+        frames += len(splitter.feed(chunk))
+    elapsed = time.perf_counter() - start
+    return {"framing": framing, "frame_len": frame_len, "chunk": chunk_size, "mb": round(size_mb, 2),
+            "mb_s": round(size_mb / elapsed, 1), "frames_s": round(frames / elapsed),
+            "x_3mbaud": round(size_mb / elapsed / 0.3, 1), "errors": splitter.errors}
+
+
+def _legacy_sync_body(device, last_id):
+    """기존 방식 (요청마다 dict 변환 + json 직렬화 + 압축) - 비교용"""
+    logs, _ = device.log_queue.since(last_id)
+    body = json.dumps({"connected": True, "last_id": device.log_queue.last_id,
+                       "logs": [r.to_dict() for r in logs]}).encode()
+    return gzip.compress(body)
+
+
+def _bench_device(buffer_lines=None):
+    """버퍼 크기를 바꾼 벤치마크용 장치 (디스크 저장 없음)"""
+    sws.devices.clear()
+    saved = sws.MAX_BUFFER_LINES
+    sws.MAX_BUFFER_LINES = buffer_lines or saved
+    try:
+        return sws.add_device(sws.SerialDevice('bench', 'loop://'))
+    finally:
+        sws.MAX_BUFFER_LINES = saved
+
+
+def _run_fanout(clients, lines_per_tick, ticks, cached, buffer_lines=None):
+    device = _bench_device(buffer_lines)
+    if not cached:
+        device.sync_cache = sws.ResponseCache(max_entries=0)
+    for i in range(device.log_queue.capacity):
+        device.append_log(f"I ({i}) bench: warmup line {i}")
+    client = sws.app.test_client()
+    headers = {'Accept-Encoding': 'gzip'}
+    served = legacy = 0.0
+    for _ in range(ticks):
+        cursor = device.log_queue.last_id
+        for i in range(lines_per_tick):
+            device.append_log(f"I ({i}) bench: tick line {i} value={i * 7}")
+        start = time.perf_counter()
+        for _ in range(clients):
+            client.get(f'/api/sync?last_id={cursor}', headers=headers)
+        served += time.perf_counter() - start
+        if not cached:
+            start = time.perf_counter()
+            for _ in range(clients):
+                _legacy_sync_body(device, cursor)
+            legacy += time.perf_counter() - start
+    requests = clients * ticks
+    return served / requests * 1e6, legacy / requests * 1e6
+
+
+def bench_sync_fanout(client_counts, lines_per_tick=20, ticks=20):
+    """틱마다 새 로그를 추가하고 N개 클라이언트가 같은 커서로 /api/sync 요청할 때 요청당 비용(µs)
+
+    cached: 공유 응답 캐시 사용 / uncached: 요청마다 JSON 조각 조립+압축 / legacy_encode: 기존 직렬화+압축만
+    """
+    results = []
+    for clients in client_counts:
+        cached_us, _ = _run_fanout(clients, lines_per_tick, ticks, cached=True)
+        uncached_us, legacy_us = _run_fanout(clients, lines_per_tick, ticks, cached=False)
+        results.append({"clients": clients, "cached_us_per_req": round(cached_us, 1),
+                        "uncached_us_per_req": round(uncached_us, 1),
+                        "legacy_encode_us_per_req": round(legacy_us, 1)})
+    return results
+
+
+def bench_sync_buffer(sizes=(1_000, 10_000, 100_000), client_counts=(1, 50)):
+    """버퍼 크기별 /api/sync 비용: 전체 로드(last_id=0, 캐시 없음) 1회 시간과 클라이언트 수별 증분 요청 비용"""
+    results = []
+    for size in sizes:
+        device = _bench_device(size)
+        device.sync_cache = sws.ResponseCache(max_entries=0)
+        for i in range(size):
+            device.append_log(f"I ({i}) bench: buffered line {i} value={i * 7}")
+        client = sws.app.test_client()
+        start = time.perf_counter()
+        body = client.get('/api/sync?last_id=0', headers={'Accept-Encoding': 'gzip'}).data
+        result = {"buffer_lines": size, "full_load_ms": round((time.perf_counter() - start) * 1000, 2),
+                  "full_load_kb": round(len(body) / 1024, 1)}
+        for clients in client_counts:
+            cached_us, _ = _run_fanout(clients, 20, 10, cached=True, buffer_lines=size)
+            result[f"tick_us_per_req_{clients}c"] = round(cached_us, 1)
+        results.append(result)
+    return results
+
+
+# --- 종단간 수집 벤치마크 (시뮬레이션 보드 → serial_listener → log_queue) ---
+# baud=0이면 속도 제한 없음, burst/idle_ms: burst줄 출력 후 idle_ms 쉼 (부팅 로그 폭주 흉내)
+INGEST_SCENARIOS = [
+    {"name": "uart-115200", "baud": 115_200, "line_len": 80},
+    {"name": "uart-921600", "baud": 921_600, "line_len": 80},
+    {"name": "usb-2M-long", "baud": 2_000_000, "line_len": 200},
+    {"name": "boot-burst", "baud": 921_600, "line_len": 100, "burst": 500, "idle_ms": 500},
+    {"name": "flood", "baud": 0, "line_len": 80},
+    {"name": "slip-3M", "baud": 3_000_000, "line_len": 64, "framing": "slip"},
+    {"name": "cobs-3M", "baud": 3_000_000, "line_len": 64, "framing": "cobs"},
+    {"name": "cobs-flood", "baud": 0, "line_len": 64, "framing": "cobs"},
+]
+
+_SENT_RE = re.compile(r"t=(\d+)")
+_FRAME_HEAD = struct.Struct("<QQ")  # 바이너리 레코드 앞부분: sequence, 송신 시각(monotonic ns)
+_FRAME_FILL = bytes(range(256)) * 16  # 구분자/이스케이프 대상 바이트가 섞인 채움 값
+
+
+def _emit_lines(write, seconds, baud=0, line_len=80, rate=0, burst=0, idle_ms=0, framing="text"):
+    """시뮬레이션 보드 출력: 각 줄에 sequence와 송신 시각(monotonic ns)을 넣고 baud/rate에 맞춰 간격 조절
+
+    framing이 slip/cobs면 줄 대신 line_len 바이트 바이너리 레코드를 인코딩해 보냄
+
+    반환: (보낸 줄 수, 보낸 바이트 수)
+    """
+    byte_sec = 10 / baud if baud else 0.0   # 8N1: 바이트당 10비트
+    line_sec = 1 / rate if rate else 0.0
+    end = time.monotonic() + seconds
+    next_at = time.monotonic()
+    lines = written = 0
+    encode = {"slip": sws.slip_encode, "cobs": sws.cobs_encode}.get(framing)
+    while time.monotonic() < end:
+        for _ in range(burst or 1):
+            if encode:
+                line = encode(_FRAME_HEAD.pack(lines, time.monotonic_ns())
+                              + _FRAME_FILL[lines % 256:lines % 256 + line_len - _FRAME_HEAD.size])
+            else:
+                head = b"I (%d) bench: t=%d " % (lines, time.monotonic_ns())
+                line = head + b"x" * max(line_len - len(head) - 1, 0) + b"\n"
+            write(line)
+            lines += 1
+            written += len(line)
+            next_at += max(len(line) * byte_sec, line_sec)
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if idle_ms:
+            time.sleep(idle_ms / 1000)
+            next_at = time.monotonic()
+    return lines, written
+
+
+def _pty_board(master, totals, seconds, options):
+    def write(data):
+        view = memoryview(data)
+        while view:
+            view = view[os.write(master, view):]
+    totals[0], totals[1] = _emit_lines(write, seconds, **options)
+
+
+class _LatencyProbe(threading.Thread):
+    """스트림 클라이언트처럼 log_queue를 기다렸다가, 각 줄이 보인 시각과 송신 시각의 차이를 기록"""
+
+    def __init__(self, ring):
+        super().__init__(daemon=True)
+        self.ring = ring
+        self.done = threading.Event()
+        self.latencies = []
+        self.missed = 0   # 프로브가 읽기 전에 링에서 밀려난 줄 (관측 누락, 장치 유실 아님)
+
+    def run(self):
+        ring = self.ring
+        cursor = ring.last_id
+        while not self.done.is_set():
+            with ring.cond:
+                ring.cond.wait_for(lambda: ring.last_id > cursor or self.done.is_set(), timeout=0.2)
+                records, gap = ring.since(cursor)
+            now = time.monotonic_ns()
+            for record in records:
+                if isinstance(record.text, bytes):
+                    self.latencies.append((now - _FRAME_HEAD.unpack_from(record.text)[1]) / 1e6)
+                    continue
+                match = _SENT_RE.search(record.text)
+                if match:
+                    self.latencies.append((now - int(match.group(1))) / 1e6)
+            if gap:
+                self.missed += gap["to_id"] - gap["from_id"] + 1
+            if records:
+                cursor = records[-1].id
+
+    def stop(self):
+        self.done.set()
+        with self.ring.cond:
+            self.ring.cond.notify_all()
+        self.join()
+
+
+def bench_ingest(scenario, seconds=3.0, transport="pty"):
+    """시뮬레이션 보드 1개를 serial_listener로 수집할 때 처리량, byte→log_queue 지연, MB당 CPU
+
+    transport: pty (별도 프로세스가 pty에 기록, 보드에 가장 가까움) / loop (pyserial loop://, 같은 프로세스에서 기록)
+    cpu_ms_per_mb는 수집 프로세스 전체 CPU (리더 + 줄 분리 + 파싱 + 인덱싱 + 프로브 1개)
+    cpu_cores는 수집 중 사용한 코어 수 (1 미만이면 단일 코어로 baud 속도를 따라감), link_util은 baud 대비 실제 처리율
+    """
+    options = {k: v for k, v in scenario.items() if k != "name"}
+    framing = options.get("framing", "text")
+    sws.devices.clear()
+    if transport == "pty":
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        device = sws.add_device(sws.SerialDevice('bench', os.ttyname(slave), framing=framing))
+    else:
+        device = sws.add_device(sws.SerialDevice('bench', 'loop://', framing=framing))
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    while not device.is_connected:
+        time.sleep(0.005)
+    probe = _LatencyProbe(device.log_queue)
+    probe.start()
+    first_id = device.log_queue.last_id
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    try:
+        if transport == "pty":
+            totals = multiprocessing.get_context("fork").Array('q', 2)
+            board = multiprocessing.get_context("fork").Process(
+                target=_pty_board, args=(master, totals, seconds, options))
+            board.start()
+            board.join()
+            sent_lines, sent_bytes = totals[:]
+        else:
+            inst = device.serial_inst
+            sent_lines, sent_bytes = _emit_lines(inst.write, seconds, **options)
+        # 남은 바이트가 다 수집될 때까지 대기 (최대 5초)
+        deadline = time.monotonic() + 5
+        while device.log_queue.last_id - first_id < sent_lines and time.monotonic() < deadline:
+            time.sleep(0.005)
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+    finally:
+        probe.stop()
+        stop.set()
+        device.disconnect()
+        listener.join(timeout=2)
+        if transport == "pty":
+            os.close(master)
+            os.close(slave)
+    received = device.log_queue.last_id - first_id
+    latencies = sorted(probe.latencies) or [0.0]
+    mb = sent_bytes / 1e6
+    baud = options.get("baud", 0)
+    return {
+        "name": scenario["name"], "transport": transport, "baud": baud, "framing": framing,
+        "line_len": options.get("line_len", 80),
+        "lines": received, "lost_lines": sent_lines - received, "probe_missed": probe.missed,
+        "lines_s": round(received / wall), "mb_s": round(mb / wall, 3),
+        "latency_p50_ms": round(latencies[len(latencies) // 2], 3),
+        "latency_p99_ms": round(latencies[int(len(latencies) * 0.99)], 3),
+        "latency_max_ms": round(latencies[-1], 3),
+        "cpu_ms_per_mb": round(cpu * 1000 / mb, 1) if mb else None,
+        "cpu_cores": round(cpu / wall, 2),
+        "link_util": round(sent_bytes * 10 / baud / wall, 3) if baud else None,
+        "rss_mb": _rss_mb(),
+    }
+
+
+def bench_metrics_overhead(seconds=3.0, transport="pty"):
+    """flood 시나리오를 계측 켜고/끄고 실행해 MB당 CPU 비교"""
+    flood = next(s for s in INGEST_SCENARIOS if s["name"] == "flood")
+    results = []
+    saved = sws.METRICS_ENABLED
+    try:
+        for enabled in (False, True):
+            sws.METRICS_ENABLED = enabled
+            result = bench_ingest(flood, seconds, transport)
+            results.append({"name": f"metrics-{'on' if enabled else 'off'}", "metrics": enabled,
+                            "lines_s": result["lines_s"], "cpu_ms_per_mb": result["cpu_ms_per_mb"]})
+    finally:
+        sws.METRICS_ENABLED = saved
+    return results
+
+
+def bench_replay(lines=100_000, line_len=80, chunk=256, speed=0):
+    """합성 고속 트레이스를 캡처 파일로 만든 뒤 replay://로 수집 경로에 재생 (speed=0 최대 속도)"""
+    workdir = tempfile.mkdtemp()
+    path = os.path.join(workdir, "trace.cap")
+    writer = sws.CaptureWriter(path)
+    data = _make_stream(lines * line_len, line_len)[:lines * line_len]
+    base = time.monotonic_ns()
+    for i, piece in enumerate(_chunks(data, chunk)):
+        writer.write(piece, base + i * 100_000, 0)   # 청크 간격 0.1ms (약 2.5MB/s 트레이스)
+    writer.close()
+    sws.devices.clear()
+    device = sws.add_device(sws.SerialDevice("replay", f"replay://{path}?speed={speed:g}"))
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    listener.start()
+    expected = data.count(b"\n")
+    while device.log_queue.last_id < expected:
+        time.sleep(0.005)
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    stop.set()
+    device.disconnect()
+    listener.join(timeout=2)
+    size = os.path.getsize(path)
+    os.unlink(path)
+    os.unlink(path + ".idx")
+    os.rmdir(workdir)
+    return {"name": f"replay-x{speed:g}" if speed else "replay-max", "lines": expected,
+            "capture_mb": round(size / 1e6, 2), "lines_s": round(expected / wall),
+            "mb_s": round(len(data) / 1e6 / wall, 2), "cpu_ms_per_mb": round(cpu * 1000 / (len(data) / 1e6), 1)}
+
+
+_TAGS = ("wifi", "app", "sensor", "httpd", "boot")
+
+
+def _retention_child(lines, retain, conn):
+    """fork된 자식에서 링(+압축 블록)에 lines줄을 넣고 RSS 증가량과 조회 시간 측정"""
+    blocks = sws.LogBlocks(retain) if retain else None
+    ring = sws.LogRing(sws.MAX_BUFFER_LINES if retain else lines, blocks=blocks)
+    before = _rss_mb()
+    start = time.perf_counter()
+    for i in range(lines):
+        ring.append(f"I ({i * 7}) {_TAGS[i % 5]}: seq={i} rssi=-{i % 90} heap={200000 - i % 5000} ok",
+                    time.monotonic_ns())
+    append_s = time.perf_counter() - start
+    result = {"lines": lines, "compressed": bool(retain), "append_lines_s": round(lines / append_s),
+              "rss_delta_mb": round(_rss_mb() - before, 1)}
+    if blocks:
+        result["block_mb"] = round(blocks.compressed_bytes / 1e6, 1)
+        old = ring.oldest_id + lines // 3
+        for name in ("history_cold_ms", "history_cached_ms"):
+            start = time.perf_counter()
+            ring.history(old, old + sws.HISTORY_MAX_LINES - 1, sws.HISTORY_MAX_LINES)
+            result[name] = round((time.perf_counter() - start) * 1000, 2)
+    start = time.perf_counter()
+    for _ in range(1000):
+        ring.encoded_since(ring.last_id - 100)
+    result["tail_read_us"] = round((time.perf_counter() - start) * 1000, 2)
+    conn.send(result)
+
+
+def bench_memory_retention(lines=1_200_000, baseline_lines=200_000):
+    """압축 블록으로 lines줄을 메모리에 보관할 때 RSS·조회 시간 vs 같은 내용을 비압축 링에 둘 때 (자식 프로세스 측정)"""
+    results = []
+    ctx = multiprocessing.get_context("fork")
+    for n, retain in ((lines, lines), (baseline_lines, 0)):
+        parent, child = ctx.Pipe()
+        proc = ctx.Process(target=_retention_child, args=(n, retain, child))
+        proc.start()
+        results.append(parent.recv())
+        proc.join()
+    results[1]["rss_per_million_mb"] = round(results[1]["rss_delta_mb"] * 1e6 / baseline_lines, 1)
+    return results
+
+
+def bench_series(hours=24, rate_hz=1.0, other_per_sample=9, points=300):
+    """시계열 추출 비용(줄당) + 24시간 구간 min/max/avg 조회: 사전 집계 vs 텍스트 재스캔"""
+    rule = r"rssi=(?P<rssi>-?\d+) heap=(?P<heap>\d+)"
+    extractor = sws.SeriesExtractor(sws.SERIES_RULES + (rule,))
+    samples = int(hours * 3600 * rate_hz)
+    step_ns = int(1e9 / rate_hz)
+    start_ns = time.time_ns() - samples * step_ns
+    records = []
+    for i in range(samples):
+        ts_ns = start_ns + i * step_ns - sws._WALL_OFFSET_NS
+        text = f"I ({i}) wifi: rssi=-{40 + i % 50} heap={200000 - i % 5000}"
+        records.append(sws.LogRecord.parse(i, text, ts_ns))
+        for j in range(other_per_sample):
+            records.append(sws.LogRecord.parse(i, f"I ({i}) {_TAGS[j % 5]}: seq={i} payload ok", ts_ns))
+    start = time.perf_counter()
+    for record in records:
+        extractor.add(record)
+    extract_s = time.perf_counter() - start
+
+    since, until = start_ns / 1e9, time.time()
+    start = time.perf_counter()
+    result = extractor.query("rssi", since, until, points)
+    query_ms = (time.perf_counter() - start) * 1000
+
+    # 비교: 같은 구간 텍스트를 매번 정규식으로 다시 읽어 버킷 계산 (추출 규칙 도입 전 대시보드가 해야 했던 일)
+    pattern = re.compile(rule)
+    bucket_ns = (until * 1e9 - start_ns) / points
+    start = time.perf_counter()
+    buckets = {}
+    for record in records:
+        m = pattern.search(record.text)
+        if m:
+            value = float(m["rssi"])
+            acc = buckets.setdefault(int((record.ts_ns + sws._WALL_OFFSET_NS - start_ns) // bucket_ns), [value, value, 0.0, 0])
+            acc[0] = min(acc[0], value)
+            acc[1] = max(acc[1], value)
+            acc[2] += value
+            acc[3] += 1
+    rescan_ms = (time.perf_counter() - start) * 1000
+    return [{"lines": len(records), "samples": samples, "extract_ns_per_line": round(extract_s / len(records) * 1e9),
+             "window_h": hours, "buckets": len(result["ts"]), "source": result["source"],
+             "query_ms": round(query_ms, 2), "rescan_ms": round(rescan_ms, 1)}]
+
+
+def bench_expect(wait_counts=(10, 100, 500), lines=5000):
+    """동시 expect 대기 수별 줄당 검사 비용: 합친 정규식 1번 vs 대기마다 패턴 검사 (매칭 없는 줄 기준)"""
+    records = [sws.LogRecord.parse(i + 1, f"I ({i}) {_TAGS[i % 5]}: seq={i} payload ok") for i in range(lines)]
+    results = []
+    for count in wait_counts:
+        hub = sws.ExpectHub()
+        waits = [hub.register([f"test {i} (?:passed|failed)", r"Guru Meditation|abort\(\)"], 0) for i in range(count)]
+        start = time.perf_counter()
+        for record in records:
+            hub.feed(record)
+        combined_us = (time.perf_counter() - start) / lines * 1e6
+        start = time.perf_counter()
+        for record in records:
+            for wait in waits:
+                for compiled in wait.compiled:
+                    compiled.search(record.text)
+        naive_us = (time.perf_counter() - start) / lines * 1e6
+        results.append({"waits": count, "combined_us_per_line": round(combined_us, 2),
+                        "per_wait_us_per_line": round(naive_us, 2)})
+    return results
+
+
+def _rss_mb():
+    """현재 RSS (/proc가 없으면 최대 RSS)"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except OSError:
+        return _peak_rss_mb()
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+def _peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _meta():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {"commit": commit, "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def _flatten(report):
+    """{섹션/결과이름/지표: 값} - 결과 이름은 name 필드 또는 숫자가 아닌 필드들로 구성"""
+    flat = {}
+    for section, results in report["results"].items():
+        for i, result in enumerate(results):
+            label = result.get("name") or ",".join(
+                f"{k}={v}" for k, v in result.items() if k in ("mode", "clients", "buffer_lines", "line_len", "chunk"))
+            for key, value in result.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    flat[f"{section}/{label or i}/{key}"] = value
+    return flat
+
+
+def compare_reports(old, new, threshold=0.05):
+    """두 결과 파일에서 threshold(5%) 이상 달라진 지표 목록 [(키, 이전, 현재, 변화율)]"""
+    before, after = _flatten(old), _flatten(new)
+    changes = []
+    for key, value in after.items():
+        prev = before.get(key)
+        if prev and abs(value - prev) / abs(prev) >= threshold:
+            changes.append((key, prev, value, round((value - prev) / abs(prev) * 100, 1)))
+    return changes
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _start_server(mode, port, config_path):
+    cmd = [sys.executable, "serial_web_server.py", "--config", config_path, "--log-dir", "",
+           "--host", "127.0.0.1", "--http-port", str(port)]
+    server, _, workers = mode.partition("-w")  # 예: flask-w4 = Flask 워커 4개 + 수집 프로세스
+    if server == "asgi":
+        cmd.append("--asgi")
+    if workers:
+        cmd += ["--workers", workers]
+    proc = subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(__file__)),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/status")
+            if json.loads(conn.getresponse().read())["connected"]:
+                return proc
+        except (OSError, ValueError, KeyError):
+            pass
+        time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def _open_streams(port, count):
+    """응답을 읽지 않고 붙잡아 두는 유휴 SSE 접속 (대시보드 탭 N개)"""
+    streams = []
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /api/stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+        streams.append(sock)
+    for sock in streams:
+        sock.settimeout(10)
+        sock.recv(4096)  # 응답 헤더 수신까지 대기 (접속이 실제로 잡혔는지 확인)
+    return streams
+
+
+def _load_client(port, path, until, latencies):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    while time.monotonic() < until:
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+            conn.getresponse().read()
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def bench_serving(mode, clients=20, idle_streams=200, seconds=5, lines=500):
+    """서버 프로세스를 띄워 /api/sync 부하 (req/s, p99 ms) 측정, 유휴 스트림 접속을 붙잡은 상태에서 실행
+
+    loop:// 장치에 /api/send로 보낸 줄이 그대로 돌아와 로그 버퍼를 채움
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump({"devices": [{"name": "bench", "port": "loop://"}]}, f)
+    port = _free_port()
+    proc = _start_server(mode, port, f.name)
+    streams = []
+    try:
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+        for i in range(lines):
+            body = json.dumps({"data": f"I ({i}) bench: serving line {i} value={i * 7}"})
+            conn.request("POST", "/api/send", body, {"Content-Type": "application/json"})
+            conn.getresponse().read()
+        conn.close()
+        streams = _open_streams(port, idle_streams)
+        per_client = [[] for _ in range(clients)]
+        until = time.monotonic() + seconds
+        threads = [threading.Thread(target=_load_client, args=(port, "/api/sync?last_id=0", until, lat))
+                   for lat in per_client]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        latencies = sorted(x for lat in per_client for x in lat)
+        return {"mode": mode, "clients": clients, "idle_streams": idle_streams,
+                "req_s": round(len(latencies) / seconds, 1),
+                "p50_ms": round(latencies[len(latencies) // 2] * 1000, 2),
+                "p99_ms": round(latencies[int(len(latencies) * 0.99)] * 1000, 2)}
+    finally:
+        for sock in streams:
+            sock.close()
+        proc.terminate()
+        proc.wait(timeout=10)
+        os.unlink(f.name)
+
+
+def _plug(link):
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    os.symlink(os.ttyname(slave), link)
+    return master, slave
+
+
+def _boot_output(master, stop, interval=0.001):
+    """리셋 직후 보드처럼 1ms마다 부트로더 줄 출력 (포트를 아무도 안 열었으면 유실됨)"""
+    i = 0
+    while not stop.is_set():
+        try:
+            os.write(master, b"ESP-ROM:esp32s3 boot %d\n" % i)
+        except OSError:
+            return
+        i += 1
+        time.sleep(interval)
+
+
+def bench_reattach(resets=20, unplug_sec=0.1):
+    """pty 포트를 지웠다가 새 pty로 다시 만들 때 (리셋 후 USB 재열거 흉내) 포트 재등장 → 첫 수집 줄까지 지연
+
+    lost_lines: 연결 전에 출력되어 잃은 부트로더 줄 수 (1ms 간격)
+    """
+    sws.devices.clear()
+    link = os.path.join(tempfile.mkdtemp(), "ttyBOARD")
+    device = sws.add_device(sws.SerialDevice("bench", link))
+    master, slave = _plug(link)
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    latencies, lost = [], []
+    try:
+        for _ in range(resets):
+            os.unlink(link)
+            os.close(master)
+            os.close(slave)
+            while device.is_connected:
+                time.sleep(0.001)
+            time.sleep(unplug_sec)
+            last_id = device.log_queue.last_id
+            master, slave = _plug(link)
+            plugged_ns = time.monotonic_ns()
+            board_stop = threading.Event()
+            board = threading.Thread(target=_boot_output, args=(master, board_stop), daemon=True)
+            board.start()
+            while device.log_queue.last_id == last_id:
+                time.sleep(0.001)
+            board_stop.set()
+            board.join()
+            first = device.log_queue.get(last_id + 1)
+            latencies.append((first.ts_ns - plugged_ns) / 1e6)
+            lost.append(int(first.text.rsplit(" ", 1)[1]))
+    finally:
+        stop.set()
+        device.disconnect()
+        listener.join(timeout=2)
+        os.close(master)
+        os.close(slave)
+        os.unlink(link)
+        os.rmdir(os.path.dirname(link))
+    latencies.sort()
+    return {"resets": resets, "p50_ms": round(latencies[len(latencies) // 2], 2),
+            "max_ms": round(latencies[-1], 2), "lost_lines_avg": round(sum(lost) / len(lost), 1)}
+
+
+_STUB_FLASHER = """import sys
+with open(sys.argv[1], 'wb', buffering=0) as port:
+    port.write(b'SYNC' * 64)
+for i in range(int(sys.argv[2])):
+    print(f'Writing at 0x{0x10000 + i * 0x400:08x}... ({i * 100 // int(sys.argv[2])} %)', flush=True)
+print('Hard resetting via RTS pin...')
+"""
+
+
+def bench_flash(runs=10, output_lines=200):
+    """/api/flash 흐름 (pty + 가짜 플래셔): 리더 정지·포트 해제 → 플래셔 → 재연결 → 첫 부트 줄 구간별 시간
+
+    플래셔가 끝나는 순간부터 보드처럼 1ms마다 부트 줄 출력, lost_lines: 수집 전에 잃은 부트 줄 수
+    (이전 build_and_upload.sh: 서버 종료 후 1초 + 플래시 후 2초 대기 + 서버 재시작, 그 사이 부트 로그와 버퍼는 유실)
+    """
+    sws.devices.clear()
+    workdir = tempfile.mkdtemp()
+    stub = os.path.join(workdir, "flasher.py")
+    with open(stub, "w") as f:
+        f.write(_STUB_FLASHER)
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    device = sws.add_device(sws.SerialDevice("bench", os.ttyname(slave),
+                                             flash_command=f"{sys.executable} {stub} {{port}} {output_lines}"))
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    phases = {phase: [] for phase in sws.FLASH_PHASES}
+    lost = []
+    try:
+        while not device.is_connected:
+            time.sleep(0.001)
+        for _ in range(runs):
+            device.start_flash()
+            job = device.flash_job
+            while job.phase in ("pause", "flash"):
+                time.sleep(0.0005)
+            last_id = device.log_queue.last_id
+            board_stop = threading.Event()
+            board = threading.Thread(target=_boot_output, args=(master, board_stop), daemon=True)
+            board.start()
+            job.done.wait(30)
+            board_stop.set()
+            board.join()
+            os.read(master, 65536)  # 플래셔가 포트에 쓴 SYNC
+            for phase, seconds in job.phases.items():
+                phases[phase].append(seconds * 1000)
+            first = next((log for log in device.log_queue.since(last_id)[0] if log.text.startswith("ESP-ROM")), None)
+            if first is not None:
+                lost.append(int(first.text.rsplit(" ", 1)[1]))
+            time.sleep(0.05)  # 부트 출력이 끝난 뒤 다음 회차
+    finally:
+        stop.set()
+        device.disconnect()
+        listener.join(timeout=2)
+        os.close(master)
+        os.close(slave)
+        os.unlink(stub)
+        os.rmdir(workdir)
+    result = {"runs": runs, "flasher_lines": output_lines}
+    for phase, values in phases.items():
+        if values:
+            values.sort()
+            result[f"{phase}_p50_ms"] = round(values[len(values) // 2], 2)
+    result["lost_lines_avg"] = round(sum(lost) / len(lost), 1) if lost else None
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=8, help="framer 입력 크기 (MB)")
+    parser.add_argument("--chunk", type=int, default=256, help="read() 청크 크기 (bytes)")
+    parser.add_argument("--seconds", type=float, default=3, help="수집 시나리오별 실행 시간 (초)")
+    parser.add_argument("--transport", choices=("pty", "loop"), default="pty" if hasattr(os, "openpty") else "loop",
+                        help="시뮬레이션 보드 연결 방식")
+    parser.add_argument("--serving", action="store_true", help="Flask 개발 서버와 ASGI 모드 부하 비교 실행")
+    parser.add_argument("--workers", type=int, default=4, help="--serving 시 멀티 프로세스 모드의 웹 워커 수")
+    parser.add_argument("--resets", type=int, default=20, help="포트 재연결 지연 측정 횟수 (0이면 생략, pty 필요)")
+    parser.add_argument("--out", default="bench_output.json", help="결과 JSON 파일 ('-'이면 저장 안 함)")
+    parser.add_argument("--compare", help="이전 결과 JSON과 비교")
+    parser.add_argument("--threshold", type=float, default=10, help="--compare 시 출력할 최소 변화율 (%%)")
+    args = parser.parse_args()
+
+    report = {"meta": _meta(), "results": {}}
+
+    def section(name, title, results):
+        print(f"# {title}")
+        for result in results:
+            print(result)
+        report["results"][name] = results
+
+    total = int(args.mb * 1e6)
+    # 개행 없는 출력: 기존 방식은 누적 버퍼를 매번 복사/재스캔하므로 1MB로 제한해 비교
+    section("framer", "LineFramer throughput", [
+        bench_framer(total, args.chunk, 80),
+        bench_framer(1_000_000, args.chunk, 0),
+        bench_framer(total, args.chunk, 0, legacy=False),
+    ])
+    section("frame_decode", "SLIP/COBS FrameSplitter throughput", [
+        bench_frame_decode(total, args.chunk, frame_len, framing)
+        for framing in ("slip", "cobs") for frame_len in (16, 64, 1024)
+    ])
+
+    # 요청 비용은 Flask 처리 포함, legacy_encode는 기존 방식의 직렬화+압축 비용만
+    section("sync_fanout", "/api/sync fan-out (gzip)", bench_sync_fanout([1, 10, 50, 200]))
+    section("ingest", f"end-to-end ingest ({args.transport}, {args.seconds:g}s per scenario)",
+            [bench_ingest(scenario, args.seconds, args.transport) for scenario in INGEST_SCENARIOS])
+    section("metrics_overhead", "/metrics instrumentation overhead (flood)",
+            bench_metrics_overhead(args.seconds, args.transport))
+    section("replay", "capture replay through ingest (max speed)", [bench_replay()])
+    section("memory_retention", "in-memory retention: compressed blocks vs plain ring (tail_read_us = 100-line sync slice)",
+            bench_memory_retention())
+    section("sync_buffer", "/api/sync vs buffer size", bench_sync_buffer())
+    section("series", "numeric series: extraction per line, 24h downsample vs text rescan", bench_series())
+    section("expect", "expect matching cost per line vs concurrent waits (combined regex vs per-wait scan)",
+            bench_expect())
+
+    # 이전 방식은 오류 후 2초 + 연결 후 1초 + 폴링 1초의 고정 대기 (수 초의 부트 로그 유실)
+    if args.resets and hasattr(os, "openpty"):
+        section("reattach", "reset-to-first-captured-line (pty hotplug)", [bench_reattach(args.resets)])
+        section("flash", "in-server flash handover (pty + stub flasher, per-phase p50)", [bench_flash()])
+
+    if args.serving:
+        results = [bench_serving("flask"), bench_serving(f"flask-w{args.workers}")]
+        try:
+            import uvicorn  # noqa: F401
+        except ImportError:
+            print("asgi: skipped (pip install uvicorn)")
+        else:
+            results += [bench_serving("asgi"), bench_serving(f"asgi-w{args.workers}")]
+        section("serving", "serving mode (/api/sync under load, idle SSE streams held open)", results)
+
+    report["meta"]["peak_rss_mb"] = _peak_rss_mb()
+    print(f"# peak RSS: {report['meta']['peak_rss_mb']} MB")
+    if args.out != "-":
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+        print(f"# saved: {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        print(f"# changes vs {args.compare} ({previous['meta'].get('commit')})")
+        for key, before, after, pct in compare_reports(previous, report, args.threshold / 100):
+            print(f"{key}: {before} -> {after} ({pct:+}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 #!/bin/bash
 
 # ESP32 빌드 및 업로드 자동화 스크립트
-# Flask 서버 중지 -> 빌드 -> 업로드 -> Flask 서버 재시작
+# 빌드 -> 업로드 (실행 중인 Flask 서버가 포트를 넘겨주고 다시 연결, 서버가 없거나 서버에서 플래시할 수 없으면 직접 업로드 후 시작)
 
 set -e  # 에러 발생 시 스크립트 중단
 
@@ -28,49 +28,54 @@ echo -e "${BLUE}  ESP-Web-Monitor 빌드 및 업로드${NC}"
 echo -e "${BLUE}========================================${NC}"
 echo ""
 
-# 1. Flask 서버 중지
-echo -e "${YELLOW}[1/4] Flask 서버 중지 중...${NC}"
-FLASK_PID=$(ps aux | grep "python.*serial_web_server.py" | grep -v grep | awk '{print $2}')
-if [ -n "$FLASK_PID" ]; then
-    kill $FLASK_PID
-    echo -e "${GREEN}✓ Flask 서버 중지됨 (PID: $FLASK_PID)${NC}"
-    sleep 1
+# 서버용 Python (가상환경이 있으면 사용)
+if [ -d "$VENV_PATH" ]; then
+    SERVER_PYTHON="$VENV_PATH/bin/python"
 else
-    echo -e "${YELLOW}⚠ Flask 서버가 실행 중이 아닙니다${NC}"
+    SERVER_PYTHON="python3"
 fi
 
-# 2. ESP-IDF 환경 설정
-echo -e "${YELLOW}[2/4] ESP-IDF 환경 설정 중...${NC}"
+# 1. ESP-IDF 환경 설정
+echo -e "${YELLOW}[1/3] ESP-IDF 환경 설정 중...${NC}"
 source "$IDF_PATH/export.sh" > /dev/null 2>&1
 echo -e "${GREEN}✓ ESP-IDF 환경 설정 완료${NC}"
 
-# 3. 빌드 및 업로드
-echo -e "${YELLOW}[3/4] ESP32 빌드 및 업로드 중...${NC}"
+# 2. 빌드 (포트가 필요 없으므로 모니터 서버는 계속 실행)
+echo -e "${YELLOW}[2/3] ESP32 빌드 중...${NC}"
 cd "$PROJECT_DIR"
-
-# 빌드
-echo -e "${BLUE}  → 빌드 중...${NC}"
 idf.py build
+echo -e "${GREEN}✓ 빌드 완료${NC}"
 
-# 업로드
-echo -e "${BLUE}  → 업로드 중...${NC}"
-idf.py -p "$SERIAL_PORT" flash
-
-echo -e "${GREEN}✓ 빌드 및 업로드 완료${NC}"
-
-# 잠시 대기 (ESP32 재시작 시간)
-sleep 2
-
-# 4. Flask 서버 재시작
-echo -e "${YELLOW}[4/4] Flask 서버 재시작 중...${NC}"
+# 3. 업로드: 실행 중인 서버가 포트를 넘겨주고 플래시 후 바로 재연결 (로그 버퍼·대시보드 접속 유지)
+echo -e "${YELLOW}[3/3] ESP32 업로드 중...${NC}"
 cd "$SCRIPT_DIR"
-if [ -d "$VENV_PATH" ]; then
-    source "$VENV_PATH/bin/activate"
-    nohup python "$FLASK_SERVER_SCRIPT" > /tmp/flask_server.log 2>&1 &
+set +e
+"$SERVER_PYTHON" "$FLASK_SERVER_SCRIPT" --flash
+FLASH_RC=$?
+set -e
+
+if [ $FLASH_RC -eq 0 ]; then
+    echo -e "${GREEN}✓ 업로드 완료 (모니터 서버가 포트를 다시 연결함)${NC}"
+elif [ $FLASH_RC -eq 3 ]; then
+    # 서버가 없거나 서버 환경에서 플래셔를 실행할 수 없으면 (ESP-IDF export.sh 없이 시작한 서버 등)
+    # 이 셸의 ESP-IDF 환경으로 직접 플래시 후 서버 시작 - 실행 중인 서버는 포트를 잡고 있으므로 먼저 중지
+    echo -e "${YELLOW}⚠ 서버에서 업로드할 수 없습니다 - 직접 업로드 후 서버를 시작합니다${NC}"
+    FLASK_PID=$(ps aux | grep "python.*serial_web_server.py" | grep -v grep | awk '{print $2}')
+    if [ -n "$FLASK_PID" ]; then
+        kill $FLASK_PID
+        echo -e "${GREEN}✓ Flask 서버 중지됨 (PID: $FLASK_PID)${NC}"
+        sleep 1
+    fi
+    cd "$PROJECT_DIR"
+    idf.py -p "$SERIAL_PORT" flash
+    echo -e "${GREEN}✓ 업로드 완료${NC}"
+    cd "$SCRIPT_DIR"
+    nohup "$SERVER_PYTHON" "$FLASK_SERVER_SCRIPT" > /tmp/flask_server.log 2>&1 &
     FLASK_NEW_PID=$!
-    echo -e "${GREEN}✓ Flask 서버 재시작됨 (PID: $FLASK_NEW_PID)${NC}"
+    echo -e "${GREEN}✓ Flask 서버 시작됨 (PID: $FLASK_NEW_PID)${NC}"
 else
-    echo -e "${RED}✗ 가상환경(.venv)을 찾을 수 없습니다. Flask 서버를 시작할 수 없습니다.${NC}"
+    echo -e "${RED}✗ 업로드 실패 (출력은 웹 대시보드의 [FLASH] 로그 참고)${NC}"
+    exit 1
 fi
 
 echo ""
@@ -1,112 +1,2998 @@
+import argparse
+import asyncio
+import atexit
+import base64
+import bisect
+import gzip
+import io
+import itertools
+import json
+import mmap
+import os
+import queue
+import re
+import shlex
+import shutil
+import signal
+import socket
+import struct
 import threading
 import time
+import urllib.error
+import urllib.request
+import zlib
 import serial
 import serial.tools.list_ports
 import subprocess
 import sys
-from flask import Flask, render_template_string, jsonify, request
-from collections import deque
+import tempfile
+from array import array
+from collections import OrderedDict, deque
+from multiprocessing.connection import AuthenticationError, Client, Listener
+from urllib.parse import parse_qsl, quote
+from flask import Flask, Response, abort, render_template_string, jsonify, request
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.http import parse_etags
 
 # --- 설정 ---
 SERIAL_PORT = '/dev/cu.usbmodem101'
 BAUD_RATE = 115200
 MAX_BUFFER_LINES = 1000  
+MEMORY_RETAIN_LINES = 1_000_000          # 링에서 밀려난 줄을 압축 블록으로 메모리에 보관할 최대 줄 수 (0이면 보관 안 함)
+LOG_BLOCK_LINES = 4096                   # 압축 블록 1개의 줄 수
+LOG_BLOCK_CACHE = 8                      # 압축 해제해 둘 최근 블록 수 (LRU)
+LOG_BLOCK_LEVEL = 6                      # 블록 zlib 압축 레벨
+STREAM_HEARTBEAT_SEC = 15  # 스트림 유휴 시 keep-alive 주석 전송 주기
+SERIAL_READ_TIMEOUT = 0.5  # 블로킹 read 최대 대기 (유휴 시 깨어나는 주기, 데이터 도착 시 즉시 반환)
+MAX_LINE_BYTES = 4096      # 개행 없이 이 길이를 넘으면 강제로 줄 분리 (버퍼 무한 증가 방지)
+MAX_FRAME_BYTES = 64 * 1024  # 바이너리 프레이밍(SLIP/COBS)에서 구분자 없이 이 길이를 넘으면 동기 이탈로 보고 버림
+PARTIAL_FLUSH_SEC = 0.3    # 개행 없는 부분 줄(프롬프트 등)을 이 시간 동안 입력이 없으면 출력
+LOG_DIR = 'logs'           # 장치별 디스크 로그 저장 위치 (--log-dir ''로 비활성화)
+STORE_SEGMENT_BYTES = 16 * 1024 * 1024   # 세그먼트 파일 최대 크기
+STORE_MAX_BYTES = 1024 * 1024 * 1024     # 장치별 보존 총 크기
+STORE_MAX_AGE_SEC = 7 * 24 * 3600        # 보존 기간
+STORE_INDEX_INTERVAL = 256               # N줄마다 sequence→offset 인덱스 1개
+STORE_BATCH_BYTES = 64 * 1024            # 대기 중인 기록이 이 크기를 넘으면 즉시 flush
+STORE_FSYNC = True                       # flush(배치)마다 fsync 1회
+HISTORY_MAX_LINES = 5000                 # /api/history 한 번에 반환할 최대 줄 수
+SEARCH_MAX_RESULTS = 1000                # /api/search 최대 결과 수
+SEARCH_MAX_CONTEXT = 20                  # /api/search 앞뒤 context 최대 줄 수
+DISCOVERY_POLL_SEC = 0.02                # 미연결 장치가 있을 때 포트 재등장 확인 주기 (/dev 변경 여부만 stat)
+DISCOVERY_RESCAN_SEC = 1.0               # /dev 변경 감지가 안 되는 환경(Windows)의 포트 재열거 주기
+RECONNECT_BACKOFF_SEC = (0.02, 2.0)      # 열기/읽기 실패 후 재시도 대기 (최소, 최대) - 실패할수록 2배
+CAPTURE_INDEX_INTERVAL = 64             # 원시 캡처에서 N청크마다 시간/sequence 인덱스 1개
+SHM_RING_BYTES = 8 * 1024 * 1024         # 장치별 공유 메모리 링의 JSON 데이터 영역 크기 (멀티 프로세스 서빙)
+SHM_POLL_SEC = 0.01                      # 웹 워커가 공유 링 헤더(새 로그·연결 상태)를 확인하는 주기
+METRICS_ENABLED = True                   # /metrics 계측 (--no-metrics로 끄면 계측 지점은 None 확인만)
+COMPRESS_MIN_BYTES = 1024                # 이보다 큰 응답만 gzip/deflate 압축
+COMPRESS_LEVEL = 6
+TX_QUEUE_SIZE = 64                       # 장치별 송신 대기열 크기 (가득 차면 /api/send 거절)
+TX_HISTORY_SIZE = 100                    # 타이밍 조회용으로 보관할 최근 송신 명령 수
+SERIES_RULES = (r'Min(?:imum free)? [Hh]eap(?: size)?: (?P<min_heap>\d+)',)  # 시계열 추출 규칙 (이름 있는 그룹마다 시계열 1개)
+SERIES_POINTS = 16384                    # 시계열별 원본 점 보관 수 (사전 집계 단위보다 짧은 구간 조회용)
+SERIES_TIERS = ((1, 4096), (10, 4096), (60, 4096), (600, 4096))  # 사전 집계 (버킷 폭 초, 버킷 수): 1초 68분 … 10분 28일
+SERIES_MAX_POINTS = 2000                 # /api/series 한 번에 반환할 최대 버킷 수
+EXPECT_TIMEOUT_SEC = 30                  # /api/expect 기본 대기 시간
+EXPECT_MAX_TIMEOUT_SEC = 600             # /api/expect 최대 대기 시간 (long-poll 1회)
+EXPECT_KEEPALIVE_SEC = 5                 # Flask 모드 expect 대기 중 공백 전송 주기 (끊긴 연결을 감지해 대기 해제)
+EXPECT_MAX_PATTERNS = 256                # expect 요청 1개의 최대 패턴 수
+EXPECT_MAX_BACKLOG = 100_000             # 커서 이후 이미 수신된 줄을 검사할 최대 줄 수 (넘으면 최근 줄만)
+FLASH_COMMAND = 'idf.py -p {port} flash'  # /api/flash 플래셔 명령 ({port}, {baud}, {name} 치환, 설정 파일 "flash"로 장치별 지정)
+FLASH_CWD = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hello_world')  # 플래셔 실행 위치
+FLASH_TIMEOUT_SEC = 300                  # 플래셔가 이 시간 안에 끝나지 않으면 종료
+FLASH_REATTACH_SEC = 10                  # 플래시 후 포트 재연결 최대 대기
+FLASH_BOOT_WAIT_SEC = 3                  # 재연결 후 첫 부트 로그 최대 대기
 
-# --- 글로벌 상태 관리 ---
-app = Flask(__name__)
-log_queue = deque(maxlen=MAX_BUFFER_LINES)
-log_sequence = 0
-serial_inst = None
-serial_lock = threading.Lock()
-is_connected = False
-
-def _find_serial_port():
-    """우선 기본 포트 시도, 실패 시 사용 가능한 USB 시리얼 포트 검색 (리셋 후 포트 번호 변경 대응)"""
-    try:
-        with serial.Serial(SERIAL_PORT, BAUD_RATE, timeout=0.1) as probe:
-            pass
-        return SERIAL_PORT
-    except Exception:
-        pass
-    for port in serial.tools.list_ports.comports():
-        path = port.device
-        if 'usbmodem' in path or 'usbserial' in path or (sys.platform == 'win32' and path.startswith('COM')):
+# --- 로그 레코드 ---
+_ANSI_RE = re.compile(r'\x1b\[[0-9;]*[A-Za-z]')
+_ESP_LOG_RE = re.compile(r'([EWIDV]) \((\d+)\) ([^:]+): ')  # ESP-IDF: "I (1234) tag: msg"
+_WALL_OFFSET_NS = time.time_ns() - time.monotonic_ns()     # monotonic → epoch 변환용
+LOG_LEVELS = ('E', 'W', 'I', 'D', 'V')
+LOG_LEVELS_BY_CODE = {ord(level): level for level in LOG_LEVELS}
+
+class LogRecord:
+    """로그 한 줄 (ESP-IDF 형식이면 level/tick/tag 파싱, level·tag 문자열은 intern으로 공유)
+
+    바이너리 프레이밍 장치의 레코드는 text가 프레임 원본 bytes (JSON에는 base64 "data"로 실림)
+    """
+
+    __slots__ = ('id', 'text', 'ts_ns', 'level', 'tick', 'tag', '_json')
+
+    def __init__(self, record_id, text, ts_ns, level=None, tick=None, tag=None, encoded=None):
+        self.id = record_id
+        self.text = text
+        self.ts_ns = ts_ns  # 수신 시각 (time.monotonic_ns)
+        self.level = level
+        self.tick = tick    # 장치 tick (ms)
+        self.tag = tag
+        self._json = encoded
+
+    @classmethod
+    def parse(cls, record_id, raw, ts_ns=None):
+        """ANSI 색상 코드 제거 후 ESP-IDF 로그 형식 파싱 (bytes는 바이너리 프레임으로 그대로 보관)"""
+        if ts_ns is None:
+            ts_ns = time.monotonic_ns()
+        if isinstance(raw, bytes):
+            return cls(record_id, raw, ts_ns)
+        text = _ANSI_RE.sub('', raw) if '\x1b' in raw else raw
+        m = _ESP_LOG_RE.match(text)
+        if m is None:
+            return cls(record_id, text, ts_ns)
+        return cls(record_id, text, ts_ns, sys.intern(m.group(1)), int(m.group(2)), sys.intern(m.group(3)))
+
+    @classmethod
+    def from_json(cls, encoded):
+        """인코딩된 JSON 조각에서 복원 (공유 링을 읽는 웹 워커용, 수신 시각은 epoch 기준으로 환산)"""
+        d = json.loads(encoded)
+        ts_ns = round(d['ts'] * 1e9) - _WALL_OFFSET_NS
+        if 'data' in d:
+            return cls(d['id'], base64.b64decode(d['data']), ts_ns, encoded=encoded)
+        level, tag = d['level'], d['tag']
+        return cls(d['id'], d['text'], ts_ns, level and sys.intern(level), d['tick'], tag and sys.intern(tag), encoded)
+
+    @property
+    def timestamp(self):
+        """수신 시각 (epoch 초)"""
+        return (self.ts_ns + _WALL_OFFSET_NS) / 1e9
+
+    @property
+    def time(self):
+        return time.strftime("%H:%M:%S", time.localtime(self.timestamp))
+
+    def to_dict(self):
+        if isinstance(self.text, bytes):
+            return {"id": self.id, "data": base64.b64encode(self.text).decode('ascii'), "len": len(self.text),
+                    "time": self.time, "ts": round(self.timestamp, 6)}
+        return {"id": self.id, "text": self.text, "time": self.time, "ts": round(self.timestamp, 6),
+                "level": self.level, "tag": self.tag, "tick": self.tick}
+
+    @property
+    def json(self):
+        """JSON 인코딩 결과 (한 번만 인코딩 후 재사용)"""
+        if self._json is None:
+            self._json = json.dumps(self.to_dict(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return self._json
+
+def record_filter(levels=None, tags=None):
+    """level/tag 조건을 레코드 → bool 함수로 변환 (조건 없으면 None, 텍스트를 다시 스캔하지 않음)"""
+    levels = set(levels) if levels else None
+    tags = set(tags) if tags else None
+    if not levels and not tags:
+        return None
+    return lambda r: (levels is None or r.level in levels) and (tags is None or r.tag in tags)
+
+# --- 로그 링 버퍼 ---
+class LogRing:
+    """log_sequence 기반 링 버퍼: 커서 위치를 O(1)로 계산해 전체 스캔 없이 슬라이스 반환
+
+    줄마다 객체를 두지 않고 열(column) 배열에 저장하며, 조회 시에만 LogRecord로 만든다.
+    """
+
+    def __init__(self, capacity, start_id=0, blocks=None):
+        self.capacity = capacity
+        self.blocks = blocks          # 밀려난 줄의 압축 보관소 (LogBlocks, None이면 버림)
+        self.mirror = None            # 공유 메모리 링 (SharedLogWriter, 멀티 프로세스 서빙 시 수집 프로세스가 설정)
+        self._text = [None] * capacity
+        self._json = [None] * capacity                  # 수집 시 1회 인코딩한 JSON (응답에 그대로 이어 붙임)
+        self._ts = array('q', bytes(8 * capacity))      # 수신 시각 (monotonic ns)
+        self._tick = array('q', bytes(8 * capacity))    # 장치 tick (-1 = 없음)
+        self._level = bytearray(capacity)               # level 문자 코드 (0 = 없음)
+        self._tag = array('I', bytes(4 * capacity))     # _tag_names 인덱스 (0 = 없음)
+        self._tag_names = [None]
+        self._tag_codes = {}
+        self.last_id = start_id       # 마지막으로 추가된 로그 id (= log_sequence)
+        self.first_id = start_id + 1  # 버퍼에 남아있는 가장 오래된 로그 id
+        self.cond = threading.Condition(threading.RLock())  # 새 로그/연결 상태 변경 시 스트림 클라이언트 깨우기
+        self.level_counts = dict.fromkeys(LOG_LEVELS, 0)  # 누적 level별 줄 수
+        self.tag_counts = {}                               # 누적 tag별 줄 수
+        self.evicted = 0              # 용량 초과로 밀려난 누적 줄 수 (clear()는 제외)
+
+    def __len__(self):
+        return self.last_id - self.first_id + 1
+
+    def __iter__(self):
+        return iter(self.since(0)[0])
+
+    @property
+    def oldest_id(self):
+        """메모리(압축 블록 포함)에 남아있는 가장 오래된 로그 id"""
+        if self.blocks and self.blocks.first_id < self.first_id:
+            return self.blocks.first_id
+        return self.first_id
+
+    def append(self, text, ts_ns=None):
+        """로그 한 줄을 LogRecord로 파싱해 추가 후 대기 중인 스트림 클라이언트에 즉시 통지
+
+        밀려나는 줄은 압축 블록으로 넘기고, 블록이 차면 압축은 락을 놓은 뒤 수행 (리더·요청 쓰레드를 막지 않음)
+        """
+        seal = False
+        with self.cond:
+            self.last_id += 1
+            record = LogRecord.parse(self.last_id, text, ts_ns)
+            i = self.last_id % self.capacity
+            if self.blocks is not None and self.last_id - self.first_id >= self.capacity:
+                seal = self.blocks.add(self.first_id, self._json[i])
+            self._text[i] = record.text
+            self._json[i] = record.json
+            self._ts[i] = record.ts_ns
+            if record.level:
+                self.level_counts[record.level] += 1
+                self.tag_counts[record.tag] = self.tag_counts.get(record.tag, 0) + 1
+                code = self._tag_codes.get(record.tag)
+                if code is None:
+                    code = self._tag_codes[record.tag] = len(self._tag_names)
+                    self._tag_names.append(record.tag)
+                self._level[i] = ord(record.level)
+                self._tick[i] = record.tick
+                self._tag[i] = code
+            else:
+                self._level[i] = 0
+                self._tick[i] = -1
+                self._tag[i] = 0
+            if self.last_id - self.first_id >= self.capacity:
+                self.first_id = self.last_id - self.capacity + 1
+                self.evicted += 1
+            if self.mirror:
+                self.mirror.append(self.last_id, record.json)
+            self.cond.notify_all()
+        if seal:
+            self.blocks.seal()
+        return record
+
+    def clear(self):
+        """버퍼만 비우고 sequence는 유지 (클라이언트 커서 호환, 압축 보관소가 있으면 비운 줄은 그쪽으로 이동)"""
+        seal = False
+        with self.cond:
+            if self.blocks is not None:
+                for record_id in range(self.first_id, self.last_id + 1):
+                    seal = self.blocks.add(record_id, self._json[record_id % self.capacity]) or seal
+            self.first_id = self.last_id + 1
+            self._text = [None] * self.capacity
+            self._json = [None] * self.capacity
+            if self.mirror:
+                self.mirror.clear(self.last_id)
+        if seal:
+            self.blocks.seal()
+
+    def _record(self, record_id):
+        i = record_id % self.capacity
+        level = self._level[i]
+        if not level:
+            return LogRecord(record_id, self._text[i], self._ts[i], encoded=self._json[i])
+        return LogRecord(record_id, self._text[i], self._ts[i], LOG_LEVELS_BY_CODE[level],
+                         self._tick[i], self._tag_names[self._tag[i]], self._json[i])
+
+    def get(self, record_id):
+        """id로 레코드 조회 (버퍼에서 밀려났으면 None)"""
+        with self.cond:
+            if not self.first_id <= record_id <= self.last_id:
+                return None
+            return self._record(record_id)
+
+    def _range(self, last_id, limit, until=None):
+        """커서 이후 [start, end) id 범위와 gap (gap: 이미 밀려나 전달할 수 없는 id 범위 또는 None)
+
+        until을 주면 그 id까지만 (응답 상태를 먼저 찍어 둔 경우 그 사이 추가된 줄 제외)
+        """
+        head = self.last_id if until is None else min(self.last_id, until)
+        start = max(last_id + 1, self.first_id)
+        end = head + 1
+        if limit is not None:
+            end = min(end, start + max(limit, 0))
+        gap = None
+        if last_id + 1 < self.first_id and last_id < head:
+            gap = {"from_id": last_id + 1, "to_id": min(self.first_id, head + 1) - 1}
+        return start, max(start, end), gap
+
+    def since(self, last_id, limit=None, until=None):
+        """last_id 이후 (until 이하) 로그 목록과 gap 반환"""
+        with self.cond:
+            start, end, gap = self._range(last_id, limit, until)
+            return [self._record(record_id) for record_id in range(start, end)], gap
+
+    def encoded_since(self, last_id, limit=None, until=None):
+        """since()와 같지만 캐시된 JSON 조각, 마지막으로 포함된 id, gap 반환 (객체 생성 없이 응답 조립용)"""
+        with self.cond:
+            start, end, gap = self._range(last_id, limit, until)
+            if start == end:
+                return [], None, gap
+            i0, i1 = start % self.capacity, end % self.capacity
+            if i0 < i1:
+                return self._json[i0:i1], end - 1, gap
+            return self._json[i0:] + self._json[:i1], end - 1, gap
+
+    def history(self, from_id, to_id, limit=None):
+        """from_id~to_id 범위 로그 dict 목록 (링에서 밀려난 범위는 필요한 압축 블록만 풀어서 조회)"""
+        with self.cond:
+            ring_from = max(from_id, self.first_id)
+        cold = []
+        if self.blocks and from_id < ring_from:
+            cold = self.blocks.fragments(from_id, min(to_id, ring_from - 1), limit)
+        records, gap = self.since(ring_from - 1, None if limit is None else limit - len(cold))
+        if gap and self.blocks:
+            # 조회 사이에 링에서 블록으로 넘어간 줄
+            cold += self.blocks.fragments(gap['from_id'], min(to_id, gap['to_id']),
+                                          None if limit is None else limit - len(cold))
+            records = records[:None if limit is None else max(limit - len(cold), 0)]
+        return [json.loads(f) for f in cold] + [r.to_dict() for r in records if r.id <= to_id]
+
+# --- 압축 로그 블록 (메모리 장기 보관) ---
+class _LogBlock:
+    __slots__ = ('first_id', 'last_id', 'data', 'size')
+
+    def __init__(self, first_id, fragments):
+        self.first_id = first_id
+        self.last_id = first_id + len(fragments) - 1
+        self.data = fragments   # 봉인 전: JSON 조각 list, 봉인 후: zlib 압축 bytes
+        self.size = 0           # 압축 후 바이트 수
+
+class LogBlocks:
+    """링 버퍼에서 밀려난 줄의 JSON 조각을 block_lines줄씩 zlib 블록으로 봉인해 메모리에 보관
+
+    블록마다 id 범위만 인덱스로 두고(bisect), 조회 시 겹치는 블록만 풀어서 최근 cache_blocks개를 LRU로 유지.
+    add()는 링 락 안에서 리더가 호출하고, 압축(seal)은 링 락 밖에서 수행 (봉인 전 블록은 조각 list 그대로 조회)
+    """
+
+    def __init__(self, max_lines=MEMORY_RETAIN_LINES, block_lines=LOG_BLOCK_LINES, cache_blocks=LOG_BLOCK_CACHE,
+                 level=LOG_BLOCK_LEVEL):
+        self.max_lines = max_lines
+        self.block_lines = block_lines
+        self.cache_blocks = cache_blocks
+        self.level = level
+        self._blocks = []         # 오래된 순 _LogBlock
+        self._firsts = []         # 블록별 first_id (bisect 인덱스)
+        self._open = []           # 아직 블록이 되지 않은 최신 조각
+        self._open_first = None
+        self._cache = OrderedDict()   # first_id → 압축 해제한 조각 list
+        self._lock = threading.Lock()
+        self._seal_lock = threading.Lock()
+        self.compressed_bytes = 0
+
+    @property
+    def first_id(self):
+        with self._lock:
+            if self._blocks:
+                return self._blocks[0].first_id
+            return self._open_first if self._open_first is not None else float('inf')
+
+    def __len__(self):
+        with self._lock:
+            lines = len(self._open)
+            if self._blocks:
+                lines += self._blocks[-1].last_id - self._blocks[0].first_id + 1
+            return lines
+
+    def add(self, record_id, fragment):
+        """밀려난 줄 1개 추가 (id는 연속), 블록이 가득 차면 True (호출자가 락 밖에서 seal() 호출)"""
+        with self._lock:
+            if self._open_first is None:
+                self._open_first = record_id
+            self._open.append(fragment)
+            if len(self._open) < self.block_lines:
+                return False
+            block = _LogBlock(self._open_first, self._open)
+            self._blocks.append(block)
+            self._firsts.append(block.first_id)
+            self._open = []
+            self._open_first = block.last_id + 1
+            return True
+
+    def seal(self):
+        """봉인 전 블록을 압축하고 보관 한도를 넘은 오래된 블록 제거"""
+        with self._seal_lock:
+            with self._lock:
+                pending = [b for b in self._blocks if isinstance(b.data, list)]
+            for block in pending:
+                data = zlib.compress(b"\n".join(block.data), self.level)
+                with self._lock:
+                    block.data = data
+                    block.size = len(data)
+                    self.compressed_bytes += block.size
+            with self._lock:
+                while self._blocks and (self._open_first - self._blocks[0].first_id) > self.max_lines:
+                    dropped = self._blocks.pop(0)
+                    self._firsts.pop(0)
+                    self._cache.pop(dropped.first_id, None)
+                    self.compressed_bytes -= dropped.size
+
+    def _fragments_of(self, block):
+        """블록의 조각 list (압축된 블록은 LRU 캐시 경유로 해제)"""
+        with self._lock:
+            data = block.data
+            if isinstance(data, list):
+                return data
+            cached = self._cache.get(block.first_id)
+            if cached is not None:
+                self._cache.move_to_end(block.first_id)
+                return cached
+        fragments = zlib.decompress(data).split(b"\n")
+        with self._lock:
+            self._cache[block.first_id] = fragments
+            while len(self._cache) > self.cache_blocks:
+                self._cache.popitem(last=False)
+        return fragments
+
+    def fragments(self, from_id, to_id, limit=None):
+        """from_id~to_id 범위 JSON 조각 (겹치는 블록만 해제)"""
+        with self._lock:
+            start = max(bisect.bisect_right(self._firsts, from_id) - 1, 0)
+            blocks = self._blocks[start:]
+            open_first, open_tail = self._open_first, list(self._open)
+        out = []
+        for block in blocks:
+            if block.first_id > to_id or (limit is not None and len(out) >= limit):
+                return out[:limit] if limit is not None else out
+            if block.last_id < from_id:
+                continue
+            fragments = self._fragments_of(block)
+            out += fragments[max(from_id - block.first_id, 0):to_id - block.first_id + 1]
+        if open_tail and to_id >= open_first:
+            out += open_tail[max(from_id - open_first, 0):to_id - open_first + 1]
+        return out[:limit] if limit is not None else out
+
+# --- 줄 분리기 (Line Framer) ---
+class LineFramer:
+    """bytearray 기반 증분 줄 분리기: 새로 들어온 바이트만 스캔 (긴 무개행 출력에서도 선형 시간)"""
+
+    def __init__(self, max_line=MAX_LINE_BYTES, idle_flush=PARTIAL_FLUSH_SEC):
+        self.max_line = max_line
+        self.idle_flush = idle_flush
+        self.errors = 0  # FrameSplitter와 같은 인터페이스 (줄 분리는 버리는 입력이 없어 항상 0)
+        self._buf = bytearray()
+        self._last_data = 0.0
+
+    @property
+    def pending(self):
+        return len(self._buf)
+
+    def feed(self, chunk, now=None):
+        """청크를 추가하고 완성된 줄(개행 제외 bytes) 목록 반환"""
+        buf = self._buf
+        scan = len(buf)  # 기존 잔여분에는 개행이 없으므로 새 바이트만 스캔
+        buf += chunk
+        self._last_data = time.monotonic() if now is None else now
+        max_line = self.max_line
+        lines = []
+        start = 0
+        nl = buf.rfind(b"\n", scan)
+        with memoryview(buf) as view:
+            if nl >= 0:
+                # 완성된 구간은 C 레벨 split 한 번으로 분리
+                lines = bytes(view[:nl]).split(b"\n")
+                start = nl + 1
+                if max(map(len, lines)) > max_line:
+                    lines = [l[i:i + max_line] if l else l
+                             for l in lines for i in range(0, max(len(l), 1), max_line)]
+            # 개행 없이 최대 길이를 넘는 부분 줄은 max_line 단위로 잘라서 내보냄
+            while len(buf) - start > max_line:
+                lines.append(bytes(view[start:start + max_line]))
+                start += max_line
+        if start:
+            del buf[:start]
+        return lines
+
+    def idle_wait(self, now=None):
+        """부분 줄을 유휴 출력하기까지 남은 시간 (초, 부분 줄이 없으면 None) - 리더의 read 대기 상한"""
+        if not self._buf:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self._last_data + self.idle_flush - now)
+
+    def flush_idle(self, now=None):
+        """마지막 입력 후 idle_flush가 지난 부분 줄을 반환 (없으면 빈 목록)"""
+        if not self._buf:
+            return []
+        now = time.monotonic() if now is None else now
+        if now - self._last_data < self.idle_flush:
+            return []
+        return self.flush()
+
+    def flush(self):
+        """남은 부분 줄을 강제로 내보냄"""
+        if not self._buf:
+            return []
+        line = bytes(self._buf)
+        self._buf.clear()
+        return [line]
+
+# --- 공유 메모리 로그 링 (멀티 프로세스 서빙) ---
+SHM_MAGIC = b'ESPRING1'
+# 헤더 64바이트: magic, 슬롯 수, 데이터 영역 크기, last_id, first_id, 예약 위치, 기록 완료 위치, 연결 상태
+_SHM_HEADER = struct.Struct('<8sIIQQQQQ')
+_SHM_HEADER_SIZE = 64
+_SHM_LAST, _SHM_FIRST, _SHM_RESERVED, _SHM_COMMITTED, _SHM_CONNECTED = 16, 24, 32, 40, 48
+_SHM_SLOT = struct.Struct('<QQI4x')   # 슬롯: id, 데이터 위치(누적 바이트), 길이
+_SHM_POS_LEN = struct.Struct('<QI')
+_U64 = struct.Struct('<Q')
+
+class SharedLogWriter:
+    """수집 프로세스 쪽: LogRing에 추가된 레코드의 JSON 조각을 mmap 파일 링에 기록 (기록자는 리더 1개뿐)
+
+    데이터 영역은 누적 바이트 위치로 순환 기록. 덮어쓸 구간을 예약 위치로 먼저 공개하고, 슬롯은 id를 0으로
+    지운 뒤 위치·길이 → id 순으로 기록해 읽는 쪽이 도중에 바뀐 레코드를 알아챌 수 있게 함
+    """
+
+    def __init__(self, path, slots, data_bytes=SHM_RING_BYTES, start_id=0):
+        self.path = path
+        self.slots = slots
+        self.data_bytes = data_bytes
+        size = _SHM_HEADER_SIZE + slots * _SHM_SLOT.size + data_bytes
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            os.ftruncate(fd, size)
+            self._mm = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+        self._data = _SHM_HEADER_SIZE + slots * _SHM_SLOT.size
+        self.first_id = start_id + 1
+        self.pos = 0
+        _SHM_HEADER.pack_into(self._mm, 0, SHM_MAGIC, slots, data_bytes, start_id, start_id + 1, 0, 0, 0)
+
+    def _slot(self, record_id):
+        return _SHM_HEADER_SIZE + (record_id % self.slots) * _SHM_SLOT.size
+
+    def append(self, record_id, fragment):
+        mm, size, n = self._mm, self.data_bytes, len(fragment)
+        end = self.pos + n
+        _U64.pack_into(mm, _SHM_RESERVED, end)
+        start = self._data + self.pos % size
+        head = min(n, self._data + size - start)
+        mm[start:start + head] = fragment[:head]
+        if head < n:
+            mm[self._data:self._data + n - head] = fragment[head:]
+        slot = self._slot(record_id)
+        _U64.pack_into(mm, slot, 0)
+        _SHM_POS_LEN.pack_into(mm, slot + 8, self.pos, n)
+        _U64.pack_into(mm, slot, record_id)
+        self.pos = end
+        # 슬롯이 재사용됐거나 데이터가 덮인 오래된 id는 버퍼에서 제외
+        first_id = max(self.first_id, record_id - self.slots + 1)
+        while first_id < record_id:
+            sid, spos, _ = _SHM_SLOT.unpack_from(mm, self._slot(first_id))
+            if sid == first_id and spos >= end - size:
+                break
+            first_id += 1
+        self.first_id = first_id
+        _U64.pack_into(mm, _SHM_COMMITTED, end)
+        _U64.pack_into(mm, _SHM_FIRST, first_id)
+        _U64.pack_into(mm, _SHM_LAST, record_id)
+
+    def clear(self, last_id):
+        """LogRing.clear()와 같이 버퍼만 비움 (sequence 유지)"""
+        self.first_id = last_id + 1
+        _U64.pack_into(self._mm, _SHM_FIRST, self.first_id)
+
+    def set_connected(self, connected):
+        _U64.pack_into(self._mm, _SHM_CONNECTED, int(connected))
+
+    def close(self):
+        self._mm.close()
+
+class SharedLogRing:
+    """웹 워커 쪽: 수집 프로세스의 공유 링을 락 없이 읽는 LogRing 호환 뷰 (last_id/first_id/since/encoded_since)
+
+    조각을 복사한 뒤 슬롯 id와 예약 위치를 다시 확인해, 읽는 도중 덮어쓴 레코드는 밀려난 것으로 처리 (seqlock 방식)
+    """
+
+    blocks = None
+    evicted = 0
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.capacity, self.data_bytes = struct.unpack_from('<8sII', self._mm)
+        if magic != SHM_MAGIC:
+            raise ValueError(f"not a shared log ring: {path}")
+        self._data = _SHM_HEADER_SIZE + self.capacity * _SHM_SLOT.size
+        self.cond = threading.Condition(threading.RLock())  # 이 프로세스의 스트림 대기용 (shared_watcher가 통지)
+
+    @property
+    def last_id(self):
+        return _U64.unpack_from(self._mm, _SHM_LAST)[0]
+
+    @property
+    def first_id(self):
+        return _U64.unpack_from(self._mm, _SHM_FIRST)[0]
+
+    @property
+    def connected(self):
+        return bool(_U64.unpack_from(self._mm, _SHM_CONNECTED)[0])
+
+    def __len__(self):
+        last_id = self.last_id
+        return max(last_id - self.first_id + 1, 0)
+
+    def __iter__(self):
+        return iter(self.since(0)[0])
+
+    def _read(self, start, end):
+        """[start, end) 조각 목록과 실제로 읽은 첫 id (도중에 덮인 앞부분은 제외)"""
+        mm, size, data = self._mm, self.data_bytes, self._data
+        fragments, positions = [], []
+        first = start
+        for record_id in range(start, end):
+            slot = _SHM_HEADER_SIZE + (record_id % self.capacity) * _SHM_SLOT.size
+            sid, pos, n = _SHM_SLOT.unpack_from(mm, slot)
+            if sid == record_id:
+                a = data + pos % size
+                if a + n <= data + size:
+                    fragment = mm[a:a + n]
+                else:
+                    fragment = mm[a:data + size] + mm[data:data + n - (data + size - a)]
+                if _U64.unpack_from(mm, slot)[0] == record_id:
+                    fragments.append(fragment)
+                    positions.append(pos)
+                    continue
+            # 슬롯이 재사용된 레코드: 그보다 오래된 레코드도 모두 밀려남
+            fragments, positions = [], []
+            first = record_id + 1
+        drop = bisect.bisect_left(positions, _U64.unpack_from(mm, _SHM_RESERVED)[0] - size)
+        return fragments[drop:], first + drop
+
+    def encoded_since(self, last_id, limit=None, until=None):
+        """LogRing.encoded_since()와 같음: (JSON 조각 목록, 마지막으로 포함된 id, gap)"""
+        head = self.last_id if until is None else min(self.last_id, until)
+        start = max(last_id + 1, self.first_id)
+        end = head + 1 if limit is None else min(head + 1, start + max(limit, 0))
+        fragments, first = self._read(start, max(start, end))
+        gap = None
+        if last_id + 1 < first and last_id < head:
+            gap = {"from_id": last_id + 1, "to_id": min(first, head + 1) - 1}
+        return fragments, (first + len(fragments) - 1 if fragments else None), gap
+
+    def since(self, last_id, limit=None, until=None):
+        fragments, _, gap = self.encoded_since(last_id, limit, until)
+        return [LogRecord.from_json(f) for f in fragments], gap
+
+    def get(self, record_id):
+        records, _ = self.since(record_id - 1, 1)
+        return records[0] if records and records[0].id == record_id else None
+
+# --- 바이너리 프레임 분리기 (SLIP/COBS) ---
+FRAMING_MODES = ('text', 'slip', 'cobs')
+
+def slip_encode(data):
+    """SLIP 인코딩 (ESC → ESC ESC_ESC, END → ESC ESC_END, 끝에 END)"""
+    return data.replace(b'\xdb', b'\xdb\xdd').replace(b'\xc0', b'\xdb\xdc') + b'\xc0'
+
+def slip_decode(frame):
+    """SLIP 이스케이프 해제 (C 레벨 replace 두 번, 바이트 단위 Python 루프 없음)"""
+    if b'\xdb' not in frame:
+        return frame
+    return frame.replace(b'\xdb\xdc', b'\xc0').replace(b'\xdb\xdd', b'\xdb')
+
+def cobs_encode(data):
+    """COBS 인코딩 (0x00 구분자 포함)"""
+    out = bytearray()
+    for block in data.split(b'\x00'):
+        while len(block) >= 254:
+            out.append(0xFF)
+            out += block[:254]
+            block = block[254:]
+        out.append(len(block) + 1)
+        out += block
+    out.append(0)
+    return bytes(out)
+
+def cobs_decode(frame):
+    """COBS 디코딩: code 블록 단위로 memoryview 슬라이스 복사 (0x00 한 개당 1회 반복, 잘못된 프레임은 ValueError)"""
+    n = len(frame)
+    if frame[0] == n:
+        return frame[1:]  # 0x00이 없는 254바이트 이하 프레임
+    out = bytearray()
+    i = 0
+    with memoryview(frame) as view:
+        while i < n:
+            code = frame[i]
+            end = i + code
+            if code == 0 or end > n:
+                raise ValueError("invalid COBS frame")
+            out += view[i + 1:end]
+            i = end
+            if code != 0xFF and i < n:
+                out.append(0)
+    return bytes(out)
+
+class FrameSplitter:
+    """구분 바이트 기준 바이너리 프레임 분리기 (LineFramer와 같은 인터페이스, 프레임은 디코딩된 bytes)
+
+    SLIP은 END(0xC0), COBS는 0x00으로 구분. 새로 들어온 바이트에서 마지막 구분자만 찾고 완성 구간은
+    C 레벨 split 한 번으로 나눔. 깨진 프레임은 버리고 errors로 집계 (다음 구분자에서 다시 동기화)
+    """
+
+    def __init__(self, framing, max_frame=MAX_FRAME_BYTES):
+        if framing not in ('slip', 'cobs'):
+            raise ValueError(f"unknown binary framing: {framing}")
+        self.delimiter = b'\xc0' if framing == 'slip' else b'\x00'
+        self.decode = slip_decode if framing == 'slip' else cobs_decode
+        self.max_frame = max_frame
+        self.errors = 0
+        self._buf = bytearray()
+
+    @property
+    def pending(self):
+        return len(self._buf)
+
+    def feed(self, chunk, now=None):
+        """청크를 추가하고 완성된 프레임(디코딩된 bytes) 목록 반환"""
+        buf = self._buf
+        scan = len(buf)
+        buf += chunk
+        end = buf.rfind(self.delimiter, scan)
+        if end < 0:
+            if len(buf) > self.max_frame:
+                self.errors += 1
+                buf.clear()
+            return []
+        with memoryview(buf) as view:
+            parts = bytes(view[:end]).split(self.delimiter)
+        del buf[:end + 1]
+        frames = []
+        decode = self.decode
+        for part in parts:
+            if not part:
+                continue  # 연속 구분자 (SLIP 송신측은 프레임 앞에도 END를 보내 잡음을 끊음)
+            if len(part) > self.max_frame:
+                self.errors += 1
+                continue
             try:
-                with serial.Serial(path, BAUD_RATE, timeout=0.1) as probe:
+                frames.append(decode(part))
+            except ValueError:
+                self.errors += 1
+        return frames
+
+    def idle_wait(self, now=None):
+        return None
+
+    def flush_idle(self, now=None):
+        """바이너리 프레임은 구분자 전까지 완성되지 않으므로 유휴 시에도 내보내지 않음"""
+        return []
+
+    def flush(self):
+        """연결 종료 시 남은 미완성 프레임은 버림"""
+        self._buf.clear()
+        return []
+
+FRAME_HEADER = struct.Struct('<QqI')  # /api/frames 레코드 헤더: id, 수신 시각(epoch ns), 길이
+
+def make_framer(framing):
+    """장치 프레이밍 모드에 맞는 분리기 ('text'는 줄 단위, 'slip'/'cobs'는 바이너리 프레임)"""
+    return LineFramer() if framing == 'text' else FrameSplitter(framing)
+
+# --- 로그 검색 ---
+_REGEX_QUANTIFIERS = '?*{'
+_BRACE_QUANTIFIER_RE = re.compile(r'\{\d*(?:,\d*)?\}')
+# 코드 이스케이프 뒤의 인자 (\x41, \u0041, \U0001F600, \N{NAME}, 8진수·역참조 숫자) - 리터럴이 아님
+_ESCAPE_ARG_RES = {
+    'x': re.compile(r'[0-9a-fA-F]{0,2}'),
+    'u': re.compile(r'[0-9a-fA-F]{0,4}'),
+    'U': re.compile(r'[0-9a-fA-F]{0,8}'),
+    'N': re.compile(r'\{[^}]*\}?'),
+}
+_ESCAPE_DIGITS_RE = re.compile(r'[0-9]{0,2}')
+
+def _class_end(pattern, i):
+    """pattern[i]의 '['로 시작하는 문자 클래스 다음 위치 (맨 앞 ']'·'^]'와 '\\' 이스케이프는 클래스 안의 문자, 닫히지 않으면 None)"""
+    j = i + 1
+    if j < len(pattern) and pattern[j] == '^':
+        j += 1
+    if j < len(pattern) and pattern[j] == ']':
+        j += 1
+    while j < len(pattern):
+        if pattern[j] == '\\':
+            j += 2
+        elif pattern[j] == ']':
+            return j + 1
+        else:
+            j += 1
+    return None
+
+def _regex_literals(pattern):
+    """정규식에서 반드시 포함되는 리터럴 조각 추출 (트라이그램 사전 필터용, 판단이 어려우면 빈 목록)"""
+    if any(c in pattern for c in '|()'):
+        return []
+    literals, run, i = [], [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            nxt = pattern[i + 1]
+            i += 2
+            if nxt.isalnum():  # \d, \w, \b 등 문자 클래스/앵커, \x41·\N{...}·8진수 등은 인자까지 건너뜀
+                arg_re = _ESCAPE_ARG_RES.get(nxt) or (_ESCAPE_DIGITS_RE if nxt.isdigit() else None)
+                if arg_re:
+                    i = arg_re.match(pattern, i).end()
+                literals.append(''.join(run))
+                run = []
+                continue
+            c = nxt
+        elif c == '[':
+            literals.append(''.join(run))
+            run = []
+            i = _class_end(pattern, i)
+            if i is None:
+                return []
+            continue
+        elif c in '.^$+' + _REGEX_QUANTIFIERS:
+            if c in _REGEX_QUANTIFIERS and run:
+                run.pop()  # 수량자가 붙은 문자는 없을 수도 있음 ({0,n} 포함)
+            literals.append(''.join(run))
+            run = []
+            brace = _BRACE_QUANTIFIER_RE.match(pattern, i) if c == '{' else None
+            i = brace.end() if brace else i + 1  # {m,n} 안의 숫자는 리터럴이 아님
+            continue
+        else:
+            i += 1
+        if i < len(pattern) and pattern[i] in _REGEX_QUANTIFIERS:
+            literals.append(''.join(run))
+            run = []
+            continue
+        run.append(c)
+    literals.append(''.join(run))
+    return [l for l in literals if len(l) >= 3]
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+def compile_matcher(query, regex=False, ignore_case=True):
+    """검색어를 text → bool 함수로 변환 (정규식 오류 시 re.error)"""
+    if regex:
+        return re.compile(query, re.IGNORECASE if ignore_case else 0).search
+    if ignore_case:
+        query = query.lower()
+        return lambda text: query in text.lower()
+    return lambda text: query in text
+
+class SearchIndex:
+    """링 버퍼 로그의 증분 트라이그램 인덱스 (줄 추가 시 갱신, 밀려난 id는 주기적으로 정리)"""
+
+    def __init__(self, ring):
+        self.ring = ring
+        self.lock = threading.Lock()
+        self._postings = {}       # 소문자 트라이그램 → 해당 줄 id 배열 (오름차순)
+        self._times = array('d')  # id별 수신 시각 (epoch), _times_base부터 연속
+        self._times_base = ring.last_id + 1
+        self._since_compact = 0
+
+    def add(self, record):
+        record_id = record.id
+        grams = _trigrams(record.text.lower())
+        with self.lock:
+            postings = self._postings
+            for gram in grams:
+                ids = postings.get(gram)
+                if ids is None:
+                    ids = postings[gram] = array('Q')
+                ids.append(record_id)
+            if not self._times:
+                self._times_base = record_id
+            self._times.append(record.timestamp)
+            self._since_compact += 1
+            if self._since_compact >= self.ring.capacity:
+                self._compact()
+
+    def _compact(self):
+        """링 버퍼에서 밀려난 id를 인덱스에서 제거 (capacity마다 1회, 추가 비용 분산)"""
+        first = self.ring.first_id
+        for gram, ids in list(self._postings.items()):
+            cut = bisect.bisect_left(ids, first)
+            if cut == len(ids):
+                del self._postings[gram]
+            elif cut:
+                del ids[:cut]
+        cut = first - self._times_base
+        if cut > 0:
+            del self._times[:cut]
+            self._times_base = first
+        self._since_compact = 0
+
+    def _id_range(self, from_id, to_id, since, until):
+        """id/시간 조건을 링 버퍼 안의 id 범위로 변환 (시간은 수신 시각 이분 탐색)"""
+        lo = max(self.ring.first_id, from_id or 0)
+        hi = min(self.ring.last_id, to_id if to_id is not None else self.ring.last_id)
+        with self.lock:
+            base, times = self._times_base, self._times
+            if since is not None:
+                lo = max(lo, base + bisect.bisect_left(times, since))
+            if until is not None:
+                hi = min(hi, base + bisect.bisect_right(times, until) - 1)
+        return lo, hi
+
+    def candidates(self, literals, lo, hi):
+        """리터럴 트라이그램 포스팅 교집합으로 후보 id 목록 (사전 필터 불가 시 범위 전체)"""
+        grams = set()
+        for literal in literals:
+            grams |= _trigrams(literal.lower())
+        if not grams:
+            return range(lo, hi + 1)
+        with self.lock:
+            slices = []
+            for gram in grams:
+                ids = self._postings.get(gram)
+                if ids is None:
+                    return []
+                slices.append(ids[bisect.bisect_left(ids, lo):bisect.bisect_right(ids, hi)])
+        slices.sort(key=len)
+        smallest, others = slices[0], slices[1:]
+        result = []
+        for record_id in smallest:
+            for ids in others:
+                pos = bisect.bisect_left(ids, record_id)
+                if pos == len(ids) or ids[pos] != record_id:
+                    break
+            else:
+                result.append(record_id)
+        return result
+
+    def search(self, query, regex=False, ignore_case=True, from_id=None, to_id=None,
+               since=None, until=None, limit=100, context=0):
+        """검색 결과 (일치 줄 + 앞뒤 context줄) 와 추가 결과 유무 반환"""
+        matcher = compile_matcher(query, regex, ignore_case)
+        literals = _regex_literals(query) if regex else [query]
+        lo, hi = self._id_range(from_id, to_id, since, until)
+        matches = []
+        for record_id in self.candidates(literals, lo, hi):
+            record = self.ring.get(record_id)
+            if record is None or not matcher(record.text):
+                continue
+            if len(matches) >= limit:
+                return matches, True
+            match = record.to_dict()
+            if context:
+                match["before"] = [r.to_dict() for r in map(self.ring.get, range(record_id - context, record_id)) if r]
+                match["after"] = [r.to_dict() for r in map(self.ring.get, range(record_id + 1, record_id + context + 1)) if r]
+            matches.append(match)
+        return matches, False
+
+# --- 수치 시계열 (로그 줄 → 지표 추출) ---
+_SERIES_GROUP_RE = re.compile(r'\([^()]*\)[?*+]?')  # 가장 안쪽 그룹 (필수 리터럴 추출 시 임의 문자로 대체)
+
+class SeriesTier:
+    """고정 폭 버킷의 min/max/sum/count 링 (버킷 번호 % 크기 위치에 기록, 크기만큼 지난 버킷은 덮어씀)"""
+
+    __slots__ = ('step_ns', 'size', 'buckets', 'mins', 'maxs', 'sums', 'counts')
+
+    def __init__(self, step_sec, size):
+        self.step_ns = int(step_sec * 1_000_000_000)
+        self.size = size
+        self.buckets = array('q', [-1]) * size   # 슬롯에 들어 있는 버킷 번호 (ts_ns // step_ns)
+        self.mins = array('d', [0.0]) * size
+        self.maxs = array('d', [0.0]) * size
+        self.sums = array('d', [0.0]) * size
+        self.counts = array('Q', [0]) * size
+
+    @property
+    def span_ns(self):
+        return self.step_ns * self.size
+
+    def add(self, ts_ns, value):
+        n = ts_ns // self.step_ns
+        i = n % self.size
+        if self.buckets[i] != n:
+            self.buckets[i] = n
+            self.mins[i] = self.maxs[i] = self.sums[i] = value
+            self.counts[i] = 1
+            return
+        if value < self.mins[i]:
+            self.mins[i] = value
+        elif value > self.maxs[i]:
+            self.maxs[i] = value
+        self.sums[i] += value
+        self.counts[i] += 1
+
+    def fold(self, lo_ns, hi_ns, origin_ns, step_ns, out):
+        """[lo_ns, hi_ns) 버킷을 step_ns(이 단계 폭의 배수) 폭 출력 버킷 out[k] = [min, max, sum, count]에 합침"""
+        last = (hi_ns - 1) // self.step_ns
+        for n in range(max(lo_ns // self.step_ns, last - self.size + 1), last + 1):
+            i = n % self.size
+            if self.buckets[i] != n:
+                continue
+            _merge_bucket(out, (n * self.step_ns - origin_ns) // step_ns,
+                          self.mins[i], self.maxs[i], self.sums[i], self.counts[i])
+
+def _merge_bucket(out, k, low, high, total, count):
+    acc = out.get(k)
+    if acc is None:
+        out[k] = [low, high, total, count]
+        return
+    if low < acc[0]:
+        acc[0] = low
+    if high > acc[1]:
+        acc[1] = high
+    acc[2] += total
+    acc[3] += count
+
+class MetricSeries:
+    """시계열 1개: 원본 점 링 + 해상도별 사전 집계 (추가는 단계 수만큼 O(1), 조회는 구간에 걸친 집계 버킷만 읽음)"""
+
+    def __init__(self, name, points=SERIES_POINTS, tiers=SERIES_TIERS):
+        self.name = name
+        self.times = array('q', [0]) * points    # epoch ns
+        self.values = array('d', [0.0]) * points
+        self.count = 0                           # 누적 점 수 (count % points가 다음 기록 위치)
+        self.first_ns = None                     # 첫 점의 시각 (이보다 오래된 구간은 보관 여부와 무관하게 비어 있음)
+        self.tiers = [SeriesTier(step, size) for step, size in tiers]
+
+    def add(self, ts_ns, value):
+        if self.first_ns is None:
+            self.first_ns = ts_ns
+        i = self.count % len(self.times)
+        self.times[i] = ts_ns
+        self.values[i] = value
+        self.count += 1
+        for tier in self.tiers:
+            tier.add(ts_ns, value)
+
+    @property
+    def first_raw_ns(self):
+        """원본 점 링에 남아 있는 가장 오래된 점의 시각"""
+        return self.times[max(self.count - len(self.times), 0) % len(self.times)]
+
+    def info(self):
+        i = (self.count - 1) % len(self.times)
+        return {"name": self.name, "count": self.count, "last": self.values[i], "last_ts": self.times[i] / 1e9}
+
+    def _fold_raw(self, lo_ns, hi_ns, origin_ns, step_ns, out):
+        size = len(self.times)
+        start = max(self.count - size, 0)
+        times, values = self.times, self.values
+        j = start + bisect.bisect_left(range(start, self.count), lo_ns, key=lambda j: times[j % size])
+        while j < self.count:
+            ts = times[j % size]
+            if ts >= hi_ns:
+                break
+            value = values[j % size]
+            _merge_bucket(out, (ts - origin_ns) // step_ns, value, value, value, 1)
+            j += 1
+
+    def downsample(self, since_ns, until_ns, points):
+        """[since, until) 구간을 최대 약 points개 버킷의 min/max/avg로 요약
+
+        요청 버킷 폭 이하이면서 구간 시작까지 보관 중인 가장 굵은 사전 집계 단계를 사용하고,
+        요청 폭이 가장 촘촘한 단계보다 짧으면 원본 점, 구간이 어떤 단계의 보관 기간보다 길면 보관 기간이 긴 단계로 대체
+        """
+        want = max(-(-(until_ns - since_ns) // points), 1)
+        latest = self.times[(self.count - 1) % len(self.times)]
+        horizon = max(since_ns, self.first_ns)
+        covering = [t for t in self.tiers if latest - t.span_ns < horizon] or self.tiers[-1:]
+        finer = [t for t in covering if t.step_ns <= want]
+        out = {}
+        if not self.tiers or (want < self.tiers[0].step_ns and self.first_raw_ns <= horizon):
+            source, step_ns, origin_ns = 'raw', want, since_ns
+            self._fold_raw(since_ns, until_ns, origin_ns, step_ns, out)
+        else:
+            tier = finer[-1] if finer else covering[0]
+            source = f"{tier.step_ns // 1_000_000_000}s"
+            step_ns = tier.step_ns * -(-want // tier.step_ns)
+            origin_ns = since_ns - since_ns % tier.step_ns
+            tier.fold(since_ns, until_ns, origin_ns, step_ns, out)
+        columns = {"ts": [], "min": [], "max": [], "avg": [], "count": []}
+        for k in sorted(out):
+            low, high, total, count = out[k]
+            columns["ts"].append((origin_ns + k * step_ns) / 1e9)
+            columns["min"].append(low)
+            columns["max"].append(high)
+            columns["avg"].append(total / count)
+            columns["count"].append(count)
+        return dict(name=self.name, since=since_ns / 1e9, until=until_ns / 1e9, step=step_ns / 1e9,
+                    source=source, **columns)
+
+class SeriesExtractor:
+    """추출 규칙(이름 있는 숫자 그룹 정규식)을 수신 줄마다 적용해 장치별 시계열에 기록
+
+    규칙마다 반드시 포함되는 리터럴을 뽑아 두고, 줄에 그 리터럴이 없으면 정규식을 실행하지 않음
+    """
+
+    def __init__(self, rules=SERIES_RULES, points=SERIES_POINTS, tiers=SERIES_TIERS):
+        self.rules = []
+        self.series = {}
+        self.points = points
+        self.tiers = tiers
+        self.lock = threading.Lock()  # 리더 쓰레드의 기록과 조회 요청 사이 (집계 버킷 갱신은 짧게 잡음)
+        for pattern in rules:
+            compiled = re.compile(pattern)
+            if not compiled.groupindex:
+                raise ValueError(f"series rule needs a named group: {pattern}")
+            literals = []
+            if not compiled.flags & re.IGNORECASE:
+                stripped, n = pattern, 1
+                while n:
+                    stripped, n = _SERIES_GROUP_RE.subn('.', stripped)
+                literals = _regex_literals(stripped)
+            self.rules.append((compiled.search, max(literals, key=len) if literals else None))
+
+    def add(self, record):
+        text = record.text
+        for search, literal in self.rules:
+            if literal is not None and literal not in text:
+                continue
+            m = search(text)
+            if m is None:
+                continue
+            ts_ns = record.ts_ns + _WALL_OFFSET_NS
+            for name, raw in m.groupdict().items():
+                try:
+                    value = float(raw)
+                except (TypeError, ValueError):
+                    continue  # 매칭되지 않은 선택 그룹, 숫자가 아닌 값
+                with self.lock:
+                    series = self.series.get(name)
+                    if series is None:
+                        series = self.series[name] = MetricSeries(name, self.points, self.tiers)
+                    series.add(ts_ns, value)
+
+    def names(self):
+        with self.lock:
+            return [series.info() for series in self.series.values()]
+
+    def query(self, name, since=None, until=None, points=300):
+        """since/until(epoch 초, 기본 최근 1시간) 구간 요약 (없는 시계열이면 None)"""
+        until_ns = int(until * 1e9) if until is not None else time.time_ns()
+        since_ns = int(since * 1e9) if since is not None else until_ns - 3600 * 1_000_000_000
+        if since_ns >= until_ns:
+            raise ValueError("since must be earlier than until")
+        with self.lock:
+            series = self.series.get(name)
+            if series is None:
+                return None
+            return series.downsample(since_ns, until_ns, max(1, points))
+
+# --- 패턴 대기 (expect) ---
+_BACKREF_RE = re.compile(r'\\[1-9]|\(\?P=')                  # 합친 정규식에서는 그룹 번호가 바뀌어 쓸 수 없음
+_GLOBAL_FLAGS_RE = re.compile(r'\(\?([aiLmsux]+)\)')          # 맨 앞 (?i) 등은 (?i:...)로 범위를 좁혀 합침
+_NAMED_GROUP_RE = re.compile(r'\(\?P<\w+>')                  # 이름 충돌 방지 (합친 정규식은 매칭 여부만 확인)
+
+class _ExpectPattern:
+    __slots__ = ('compiled', 'part', 'refs')
+
+    def __init__(self, pattern):
+        self.compiled = re.compile(pattern)
+        self.refs = 0
+        self.part = None  # 합친 정규식에 들어갈 형태 (None이면 따로 검사)
+        if _BACKREF_RE.search(pattern):
+            return
+        flags = _GLOBAL_FLAGS_RE.match(pattern)
+        body = _NAMED_GROUP_RE.sub('(?:', pattern[flags.end():] if flags else pattern)
+        part = f"(?{flags.group(1)}:{body})" if flags else f"(?:{body})"
+        try:
+            re.compile(part)
+        except re.error:
+            return
+        self.part = part
+
+class ExpectWait:
+    """after_id 이후 줄에서 패턴 목록 중 하나(all=True면 전부)가 나타나기를 기다리는 요청 1개"""
+
+    def __init__(self, patterns, compiled, after_id, need_all=False):
+        self.patterns = patterns
+        self.compiled = compiled
+        self.after_id = after_id
+        self.need_all = need_all
+        self.matches = [None] * len(patterns)  # 패턴별 가장 이른 매칭
+        self.event = threading.Event()
+        self.active = True
+        self._async = None  # (이벤트 루프, Future) - ASGI 대기자
+
+    def offer(self, index, record_id, m, text, ts):
+        """매칭 기록 (ExpectHub.lock 안에서 호출, 같은 패턴은 id가 더 이른 매칭만 남김)"""
+        current = self.matches[index]
+        if current is not None and current['id'] <= record_id:
+            return
+        self.matches[index] = {"index": index, "pattern": self.patterns[index], "id": record_id, "text": text,
+                               "ts": round(ts, 6), "groups": list(m.groups()), "named": m.groupdict()}
+        if self.done() and not self.event.is_set():
+            self.event.set()
+            if self._async:
+                loop, future = self._async
+                try:
+                    loop.call_soon_threadsafe(_resolve_future, future)
+                except RuntimeError:  # 루프 종료됨
                     pass
-                return path
-            except Exception:
+
+    def done(self):
+        if self.need_all:
+            return all(m is not None for m in self.matches)
+        return any(m is not None for m in self.matches)
+
+    async def wait_async(self, timeout):
+        """쓰레드 없이 대기 (리더 쓰레드의 offer()가 call_soon_threadsafe로 깨움)"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._async = (loop, future)
+        if self.event.is_set():
+            return True
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        return self.event.is_set()
+
+    def result(self):
+        found = [m for m in self.matches if m is not None]
+        matched = self.done()
+        first = min(found, key=lambda m: (m['id'], m['index'])) if found and not self.need_all else None
+        return {"matched": matched, "timeout": not matched, "match": first if matched else None,
+                "matches": self.matches}
+
+def _resolve_future(future):
+    if not future.done():
+        future.set_result(None)
+
+class ExpectHub:
+    """장치별 활성 expect 대기 목록 + 모든 패턴을 하나로 합친 정규식 (대기가 수백 개여도 줄마다 검사 1번)
+
+    합친 정규식에 걸린 줄만 패턴별로 다시 검사해 해당 대기를 찾음, 역참조가 있는 패턴만 따로 검사
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waits = []
+        self.patterns = {}     # 패턴 문자열 → _ExpectPattern (대기들이 공유, refs로 사용 수 관리)
+        self.combined = None
+        self.solo = []
+        self.fed_id = 0        # 마지막으로 검사한 줄 id
+        self._dirty = False    # 새 패턴이 추가되어 다음 feed()에서 합친 정규식을 다시 만들어야 함
+        self._stale = 0        # 해제됐지만 합친 정규식에 남아 있는 패턴 수 (걸러낼 뿐 결과는 같으므로 쌓일 때만 다시 만듦)
+
+    def register(self, patterns, after_id, need_all=False):
+        """대기 등록 (잘못된 정규식은 re.error, 등록 전에 컴파일하므로 락을 오래 잡지 않음)"""
+        fresh = {p: _ExpectPattern(p) for p in set(patterns) if p not in self.patterns}
+        with self.lock:
+            entries = []
+            for p in patterns:
+                entry = self.patterns.get(p)
+                if entry is None:
+                    entry = self.patterns[p] = fresh.get(p) or _ExpectPattern(p)  # 컴파일 후 다른 대기가 해제한 경우
+                    self._dirty = True
+                entry.refs += 1
+                entries.append(entry)
+            wait = ExpectWait(list(patterns), [e.compiled for e in entries], after_id, need_all)
+            self.waits.append(wait)
+        return wait
+
+    def _release(self, wait):
+        wait.active = False
+        self.waits.remove(wait)
+        for p in wait.patterns:
+            entry = self.patterns[p]
+            entry.refs -= 1
+            if not entry.refs:
+                del self.patterns[p]
+                self._stale += 1
+
+    def cancel(self, wait):
+        with self.lock:
+            if wait.active:
+                self._release(wait)
+
+    def _rebuild(self):
+        self._dirty = False
+        self._stale = 0
+        parts = [e.part for e in self.patterns.values() if e.part is not None]
+        self.solo = [p for p, e in self.patterns.items() if e.part is None]
+        self.combined = re.compile('|'.join(parts)).search if parts else None
+
+    def feed(self, record):
+        """새 줄 검사 (리더 쓰레드, 대기가 없으면 호출하지 않음)"""
+        text = record.text
+        with self.lock:
+            self.fed_id = record.id
+            if self._dirty or self._stale > len(self.patterns):
+                self._rebuild()
+            combined_hit = self.combined is not None and self.combined(text) is not None
+            if not combined_hit and not self.solo:
+                return
+            hits = {}
+            for wait in list(self.waits):
+                if record.id <= wait.after_id:
+                    continue
+                for index, p in enumerate(wait.patterns):
+                    m = hits.get(p, False)
+                    if m is False:
+                        entry = self.patterns[p]
+                        m = hits[p] = entry.compiled.search(text) if combined_hit or entry.part is None else None
+                    if m is not None:
+                        wait.offer(index, record.id, m, text, record.timestamp)
+                if wait.event.is_set():
+                    self._release(wait)
+
+    def scan(self, wait, lines):
+        """등록 전에 이미 수신된 (id, text, 수신 epoch 초) 줄 검사 (요청 쓰레드)"""
+        for record_id, text, ts in lines:
+            if record_id <= wait.after_id:
                 continue
+            for index, compiled in enumerate(wait.compiled):
+                m = compiled.search(text)
+                if m is not None:
+                    with self.lock:
+                        wait.offer(index, record_id, m, text, ts)
+
+# --- 디스크 로그 저장소 ---
+class LogStore:
+    """장치별 append-only 세그먼트 로그 파일 (배치 쓰기, 희소 sequence→offset 인덱스, mmap 읽기)
+
+    세그먼트는 '<첫 id>.log' (JSON 한 줄당 레코드 1개), 인덱스는 '<첫 id>.idx' (id, offset 쌍)로 저장.
+    """
+
+    _INDEX_ENTRY = struct.Struct('<QQ')
+
+    def __init__(self, path, segment_bytes=STORE_SEGMENT_BYTES, max_bytes=STORE_MAX_BYTES,
+                 max_age=STORE_MAX_AGE_SEC, index_interval=STORE_INDEX_INTERVAL):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.index_interval = index_interval
+        self.lock = threading.Lock()        # 대기열·세그먼트 메타데이터 (짧게만 잡음)
+        self.write_lock = threading.Lock()  # 파일 기록·보존 정책 직렬화 (write/fsync는 self.lock 밖에서)
+        self.last_id = 0
+        self._pending = []        # (id, 인코딩된 줄) - flush 시 한 번에 기록
+        self._pending_bytes = 0
+        self._firsts = []         # 세그먼트 첫 id 목록 (정렬)
+        self._index = {}          # 첫 id → ([id...], [offset...]) 희소 인덱스
+        self._sizes = {}          # 첫 id → 세그먼트 크기
+        self._active = None       # 현재 기록 중인 세그먼트 (log, idx) 파일 객체
+        self._closed = False
+        self._wake = threading.Event()
+        os.makedirs(path, exist_ok=True)
+        self._load()
+        threading.Thread(target=self._write_loop, daemon=True, name=f"store-{os.path.basename(path)}").start()
+
+    def _segment_path(self, first_id, ext):
+        return os.path.join(self.path, f"{first_id:016d}.{ext}")
+
+    def _load(self):
+        """기존 세그먼트/인덱스 로드, 마지막 세그먼트는 끝까지 스캔해 last_id 복구 (잘린 줄은 버림)"""
+        firsts = sorted(int(name[:-4]) for name in os.listdir(self.path)
+                        if name.endswith('.log') and name[:-4].isdigit())
+        for first_id in firsts:
+            log_path = self._segment_path(first_id, 'log')
+            ids, offsets = [], []
+            try:
+                with open(self._segment_path(first_id, 'idx'), 'rb') as f:
+                    for entry_id, offset in self._INDEX_ENTRY.iter_unpack(f.read()):
+                        ids.append(entry_id)
+                        offsets.append(offset)
+            except (FileNotFoundError, struct.error):
+                ids, offsets = [], []
+            self._firsts.append(first_id)
+            self._index[first_id] = (ids, offsets)
+            self._sizes[first_id] = os.path.getsize(log_path)
+            if not ids and self._sizes[first_id]:
+                self._rebuild_index(first_id)
+        if not firsts:
+            return
+        last = firsts[-1]
+        ids, offsets = self._index[last]
+        self.last_id = last - 1
+        with open(self._segment_path(last, 'log'), 'r+b') as f:
+            f.seek(offsets[-1] if offsets else 0)
+            good = f.tell()
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                self.last_id = json.loads(line)['id']
+                good += len(line)
+            if good < self._sizes[last]:
+                f.truncate(good)
+                self._sizes[last] = good
+        # 잘린 구간을 가리키는 인덱스 항목 제거
+        while offsets and offsets[-1] >= self._sizes[last]:
+            ids.pop()
+            offsets.pop()
+
+    def _rebuild_index(self, first_id):
+        ids, offsets = [], []
+        offset = 0
+        with open(self._segment_path(first_id, 'log'), 'rb') as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                record_id = json.loads(line)['id']
+                if (record_id - first_id) % self.index_interval == 0:
+                    ids.append(record_id)
+                    offsets.append(offset)
+                offset += len(line)
+        with open(self._segment_path(first_id, 'idx'), 'wb') as f:
+            f.write(b"".join(self._INDEX_ENTRY.pack(i, o) for i, o in zip(ids, offsets)))
+        self._index[first_id] = (ids, offsets)
+
+    def append(self, record):
+        """레코드를 대기열에 추가 (디스크 기록은 flush/기록 쓰레드에서 배치로 - 리더 쓰레드는 파일 I/O를 기다리지 않음)"""
+        line = record.json + b"\n"
+        with self.lock:
+            self._pending.append((record.id, line))
+            self._pending_bytes += len(line)
+            self.last_id = record.id
+            full = self._pending_bytes >= STORE_BATCH_BYTES
+        if full:
+            self._wake.set()
+
+    def _write_loop(self):
+        """대기열이 STORE_BATCH_BYTES를 넘으면 깨어나 기록 (주기적 flush와 별개)"""
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if self._closed:
+                return
+            self.flush()
+
+    def flush(self):
+        """대기열을 떼어 내 락 밖에서 write/fsync (그 동안 append는 막히지 않음) 후 보존 정책 적용"""
+        with self.write_lock:
+            with self.lock:
+                pending, self._pending, self._pending_bytes = self._pending, [], 0
+                writes = self._plan_locked(pending)
+            for files, chunks, entries, done in writes:
+                self._write_active(files, chunks, entries)
+                if done:
+                    for f in files:
+                        f.close()
+            # 주기적 flush마다 확인 - 기록이 없는 장치도 보존 기간이 지난 세그먼트는 삭제
+            self._apply_retention()
+
+    def _plan_locked(self, pending):
+        """대기열을 세그먼트별 (파일, 줄 묶음, 인덱스 항목, 기록 후 닫기) 목록으로 나누고 인덱스·크기 갱신"""
+        writes = []
+        chunks, entries = [], []
+        for record_id, line in pending:
+            if self._active is None or self._sizes[self._firsts[-1]] >= self.segment_bytes:
+                if self._active is not None:
+                    writes.append((self._active, chunks, entries, True))
+                chunks, entries = [], []
+                self._roll(record_id)
+            first_id = self._firsts[-1]
+            if (record_id - first_id) % self.index_interval == 0:
+                ids, offsets = self._index[first_id]
+                ids.append(record_id)
+                offsets.append(self._sizes[first_id])
+                entries.append(self._INDEX_ENTRY.pack(record_id, self._sizes[first_id]))
+            chunks.append(line)
+            self._sizes[first_id] += len(line)
+        if chunks:
+            writes.append((self._active, chunks, entries, False))
+        return writes
+
+    def _write_active(self, files, chunks, entries):
+        """세그먼트당 write 1회 + fsync 1회 (줄마다 fsync 하지 않음)"""
+        if not chunks:
+            return
+        log_file, idx_file = files
+        log_file.write(b"".join(chunks))
+        log_file.flush()
+        if entries:
+            idx_file.write(b"".join(entries))
+            idx_file.flush()
+        if STORE_FSYNC:
+            os.fsync(log_file.fileno())
+
+    def _roll(self, first_id):
+        """새 세그먼트 시작 (마지막 세그먼트가 비어있지 않으면) - 이전 세그먼트 파일은 flush가 기록 후 닫음"""
+        if self._firsts and self._sizes[self._firsts[-1]] < self.segment_bytes:
+            first_id = self._firsts[-1]  # 재시작 후 이어쓰기
+        else:
+            self._firsts.append(first_id)
+            self._index[first_id] = ([], [])
+            self._sizes[first_id] = 0
+        self._active = (open(self._segment_path(first_id, 'log'), 'ab'),
+                        open(self._segment_path(first_id, 'idx'), 'ab'))
+
+    def _apply_retention(self):
+        """총 크기(max_bytes) 또는 보존 기간(max_age) 초과 시 가장 오래된 세그먼트부터 삭제 (write_lock 안에서 호출)"""
+        now = time.time()
+        while True:
+            with self.lock:
+                if len(self._firsts) <= 1:
+                    return
+                oldest = self._firsts[0]
+                total = sum(self._sizes.values())
+            try:
+                expired = self.max_age and now - os.path.getmtime(self._segment_path(oldest, 'log')) > self.max_age
+            except FileNotFoundError:
+                expired = True
+            if total <= self.max_bytes and not expired:
+                return
+            with self.lock:
+                self._firsts.pop(0)
+                del self._index[oldest]
+                del self._sizes[oldest]
+            for ext in ('log', 'idx'):
+                try: os.remove(self._segment_path(oldest, ext))
+                except FileNotFoundError: pass
+
+    @property
+    def first_id(self):
+        return self._firsts[0] if self._firsts else self.last_id + 1
+
+    def read_range(self, from_id, to_id, limit=None):
+        """from_id~to_id 범위 레코드 반환: 인덱스로 시작 오프셋을 찾고 mmap으로 필요한 부분만 읽음"""
+        self.flush()
+        with self.lock:
+            firsts = list(self._firsts)
+            index = {f: self._index[f] for f in firsts}
+        logs = []
+        start = max(bisect.bisect_right(firsts, from_id) - 1, 0)
+        for first_id in firsts[start:]:
+            if first_id > to_id or (limit is not None and len(logs) >= limit):
+                break
+            ids, offsets = index[first_id]
+            pos = min(bisect.bisect_right(ids, from_id), len(offsets)) - 1
+            offset = offsets[pos] if pos >= 0 else 0
+            try:
+                with open(self._segment_path(first_id, 'log'), 'rb') as f:
+                    if os.fstat(f.fileno()).st_size <= offset:
+                        continue
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        while True:
+                            end = mm.find(b"\n", offset)
+                            if end < 0:
+                                break
+                            record = json.loads(mm[offset:end])
+                            offset = end + 1
+                            if record['id'] < from_id:
+                                continue
+                            if record['id'] > to_id or (limit is not None and len(logs) >= limit):
+                                return logs
+                            logs.append(record)
+            except FileNotFoundError:
+                continue  # 보존 정책으로 삭제된 세그먼트
+        return logs
+
+    def close(self):
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        with self.write_lock, self.lock:
+            if self._active:
+                for f in self._active:
+                    f.close()
+                self._active = None
+
+# --- 원시 캡처 (녹화/재생) ---
+# .cap: 헤더(매직, 녹화 시작 wall-clock ns, baud) 뒤에 (녹화 시작 기준 ns, 길이, 원시 바이트) 레코드 반복
+# .cap.idx: N청크마다 (상대 ns, 파일 offset, 그 청크에서 시작하는 로그 id) - 시간/sequence 탐색용
+CAPTURE_MAGIC = b'ESPCAP1\n'
+_CAPTURE_HEADER = struct.Struct('<qI')
+_CAPTURE_RECORD = struct.Struct('<QI')
+_CAPTURE_INDEX = struct.Struct('<QQQ')
+
+class CaptureWriter:
+    """리더가 받은 원시 청크를 수신 시각(ns)과 함께 그대로 기록 (디코딩·줄 분리 전 바이트 스트림 보존)"""
+
+    def __init__(self, path, baud=0, index_interval=CAPTURE_INDEX_INTERVAL):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.index_interval = index_interval
+        self.lock = threading.Lock()
+        self._file = open(path, 'wb', buffering=256 * 1024)
+        self._index = open(path + '.idx', 'wb')
+        self._file.write(CAPTURE_MAGIC + _CAPTURE_HEADER.pack(time.time_ns(), baud))
+        self._offset = len(CAPTURE_MAGIC) + _CAPTURE_HEADER.size
+        self._base_ns = time.monotonic_ns()
+        self._count = 0
+
+    def write(self, chunk, ts_ns, next_id):
+        """청크 1개 기록 (next_id: 이 청크에서 완성되는 첫 줄이 받을 로그 id)"""
+        rel = max(ts_ns - self._base_ns, 0)
+        with self.lock:
+            if self._file is None:
+                return
+            if self._count % self.index_interval == 0:
+                self._index.write(_CAPTURE_INDEX.pack(rel, self._offset, next_id))
+            self._file.write(_CAPTURE_RECORD.pack(rel, len(chunk)))
+            self._file.write(chunk)
+            self._offset += _CAPTURE_RECORD.size + len(chunk)
+            self._count += 1
+
+    def flush(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+                self._index.flush()
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._index.close()
+                self._file = self._index = None
+
+class CaptureReader:
+    """캡처 파일 순차 읽기 + 인덱스로 시간(ns)/로그 id 탐색 (인덱스가 없으면 레코드 헤더만 훑어 재구성)"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        head = self._file.read(len(CAPTURE_MAGIC) + _CAPTURE_HEADER.size)
+        if not head.startswith(CAPTURE_MAGIC) or len(head) < len(CAPTURE_MAGIC) + _CAPTURE_HEADER.size:
+            self._file.close()
+            raise ValueError(f"Not a capture file: {path}")
+        self.wall_start_ns, self.baud = _CAPTURE_HEADER.unpack_from(head, len(CAPTURE_MAGIC))
+        self._data_start = len(head)
+        self.index = self._load_index()   # [(상대 ns, offset, 로그 id)]
+
+    def _load_index(self):
+        try:
+            with open(self.path + '.idx', 'rb') as f:
+                raw = f.read()
+            entries = [_CAPTURE_INDEX.unpack_from(raw, i)
+                       for i in range(0, len(raw) - _CAPTURE_INDEX.size + 1, _CAPTURE_INDEX.size)]
+            if entries:
+                return entries
+        except OSError:
+            pass
+        # 인덱스 없음: 레코드 헤더만 따라가며 재구성 (로그 id는 개행 수로 계산)
+        entries, next_id, count = [], 1, 0
+        self._file.seek(self._data_start)
+        while True:
+            offset = self._file.tell()
+            record = self.next_record()
+            if record is None:
+                break
+            if count % CAPTURE_INDEX_INTERVAL == 0:
+                entries.append((record[0], offset, next_id))
+            next_id += record[1].count(b'\n')
+            count += 1
+        self._file.seek(self._data_start)
+        return entries
+
+    def next_record(self):
+        """(상대 ns, 바이트) 또는 끝/잘린 레코드면 None"""
+        head = self._file.read(_CAPTURE_RECORD.size)
+        if len(head) < _CAPTURE_RECORD.size:
+            return None
+        rel, length = _CAPTURE_RECORD.unpack(head)
+        data = self._file.read(length)
+        if len(data) < length:
+            return None
+        return rel, data
+
+    def seek(self, from_ns=None, from_id=None):
+        """from_ns(녹화 시작 기준) 또는 from_id(로그 id)를 포함하는 청크로 이동 (청크 단위이므로 첫 줄은 잘릴 수 있음)"""
+        if not self.index or (from_ns is None and from_id is None):
+            self._file.seek(self._data_start)
+            return
+        column = 0 if from_ns is not None else 2
+        target = from_ns if from_ns is not None else from_id
+        pos = max(bisect.bisect_right([entry[column] for entry in self.index], target) - 1, 0)
+        _, offset, next_id = self.index[pos]
+        self._file.seek(offset)
+        while True:
+            offset = self._file.tell()
+            record = self.next_record()
+            if record is None:
+                break
+            newlines = record[1].count(b'\n')
+            if (record[0] >= from_ns) if from_ns is not None else (next_id + newlines > from_id):
+                break
+            next_id += newlines
+        self._file.seek(offset)
+
+    def close(self):
+        self._file.close()
+
+class ReplaySerial:
+    """캡처 파일을 시리얼 포트처럼 읽게 하는 재생 소스 - 같은 줄 분리·수집 경로를 그대로 탐
+
+    포트 URL: replay://<경로>?speed=N&from_sec=S&from_id=I (speed=1 실시간, N배속, 0이면 최대 속도)
+    기록된 청크 간격을 speed배로 재현하고, 끝에 도달하면 유휴 포트처럼 동작. 쓰기·DTR/RTS는 무시.
+    """
+
+    def __init__(self, path, speed=1.0, from_sec=None, from_id=None, timeout=SERIAL_READ_TIMEOUT):
+        self.reader = CaptureReader(path)
+        self.reader.seek(from_ns=int(from_sec * 1e9) if from_sec is not None else None, from_id=from_id)
+        self.speed = speed
+        self.timeout = timeout
+        self.is_open = True
+        self.eof = False
+        self.dtr = self.rts = False
+        self._pending = b''
+        self._next = None       # 아직 재생 시각이 안 된 레코드
+        self._origin = None     # (재생 시작 monotonic ns, 첫 레코드 상대 ns)
+
+    @classmethod
+    def from_url(cls, url, timeout=SERIAL_READ_TIMEOUT):
+        path, _, query = url[len('replay://'):].partition('?')
+        params = dict(parse_qsl(query))
+        return cls(path, speed=float(params.get('speed', 1)),
+                   from_sec=float(params['from_sec']) if 'from_sec' in params else None,
+                   from_id=int(params['from_id']) if 'from_id' in params else None, timeout=timeout)
+
+    def _wait_ns(self):
+        """다음 레코드까지 남은 시간 (ns), 끝이면 None"""
+        if self._next is None:
+            self._next = self.reader.next_record()
+            if self._next is None:
+                self.eof = True
+                return None
+        if not self.speed:
+            return 0
+        now = time.monotonic_ns()
+        if self._origin is None:
+            self._origin = (now, self._next[0])
+        return (self._next[0] - self._origin[1]) / self.speed - (now - self._origin[0])
+
+    def read(self, size=1):
+        deadline = time.monotonic() + self.timeout
+        while not self._pending:
+            if not self.is_open:
+                raise serial.SerialException("replay closed")
+            wait = self._wait_ns()
+            remaining = deadline - time.monotonic()
+            if wait is None or wait / 1e9 > remaining:
+                time.sleep(max(remaining, 0))
+                return b''
+            if wait > 0:
+                time.sleep(wait / 1e9)
+            self._pending = self._next[1]
+            self._next = None
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+    @property
+    def in_waiting(self):
+        return len(self._pending)
+
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def setDTR(self, value=True):
+        pass
+
+    def setRTS(self, value=True):
+        pass
+
+    def close(self):
+        if self.is_open:
+            self.is_open = False
+            self.reader.close()
+
+# --- 응답 인코딩 (다수 클라이언트 공유) ---
+_ETAG_EPOCH = time.time_ns()  # 서버 재시작 시 이전 ETag와 구분
+
+def negotiate_encoding(accept_encoding):
+    """Accept-Encoding 헤더에서 gzip/deflate 선택 (q=0은 제외, 미지원 시 None)"""
+    offered = {}
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    for encoding in ('gzip', 'deflate'):
+        if offered.get(encoding, offered.get('*', 0)) > 0:
+            return encoding
     return None
 
-# --- 시리얼 리스너 쓰레드 ---
-def serial_listener():
-    global serial_inst, log_sequence, is_connected
-    buffer = b""
-    
-    while True:
-        # 1. 연결 시도 (기본 포트 → 포트 스캔으로 재연결)
-        # 1. 연결 시도 (기본 포트 → 포트 스캔으로 재연결)
-        if serial_inst is None:
-            port = _find_serial_port()
-            if port is None:
-                if time.time() % 5 < 0.2:
-                    print(f"⌛ No serial port found (trying {SERIAL_PORT} and USB serial)", flush=True)
-                time.sleep(1)
-                continue
+def compress_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, COMPRESS_LEVEL, mtime=0)
+    if encoding == 'deflate':
+        return zlib.compress(body, COMPRESS_LEVEL)
+    return body
+
+class EncodedResponse:
+    """인코딩(및 압축)이 끝난 응답 본문과 ETag (따옴표 없는 weak ETag 값)"""
+
+    __slots__ = ('body', 'etag', 'encoding')
+
+    def __init__(self, body, etag, encoding):
+        self.body = body
+        self.etag = etag
+        self.encoding = encoding
+
+class ResponseCache:
+    """같은 시점·같은 커서 요청은 인코딩/압축된 응답 하나를 공유 (로그·연결 상태가 바뀌면 비움)"""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self._state = None
+        self._entries = {}
+
+    def get(self, state, key, build):
+        with self.lock:
+            if state != self._state:
+                self._state = state
+                self._entries = {}
+            entry = self._entries.get(key)
+        if entry is None:
+            entry = build()
+            with self.lock:
+                if self._state == state and len(self._entries) < self.max_entries:
+                    self._entries[key] = entry
+        return entry
+
+def encode_envelope(fields, fragments):
+    """작은 필드만 json.dumps 하고 로그는 캐시된 JSON 조각을 그대로 이어 붙여 본문 생성"""
+    head = json.dumps(fields, separators=(',', ':')).encode('utf-8')
+    return head[:-1] + b',"logs":[' + b','.join(fragments) + b']}'
+
+# --- 메트릭 (Prometheus) ---
+_SECONDS_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0)
+_LAG_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+_REBOOT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+_FLASH_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+FLASH_PHASES = ('pause', 'flash', 'reattach', 'first_line')
+
+class Histogram:
+    """고정 bucket 히스토그램 (observe는 bisect 1회 + 짧은 락)"""
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # 마지막 칸 = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def samples(self):
+        """(le 문자열, 누적 개수) 목록과 sum, count"""
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        cumulative, out = 0, []
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            out.append(('+Inf' if bound == float('inf') else repr(bound), cumulative))
+        return out, total, count
+
+class DeviceMetrics:
+    """장치 1개의 수집·버퍼·클라이언트 지표 (METRICS_ENABLED=False면 만들지 않고 계측 지점은 None만 확인)"""
+
+    def __init__(self):
+        self.rx_bytes = 0             # 리더 쓰레드만 갱신
+        self.rx_lines = 0
+        self.frame_errors = 0         # 바이너리 프레이밍에서 버린 깨진 프레임
+        self.reader_pass = Histogram(_SECONDS_BUCKETS)
+        self.lock_hold = {'serial': Histogram(_SECONDS_BUCKETS), 'write': Histogram(_SECONDS_BUCKETS)}
+        self.sync_seconds = Histogram(_SECONDS_BUCKETS)
+        self.sync_lag = Histogram(_LAG_BUCKETS)
+        self.stream_lag = Histogram(_LAG_BUCKETS)
+        self.reboot_seconds = Histogram(_REBOOT_BUCKETS)
+        self.flash_phase = {phase: Histogram(_FLASH_BUCKETS) for phase in FLASH_PHASES}
+        self.counters = {}            # (이름, 라벨값) → 개수 (요청 쓰레드 여러 개가 갱신)
+        self.stream_clients = 0
+        self._lock = threading.Lock()
+
+    def inc(self, name, label='', n=1):
+        with self._lock:
+            self.counters[(name, label)] = self.counters.get((name, label), 0) + n
+
+    def stream_opened(self, delta=1):
+        with self._lock:
+            self.stream_clients += delta
+
+# (이름, 종류, 설명) - 모든 시계열에 device 라벨
+_METRIC_FAMILIES = (
+    ('rx_bytes_total', 'counter', 'Bytes read from the serial port'),
+    ('rx_lines_total', 'counter', 'Lines appended to the log buffer'),
+    ('frame_errors_total', 'counter', 'Binary frames dropped as malformed or oversized (SLIP/COBS framing)'),
+    ('evicted_lines_total', 'counter', 'Lines dropped from the in-memory ring buffer by capacity'),
+    ('connected', 'gauge', 'Serial port connected (1) or not (0)'),
+    ('buffer_lines', 'gauge', 'Lines currently held in the ring buffer'),
+    ('retained_lines', 'gauge', 'Lines held in memory including compressed blocks'),
+    ('block_bytes', 'gauge', 'Compressed size of in-memory log blocks'),
+    ('last_id', 'gauge', 'Latest log sequence number'),
+    ('tx_queue_depth', 'gauge', 'Commands waiting for the writer thread'),
+    ('stream_clients', 'gauge', 'Open SSE stream connections'),
+    ('reader_pass_seconds', 'histogram', 'Reader loop time spent framing and ingesting one read chunk'),
+    ('lock_hold_seconds', 'histogram', 'Time serial_lock/write_lock was held'),
+    ('sync_requests_total', 'counter', 'Sync requests by HTTP status'),
+    ('sync_seconds', 'histogram', 'Time to answer /api/sync'),
+    ('sync_lag_lines', 'histogram', 'Lines between the sync cursor and the head at request time'),
+    ('stream_lag_lines', 'histogram', 'Lines between the stream cursor and the head at each wake'),
+    ('reboots_total', 'counter', 'Reset commands by result'),
+    ('reboot_seconds', 'histogram', 'Duration of the reset sequence (write + DTR/RTS toggling)'),
+    ('flashes_total', 'counter', 'Flash runs by result'),
+    ('flash_phase_seconds', 'histogram', 'Flash workflow phases (pause reader, flasher, reattach, first boot line)'),
+)
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def render_metrics(targets):
+    """Prometheus text exposition format (0.0.4)"""
+    per_family = {name: [] for name, _, _ in _METRIC_FAMILIES}
+
+    def add(name, dev, value, **labels):
+        labels = ''.join(f',{k}="{_label_value(v)}"' for k, v in labels.items())
+        per_family[name].append(f'esp_monitor_{name}{{device="{_label_value(dev.name)}"{labels}}} {value}')
+
+    def add_histogram(name, dev, histogram, **labels):
+        buckets, total, count = histogram.samples()
+        extra = ''.join(f',{k}="{_label_value(v)}"' for k, v in labels.items())
+        prefix = f'esp_monitor_{name}'
+        device = _label_value(dev.name)
+        for le, n in buckets:
+            per_family[name].append(f'{prefix}_bucket{{device="{device}"{extra},le="{le}"}} {n}')
+        per_family[name].append(f'{prefix}_sum{{device="{device}"{extra}}} {total}')
+        per_family[name].append(f'{prefix}_count{{device="{device}"{extra}}} {count}')
+
+    for dev in targets:
+        m = dev.metrics
+        if m is None:
+            continue
+        add('rx_bytes_total', dev, m.rx_bytes)
+        add('rx_lines_total', dev, m.rx_lines)
+        add('frame_errors_total', dev, m.frame_errors)
+        add('evicted_lines_total', dev, dev.log_queue.evicted)
+        add('connected', dev, int(dev.is_connected))
+        add('buffer_lines', dev, len(dev.log_queue))
+        blocks = dev.log_queue.blocks
+        add('retained_lines', dev, len(dev.log_queue) + (len(blocks) if blocks else 0))
+        add('block_bytes', dev, blocks.compressed_bytes if blocks else 0)
+        add('last_id', dev, dev.log_queue.last_id)
+        add('tx_queue_depth', dev, dev.tx_queue.qsize())
+        add('stream_clients', dev, m.stream_clients)
+        add_histogram('reader_pass_seconds', dev, m.reader_pass)
+        for lock, histogram in m.lock_hold.items():
+            add_histogram('lock_hold_seconds', dev, histogram, lock=lock)
+        add_histogram('sync_seconds', dev, m.sync_seconds)
+        add_histogram('sync_lag_lines', dev, m.sync_lag)
+        add_histogram('stream_lag_lines', dev, m.stream_lag)
+        add_histogram('reboot_seconds', dev, m.reboot_seconds)
+        for phase, histogram in m.flash_phase.items():
+            add_histogram('flash_phase_seconds', dev, histogram, phase=phase)
+        with m._lock:
+            counters = sorted(m.counters.items())
+        for (name, label), value in counters:
+            key = 'code' if name == 'sync_requests_total' else 'result'
+            add(name, dev, value, **{key: label})
+    out = []
+    for name, kind, help_text in _METRIC_FAMILIES:
+        out.append(f'# HELP esp_monitor_{name} {help_text}')
+        out.append(f'# TYPE esp_monitor_{name} {kind}')
+        out.extend(per_family[name])
+    return '\n'.join(out) + '\n'
+
+# --- 글로벌 상태 관리 ---
+app = Flask(__name__)
+devices = {}               # 장치 이름 → SerialDevice (첫 번째 장치가 기존 단일 포트 라우트의 기본 장치)
+devices_lock = threading.Lock()
+listener_wake = threading.Event()  # 장치 연결 해제 시 serial_listener를 바로 깨움
+
+def _is_usb_serial(port):
+    """comports() 항목이 USB 시리얼인지 (VID가 있거나 macOS/Windows 포트 이름 규칙)"""
+    path = port.device
+    return (port.vid is not None or 'usbmodem' in path or 'usbserial' in path
+            or (sys.platform == 'win32' and path.startswith('COM')))
+
+def _port_present(port):
+    """포트를 열지 않고 존재 여부만 확인 (URL·Windows COM 포트는 열어 봐야 알 수 있으므로 True)"""
+    return '://' in port or sys.platform == 'win32' or os.path.exists(port)
+
+def parse_usb_id(value):
+    """'VID:PID[:SERIAL]' (16진수) → (vid, pid, serial_number)"""
+    parts = value.split(':', 2)
+    return int(parts[0], 16), int(parts[1], 16), parts[2] if len(parts) > 2 else None
+
+def _usb_id_matches(usb_id, found):
+    vid, pid, serial_number = usb_id
+    return found[:2] == (vid, pid) and (serial_number is None or found[2] == serial_number)
+
+class PortScanner:
+    """USB 시리얼 포트 목록 캐시: /dev가 바뀌었을 때(노드 생성/삭제)만 다시 열거, 포트는 열어 보지 않음"""
+
+    def __init__(self, rescan_sec=DISCOVERY_RESCAN_SEC):
+        self.rescan_sec = rescan_sec
+        self.ports = {}           # 경로 → (vid, pid, serial_number)
+        self._stamp = None
+        self._scanned_at = None
+
+    def poll(self, now=None):
+        """변경이 감지되면 다시 열거하고 True 반환 (변경 없으면 stat 1회)"""
+        now = time.monotonic() if now is None else now
+        try:
+            stamp = os.stat('/dev').st_mtime_ns
+        except OSError:
+            stamp = None
+        if (self._scanned_at is not None and stamp == self._stamp
+                and (stamp is not None or now - self._scanned_at < self.rescan_sec)):
+            return False
+        self._stamp = stamp
+        self._scanned_at = now
+        self.ports = {p.device: (p.vid, p.pid, p.serial_number)
+                      for p in serial.tools.list_ports.comports() if _is_usb_serial(p)}
+        return True
+
+def _open_serial(port, baud=BAUD_RATE):
+    """포트 열기 (pyserial URL 지원: loop://, 가상 pty 등으로 보드 없이 테스트 가능)
+
+    DTR/RTS를 내린 상태로 열어 연결만으로 보드가 리셋되지 않게 함, replay://는 캡처 파일 재생
+    """
+    if port.startswith('replay://'):
+        return ReplaySerial.from_url(port)
+    inst = serial.serial_for_url(port, baud, timeout=SERIAL_READ_TIMEOUT, do_not_open=True)
+    inst.dtr = False
+    inst.rts = False
+    inst.open()
+    return inst
+
+def _read_chunk(inst):
+    """바이트가 도착할 때까지 블로킹 (최대 SERIAL_READ_TIMEOUT), 도착 즉시 대기 중인 바이트 전부 반환"""
+    chunk = inst.read(1)
+    if chunk:
+        waiting = inst.in_waiting
+        if waiting:
+            chunk += inst.read(waiting)
+    return chunk
+
+# --- 송신 (TX) ---
+class TxQueueFull(Exception):
+    pass
+
+class TxCommand:
+    """송신 명령 1건과 구간별 타이밍 (enqueue→written, written→첫 응답 줄)"""
+
+    __slots__ = ('id', 'kind', 'data', 'status', 'error', 'enqueued_ns', 'written_ns', 'response_ns', 'response_id')
+
+    def __init__(self, command_id, kind, data=b""):
+        self.id = command_id
+        self.kind = kind          # 'line' (데이터 전송) 또는 'reset' (REBOOT + DTR/RTS 리셋)
+        self.data = data
+        self.status = 'queued'    # queued → written → answered / failed / dropped / disconnected (응답 전에 끊김)
+        self.error = None
+        self.enqueued_ns = time.monotonic_ns()
+        self.written_ns = None
+        self.response_ns = None
+        self.response_id = None   # 기록 후 처음 수신된 로그 id
+
+    def to_dict(self):
+        def ms(start, end):
+            return round((end - start) / 1e6, 3) if start is not None and end is not None else None
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "data": self.data.decode('utf-8', errors='replace'),
+            "status": self.status,
+            "error": self.error,
+            "enqueue_to_write_ms": ms(self.enqueued_ns, self.written_ns),
+            "write_to_response_ms": ms(self.written_ns, self.response_ns),
+            "response_id": self.response_id,
+        }
+
+# --- asyncio 브리지 (리더 쓰레드 → 이벤트 루프) ---
+class AsyncBroadcast:
+    """리더 쓰레드의 새 로그/상태 변경을 이벤트 루프의 대기 코루틴들에 전달
+
+    대기자 수와 무관하게 공유 Future 하나를 완료시키며, 루프에 예약된 알림이 처리되기 전까지의
+    추가 wake()는 합쳐짐 (줄마다 call_soon_threadsafe를 부르지 않음)
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._waiter = None
+        self._scheduled = False
+
+    def bind(self, loop):
+        """이벤트 루프 연결 (None이면 해제, 루프 쓰레드에서 호출)"""
+        self._loop = loop
+        self._waiter = loop.create_future() if loop else None
+        self._scheduled = False
+
+    def current(self):
+        """다음 wake()에서 완료될 Future (상태 확인 전에 가져와야 알림을 놓치지 않음)"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self.bind(loop)
+        return self._waiter
+
+    def wake(self):
+        """아무 쓰레드에서나 호출 가능, 루프가 없으면 바로 반환"""
+        loop = self._loop
+        if loop is None or self._scheduled:
+            return
+        self._scheduled = True
+        try:
+            loop.call_soon_threadsafe(self._fire)
+        except RuntimeError:  # 루프 종료됨
+            self._loop = None
+
+    def _fire(self):
+        self._scheduled = False
+        waiter = self._waiter
+        if waiter is None:
+            return
+        self._waiter = waiter.get_loop().create_future()
+        if not waiter.done():
+            waiter.set_result(None)
+
+# --- 플래시 (포트를 넘겨주고 다시 연결) ---
+class FlashBusy(Exception):
+    pass
+
+class FlashJob:
+    """플래시 1회: 리더 정지·포트 해제 → 플래셔 실행(출력은 로그로) → 재연결 → 첫 부트 로그, 구간별 시간 기록"""
+
+    def __init__(self, job_id, argv):
+        self.id = job_id
+        self.argv = argv
+        self.status = 'running'  # running → ok / failed / timeout / missing (서버 환경에 플래셔 없음)
+        self.phase = 'pause'
+        self.returncode = None
+        self.error = None
+        self.output_lines = 0
+        self.first_boot_id = None  # 재연결 후 처음 수신된 줄
+        self.phases = {}           # 구간 → 초
+        self.done = threading.Event()
+        self._mark = time.perf_counter()
+        self._started = self._mark
+
+    def end_phase(self, next_phase=None):
+        now = time.perf_counter()
+        self.phases[self.phase] = now - self._mark
+        self._mark = now
+        self.phase = next_phase
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "command": shlex.join(self.argv),
+            "status": self.status,
+            "phase": self.phase,
+            "returncode": self.returncode,
+            "error": self.error,
+            "output_lines": self.output_lines,
+            "first_boot_id": self.first_boot_id,
+            "phases_ms": {k: round(v * 1000, 1) for k, v in self.phases.items()},
+            "total_ms": round(((sum(self.phases.values()) if self.done.is_set() else
+                                time.perf_counter() - self._started)) * 1000, 1),
+        }
+
+# --- 장치 (보드 1개 단위 상태) ---
+class SerialDevice:
+    """보드 1개의 연결, 리더 쓰레드, 로그 버퍼, sequence, 재부팅 제어를 묶은 단위 (장치별 락 사용)"""
+
+    def __init__(self, name, port, baud=BAUD_RATE, scan=False, store=None, usb_id=None, capture=None,
+                 framing='text', series_rules=SERIES_RULES, flash_command=None, flash_cwd=None):
+        self.name = name
+        self.port = port          # 설정된 포트 (pyserial URL 가능)
+        self.baud = baud
+        self.scan = scan          # 설정 포트가 없으면 USB 시리얼 포트 검색 (리셋 후 포트 번호 변경 대응)
+        self.usb_id = usb_id      # (vid, pid, serial_number) - 첫 연결 시 기억, 이후 이 식별자로만 재연결
+        self.active_port = None   # 실제 연결된 포트
+        self.store = store        # 디스크 로그 저장소 (None이면 메모리만 사용)
+        self.capture = capture    # 원시 바이트 녹화 (CaptureWriter, None이면 녹화 안 함)
+        self.framing = framing    # 'text' (줄 단위 UTF-8) 또는 'slip'/'cobs' (바이너리 프레임을 bytes 그대로 보관)
+        # 재시작 시 sequence를 디스크의 마지막 id부터 이어감
+        self.log_queue = LogRing(MAX_BUFFER_LINES, start_id=store.last_id if store else 0,
+                                 blocks=LogBlocks(MEMORY_RETAIN_LINES) if MEMORY_RETAIN_LINES else None)
+        self.search_index = SearchIndex(self.log_queue) if framing == 'text' else None
+        self.series = SeriesExtractor(series_rules) if framing == 'text' and series_rules else None
+        self.expects = ExpectHub() if framing == 'text' else None
+        self.sync_cache = ResponseCache()
+        self.async_wake = AsyncBroadcast()  # ASGI 모드의 스트림 클라이언트 통지
+        self.metrics = DeviceMetrics() if METRICS_ENABLED else None
+        self.serial_inst = None
+        self.serial_lock = threading.Lock()  # serial_inst 교체/해제 전용 (읽기 경로에서는 잡지 않음)
+        self.write_lock = threading.Lock()   # 쓰기/DTR·RTS 제어 전용 (리더와 독립)
+        self.is_connected = False
+        self.retry_at = 0.0       # 오류 후 재연결 시도 가능 시각 (monotonic)
+        self.backoff = RECONNECT_BACKOFF_SEC[0]
+        self.waiting_reason = None  # 마지막으로 출력한 대기 사유 (같은 메시지 반복 출력 방지)
+        self.tx_queue = queue.Queue(maxsize=TX_QUEUE_SIZE)  # 전용 writer 쓰레드가 비움
+        self.tx_history = deque(maxlen=TX_HISTORY_SIZE)
+        self._tx_ids = itertools.count(1)
+        self._tx_lock = threading.Lock()
+        self._awaiting = []       # 기록 완료 후 첫 응답 줄을 기다리는 명령
+        self.reader = None        # 현재 리더 쓰레드 (플래시 전 포트가 완전히 닫혔는지 확인용)
+        self.paused = False       # 플래시 중: serial_listener가 다시 연결하지 않음
+        self.flash_command = flash_command  # None이면 FLASH_COMMAND
+        self.flash_cwd = flash_cwd          # None이면 FLASH_CWD
+        self.flash_job = None
+        self._flash_ids = itertools.count(1)
+        self._flash_lock = threading.Lock()
+
+    def append_log(self, text, ts_ns=None):
+        """로그 한 줄(바이너리 장치는 프레임 bytes) 추가 (대기 중인 스트림 클라이언트에 즉시 통지, 디스크에는 배치로 기록)"""
+        record = self.log_queue.append(text, ts_ns)
+        if self.search_index:
+            self.search_index.add(record)
+        if self.series:
+            self.series.add(record)
+        if self.expects and self.expects.waits:
+            self.expects.feed(record)
+        if self.store:
+            self.store.append(record)
+        if self._awaiting:
+            self._mark_response(record)
+        self.async_wake.wake()
+        return record
+
+    def _mark_response(self, record):
+        """기록 이후 수신된 첫 줄을 대기 중인 명령의 응답으로 기록"""
+        with self._tx_lock:
+            waiting = []
+            for cmd in self._awaiting:
+                if record.ts_ns >= cmd.written_ns:
+                    cmd.response_ns = record.ts_ns
+                    cmd.response_id = record.id
+                    cmd.status = 'answered'
+                else:
+                    waiting.append(cmd)
+            self._awaiting = waiting
+
+    def history(self, from_id, to_id, limit=None):
+        """from_id~to_id 범위 로그 (메모리(링 + 압축 블록)에 없는 오래된 범위만 디스크 저장소에서)"""
+        if self.store and from_id < self.log_queue.oldest_id:
+            return self.store.read_range(from_id, to_id, limit)
+        return self.log_queue.history(from_id, to_id, limit)
+
+    def oldest_id(self):
+        """history()로 조회 가능한 가장 오래된 id"""
+        return self.store.first_id if self.store else self.log_queue.oldest_id
+
+    def series_query(self, name=None, since=None, until=None, points=300):
+        """추출된 시계열 목록 (name 없음) 또는 구간 요약 (없는 시계열이면 None)"""
+        if name is None:
+            return self.series.names() if self.series else []
+        return self.series.query(name, since, until, points) if self.series else None
+
+    def notify(self):
+        """연결 상태 변경 등 로그 외 이벤트를 스트림 클라이언트에 알림"""
+        with self.log_queue.cond:
+            if self.log_queue.mirror:
+                self.log_queue.mirror.set_connected(self.is_connected)
+            self.log_queue.cond.notify_all()
+        self.async_wake.wake()
+
+    def status(self):
+        return {
+            "name": self.name,
+            "port": self.active_port or self.port,
+            "status": "Connected" if self.is_connected else "Disconnected",
+            "connected": self.is_connected,
+            "framing": self.framing,
+            "count": len(self.log_queue),
+            "last_id": self.log_queue.last_id,
+            "levels": dict(self.log_queue.level_counts),
+            "tags": dict(self.log_queue.tag_counts),
+        }
+
+    def find_port(self, scanner, claimed=()):
+        """연결할 포트 결정 (포트를 열어 보지 않음)
+
+        USB 식별자를 알면 그 식별자의 포트만, 모르면 설정 포트 → (scan=True) 다른 장치가 쓰지 않는 USB 시리얼 포트
+        """
+        if self.usb_id:
+            for path, found in scanner.ports.items():
+                if path not in claimed and _usb_id_matches(self.usb_id, found):
+                    return path
+            # 열거 목록에 없는 포트(pty, URL)는 식별자 대신 설정 경로로 연결
+            if self.port in scanner.ports or not _port_present(self.port):
+                return None
+            return self.port
+        if _port_present(self.port):
+            return self.port
+        if self.scan:
+            for path in scanner.ports:
+                if path not in claimed:
+                    return path
+        return None
+
+    def _wait_reason(self, reason):
+        if reason != self.waiting_reason:
+            self.waiting_reason = reason
+            print(f"⌛ [{self.name}] {reason}", flush=True)
+
+    def _lock_held(self, lock, started):
+        """락 보유 시간 기록 (started: 락 획득 직후 perf_counter)"""
+        if self.metrics:
+            self.metrics.lock_hold[lock].observe(time.perf_counter() - started)
+
+    def _backoff(self):
+        """재시도 시각을 미루고 다음 대기 시간을 2배로"""
+        self.retry_at = time.monotonic() + self.backoff
+        self.backoff = min(self.backoff * 2, RECONNECT_BACKOFF_SEC[1])
+
+    def connect(self, scanner, claimed=(), stop_event=None):
+        """포트를 찾아 연결하고 장치 전용 리더 쓰레드 시작 (성공 시 True)"""
+        port = self.find_port(scanner, claimed)
+        if port is None:
+            self._wait_reason(f"No serial port found (trying {self.port}{' and USB serial' if self.scan else ''})")
+            return False
+        try:
+            inst = _open_serial(port, self.baud)
+        except Exception as e:
+            self._wait_reason(f"Serial port {port} error: {e}")
+            self._backoff()
+            return False
+        found = scanner.ports.get(port)
+        if self.usb_id is None and found and found[0] is not None:
+            self.usb_id = found
+        with self.serial_lock:
+            locked_at = time.perf_counter()
+            self.serial_inst = inst
+            self.active_port = port
+            self.is_connected = True
+        self._lock_held('serial', locked_at)
+        self.waiting_reason = None
+        self.notify()
+        print(f"📡 [{self.name}] Serial Connected: {port}")
+        self.reader = threading.Thread(target=self.read_loop, args=(inst, stop_event), daemon=True,
+                                       name=f"reader-{self.name}")
+        self.reader.start()
+        threading.Thread(target=self.write_loop, args=(inst, stop_event), daemon=True,
+                         name=f"writer-{self.name}").start()
+        return True
+
+    def disconnect(self, inst=None):
+        """연결 해제 (inst 지정 시 현재 연결이 그 인스턴스일 때만)"""
+        with self.serial_lock:
+            locked_at = time.perf_counter()
+            if inst is not None and inst is not self.serial_inst:
+                return
+            inst = self.serial_inst
+            self.serial_inst = None
+            self.is_connected = False
+        self._lock_held('serial', locked_at)
+        if inst:
+            try: inst.close()
+            except: pass
+        self.notify()
+        listener_wake.set()
+
+    def read_loop(self, inst, stop_event=None):
+        """연결된 포트 전용 리더: fd에서 블로킹 대기, 락 없이 읽음 (쓰기는 write_lock 경로로 분리)"""
+        # 연결 즉시 읽기 시작 (리셋 직후 1단계 부트로더 출력을 놓치지 않음)
+        print(f"📡 [AUTO] [{self.name}] Serial connection established")
+        framer = make_framer(self.framing)
+        binary = self.framing != 'text'
+        metrics = self.metrics
+        capture = self.capture
+        try:
+            while self.serial_inst is inst and (stop_event is None or not stop_event.is_set()):
+                # 부분 줄이 있으면 유휴 출력 시점까지만 대기 (조용한 포트에서도 PARTIAL_FLUSH_SEC 지킴)
+                wait = framer.idle_wait()
+                timeout = SERIAL_READ_TIMEOUT if wait is None else min(SERIAL_READ_TIMEOUT, wait)
+                if inst.timeout != timeout:
+                    inst.timeout = timeout
+                chunk = _read_chunk(inst)
+                ts_ns = time.monotonic_ns()
+                if chunk:
+                    self.backoff = RECONNECT_BACKOFF_SEC[0]
+                    if capture:
+                        capture.write(chunk, ts_ns, self.log_queue.last_id + 1)
+                
+                # 새 바이트만 스캔해 줄 단위로 분리, 입력이 끊긴 부분 줄(프롬프트 등)은 유휴 시 출력
+                lines = framer.feed(chunk) if chunk else framer.flush_idle()
+                if binary:
+                    for frame in lines:
+                        self.append_log(frame, ts_ns)
+                else:
+                    for l in lines:
+                        text = l.decode('utf-8', errors='replace').rstrip('\r')
+                        self.append_log(text, ts_ns)
+                if metrics and chunk:
+                    metrics.rx_bytes += len(chunk)
+                    metrics.rx_lines += len(lines)
+                    if framer.errors:
+                        metrics.frame_errors += framer.errors
+                        framer.errors = 0
+                    metrics.reader_pass.observe((time.monotonic_ns() - ts_ns) / 1e9)
+                    
+                    # 자동 재부팅 감지 비활성화 - HARD RESET 버튼으로만 리셋
+        except Exception as e:
+            if self.serial_inst is not inst:
+                return  # disconnect()로 닫힌 포트 (finally에서 정리)
+            print(f"❌ [{self.name}] Serial Error: {e}", flush=True)
+            # 리셋으로 포트가 사라진 경우 다시 나타나는 즉시 재연결 (연속 실패 시에만 대기가 늘어남)
+            self._backoff()
+        finally:
+            for l in framer.flush():
+                self.append_log(l.decode('utf-8', errors='replace').rstrip('\r'))
+            self.disconnect(inst)
+            self._drop_pending("disconnected")
+            self._fail_awaiting("disconnected before response")
+
+    def send(self, data, kind='line'):
+        """송신 대기열에 명령 추가 (가득 차면 TxQueueFull, 실제 기록은 writer 쓰레드가 수행)"""
+        cmd = TxCommand(next(self._tx_ids), kind, data)
+        try:
+            self.tx_queue.put_nowait(cmd)
+        except queue.Full:
+            raise TxQueueFull(f"TX queue full ({TX_QUEUE_SIZE})")
+        self.tx_history.append(cmd)
+        return cmd
+
+    def commands(self):
+        """최근 송신 명령과 대기열 길이 (/api/commands)"""
+        return {"commands": [cmd.to_dict() for cmd in list(self.tx_history)], "queued": self.tx_queue.qsize()}
+
+    def _drop_pending(self, reason):
+        while True:
+            try:
+                cmd = self.tx_queue.get_nowait()
+            except queue.Empty:
+                return
+            cmd.status = 'dropped'
+            cmd.error = reason
+
+    def _await_response(self, cmd):
+        """기록 직전에 응답 대기로 등록 (리더가 기록 직후 읽은 빠른 응답 줄도 놓치지 않음)"""
+        with self._tx_lock:
+            cmd.written_ns = time.monotonic_ns()
+            cmd.status = 'written'
+            self._awaiting.append(cmd)
+
+    def _forget_response(self, cmd):
+        with self._tx_lock:
+            if cmd in self._awaiting:
+                self._awaiting.remove(cmd)
+
+    def _fail_awaiting(self, reason):
+        """응답을 기다리던 명령을 끝난 상태로 (포트가 닫히면 응답 줄이 올 수 없음)"""
+        with self._tx_lock:
+            waiting, self._awaiting = self._awaiting, []
+        for cmd in waiting:
+            cmd.status = 'disconnected'
+            cmd.error = reason
+
+    def _requeue(self, cmd):
+        """꺼낸 명령을 대기열 맨 앞으로 되돌림 (순서 유지, maxsize 무시)"""
+        with self.tx_queue.mutex:
+            self.tx_queue.queue.appendleft(cmd)
+            self.tx_queue.unfinished_tasks += 1
+            self.tx_queue.not_empty.notify()
+
+    def write_loop(self, inst, stop_event=None):
+        """연결된 포트 전용 writer: 대기열의 명령을 순서대로 기록 (리더를 막지 않음)"""
+        while self.serial_inst is inst and (stop_event is None or not stop_event.is_set()):
+            try:
+                cmd = self.tx_queue.get(timeout=SERIAL_READ_TIMEOUT)
+            except queue.Empty:
+                continue
+            if self.serial_inst is not inst:
+                # 대기 중 재연결됨: 대기열은 연결 간에 공유되므로 새 연결의 writer가 순서대로 보내도록 되돌림
+                self._requeue(cmd)
+                return
+            if cmd.kind == 'reset':
+                self._reset(inst, cmd)
+                continue
+            try:
+                with self.write_lock:
+                    locked_at = time.perf_counter()
+                    self._await_response(cmd)
+                    inst.write(cmd.data)
+                    inst.flush()
+                self._lock_held('write', locked_at)
+            except Exception as e:
+                self._forget_response(cmd)
+                cmd.status = 'failed'
+                cmd.error = str(e)
+                print(f"❌ [{self.name}] TX failed: {e}")
+
+    def reboot(self):
+        """리셋 명령을 송신 대기열에 추가 (writer 쓰레드의 순서대로 실행)"""
+        print(f"🔄 [{self.name}] reboot() called")
+        return self.send(b"REBOOT\n", kind='reset')
+
+    def _reset(self, inst, cmd):
+        """REBOOT 1회 전송 (확실히 flush) 후 DTR/RTS 하드웨어 리셋 - writer 쓰레드에서 실행"""
+        result = self._reset_sequence(inst, cmd)
+        if self.metrics:
+            self.metrics.inc('reboots_total', result)
+            if result != 'failed':
+                self.metrics.reboot_seconds.observe((time.monotonic_ns() - cmd.written_ns) / 1e9)
+
+    def _reset_sequence(self, inst, cmd):
+        """결과 반환: ok / no_reset (전송만 성공) / failed"""
+        # 쓰기 전용 락 사용: 리더는 리셋 중에도 계속 부트 로그를 수집
+        with self.write_lock:
+            locked_at = time.perf_counter()
+            try:
+                try:
+                    # 핀을 움직이기 전에 응답 대기로 등록 (리셋 직후 빠른 부트 출력도 응답으로 기록)
+                    self._await_response(cmd)
+                    inst.write(cmd.data)
+                    inst.flush()
+                    self.log_queue.clear()
+                    print("✅ REBOOT sent (once).")
+                except Exception as e:
+                    self._forget_response(cmd)
+                    cmd.status = 'failed'
+                    cmd.error = str(e)
+                    print(f"❌ Reboot send failed: {e}")
+                    return 'failed'
+
+                # DTR/RTS 핀 제어로 ESP32 하드웨어 리셋
+                try:
+                    print("🔌 Performing hardware reset via DTR/RTS")
+                    # ESP32 리셋 시퀀스: DTR=Low, RTS=High -> DTR=High, RTS=Low
+                    inst.setDTR(False)
+                    inst.setRTS(True)
+                    time.sleep(0.1)
+                    inst.setDTR(True)
+                    inst.setRTS(False)
+                    time.sleep(0.1)
+                    inst.setDTR(False)
+                    inst.setRTS(False)
+                    print("✅ Hardware reset sequence completed")
+                except Exception as e:
+                    cmd.error = str(e)
+                    print(f"❌ Hardware reset failed: {e}")
+                    return 'no_reset'
+                return 'ok'
+            finally:
+                self._lock_held('write', locked_at)
+
+    def start_flash(self):
+        """플래시 작업 시작 (이미 진행 중이면 FlashBusy, 작업은 별도 쓰레드에서 실행)"""
+        command = self.flash_command or FLASH_COMMAND
+        port = self.active_port or self.port
+        argv = [arg.format(port=port, baud=self.baud, name=self.name) for arg in shlex.split(command)]
+        with self._flash_lock:
+            if self.flash_job and not self.flash_job.done.is_set():
+                raise FlashBusy(f"flash already running (job {self.flash_job.id})")
+            job = self.flash_job = FlashJob(next(self._flash_ids), argv)
+        threading.Thread(target=self._flash_run, args=(job,), daemon=True, name=f"flash-{self.name}").start()
+        return job.to_dict()
+
+    def flash_status(self, wait_sec=0):
+        """마지막 플래시 작업 상태 (wait_sec 동안 끝나기를 기다림, 작업이 없으면 None)"""
+        job = self.flash_job
+        if job is None:
+            return None
+        if wait_sec:
+            job.done.wait(wait_sec)
+        return job.to_dict()
+
+    def _flash_run(self, job):
+        """포트를 플래셔에 넘겨주고 끝나면 바로 다시 연결 (로그 버퍼·sequence·클라이언트 연결은 유지)"""
+        print(f"🔥 [{self.name}] Flash: {shlex.join(job.argv)}", flush=True)
+        try:
+            # 1) 리더 정지 + 포트 해제 (리더 쓰레드가 끝나야 fd가 완전히 닫힘)
+            self.paused = True
+            reader = self.reader
+            self.disconnect()
+            if reader and reader is not threading.current_thread():
+                reader.join(SERIAL_READ_TIMEOUT + 1.0)
+            job.end_phase('flash')
+            # 2) 플래셔 실행, 출력은 같은 로그 뷰로
+            self.append_log(f"[FLASH] $ {shlex.join(job.argv)}")
+            self._run_flasher(job)
+        except Exception as e:
+            job.status, job.error = 'failed', str(e)
+            self.append_log(f"[FLASH] error: {e}")
+        finally:
+            # 3) 즉시 재연결 (리셋 직후 부트 로그를 놓치지 않도록 listener를 바로 깨움)
+            mark = self.log_queue.last_id
+            self.paused = False
+            listener_wake.set()
+            if job.phase != 'reattach':
+                job.end_phase('reattach')
+            log_queue = self.log_queue
+            with log_queue.cond:
+                log_queue.cond.wait_for(lambda: self.is_connected, FLASH_REATTACH_SEC)
+            if self.is_connected:
+                job.end_phase('first_line')
+                with log_queue.cond:
+                    if log_queue.cond.wait_for(lambda: log_queue.last_id > mark, FLASH_BOOT_WAIT_SEC):
+                        job.first_boot_id = mark + 1
+                        job.end_phase()
+            if not self.is_connected:
+                job.error = job.error or f"port not reattached within {FLASH_REATTACH_SEC}s"
+            job.phase = None  # 재연결·첫 줄 대기 시간 초과면 해당 구간은 기록하지 않음
+            print(f"🔥 [{self.name}] Flash {job.status}: {job.to_dict()['phases_ms']}", flush=True)
+            if self.metrics:
+                self.metrics.inc('flashes_total', job.status)
+                for phase, seconds in job.phases.items():
+                    self.metrics.flash_phase[phase].observe(seconds)
+            job.done.set()
+
+    def _run_flasher(self, job):
+        try:
+            proc = subprocess.Popen(job.argv, cwd=self.flash_cwd or FLASH_CWD, stdin=subprocess.DEVNULL,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        except (FileNotFoundError, NotADirectoryError, PermissionError) as e:
+            # 예: ESP-IDF export.sh 없이 시작한 서버 - 클라이언트(--flash)가 직접 플래시하도록 'missing'으로 알림
+            job.status, job.error = 'missing', f"flasher not available on server: {e}"
+            self.append_log(f"[FLASH] {job.error}")
+            job.end_phase('reattach')
+            return
+        timer = threading.Timer(FLASH_TIMEOUT_SEC, proc.kill)
+        timer.start()
+        framer = LineFramer()
+        try:
+            while True:
+                chunk = os.read(proc.stdout.fileno(), 65536)
+                lines = framer.feed(chunk) if chunk else framer.flush()
+                for line in lines:
+                    # 진행률 출력(\r로 덮어쓰기)은 마지막 상태만
+                    text = line.decode('utf-8', errors='replace').rstrip('\r').rpartition('\r')[2]
+                    self.append_log(f"[FLASH] {text}")
+                    job.output_lines += 1
+                if not chunk:
+                    break
+            job.returncode = proc.wait()
+        finally:
+            timed_out = not timer.is_alive()
+            timer.cancel()
+            proc.stdout.close()
+        if timed_out:
+            job.status = 'timeout'
+        elif job.returncode == 127:  # 셸 래퍼의 command not found
+            job.status = 'missing'
+        else:
+            job.status = 'ok' if job.returncode == 0 else 'failed'
+        self.append_log(f"[FLASH] {job.status} (exit {job.returncode})")
+        job.end_phase('reattach')
+
+def add_device(device):
+    with devices_lock:
+        devices[device.name] = device
+    return device
+
+def default_device():
+    """기존 단일 포트 라우트(/api/sync, /reboot 등)가 사용하는 기본 장치"""
+    return next(iter(devices.values()))
+
+def load_devices(config_path=None, discover=False, log_dir=None, record_dir=None, replay=None, series_rules=()):
+    """장치 목록 구성: 설정 파일(JSON) → USB 시리얼 자동 검색 → 캡처 재생 → 기본 단일 포트 순
+
+    설정 파일 형식: {"devices": [{"name": "rack1-a", "port": "/dev/ttyUSB0", "baud": 921600, "usb": "303a:1001"}]}
+    ("usb"는 선택, 'VID:PID[:SERIAL]' - 포트 이름이 바뀌어도 이 보드만 따라감,
+     "framing"은 선택, 'text'(기본)/'slip'/'cobs')
+    "series": 시계열 추출 정규식 목록 (최상위는 모든 장치, 장치 항목 안은 그 장치만, SERIES_RULES·series_rules에 추가)
+    "flash"/"flash_cwd": 장치별 플래셔 명령·실행 위치 (기본 FLASH_COMMAND/FLASH_CWD)
+    log_dir 지정 시 장치마다 log_dir/<이름>/ 에 디스크 로그 저장, record_dir 지정 시 원시 바이트 녹화
+    replay: 캡처 재생 포트 URL (replay://파일?speed=N)
+    """
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+
+    rules = tuple(SERIES_RULES) + tuple(series_rules)
+
+    def make(name, port, baud=BAUD_RATE, scan=False, usb_id=None, framing='text', series=(), flash=None, flash_cwd=None):
+        if framing not in FRAMING_MODES:
+            raise ValueError(f"{name}: unknown framing '{framing}' (expected one of {', '.join(FRAMING_MODES)})")
+        store = LogStore(os.path.join(log_dir, name)) if log_dir else None
+        capture = CaptureWriter(os.path.join(record_dir, f"{name}-{stamp}.cap"), baud) if record_dir else None
+        return SerialDevice(name, port, baud, scan=scan, store=store, usb_id=usb_id, capture=capture,
+                            framing=framing, series_rules=rules + tuple(series), flash_command=flash,
+                            flash_cwd=flash_cwd)
+
+    found = []
+    if config_path:
+        with open(config_path) as f:
+            config = json.load(f)
+        rules += tuple(config.get('series', ()))
+        for entry in config.get('devices', []):
+            found.append(make(entry['name'], entry['port'], entry.get('baud', BAUD_RATE),
+                              scan=entry.get('scan', False),
+                              usb_id=parse_usb_id(entry['usb']) if entry.get('usb') else None,
+                              framing=entry.get('framing', 'text'), series=entry.get('series', ()),
+                              flash=entry.get('flash'), flash_cwd=entry.get('flash_cwd')))
+    if discover:
+        configured = {d.port for d in found}
+        for port in serial.tools.list_ports.comports():
+            if _is_usb_serial(port) and port.device not in configured:
+                name = re.sub(r'[^A-Za-z0-9_.-]', '_', os.path.basename(port.device))
+                usb_id = (port.vid, port.pid, port.serial_number) if port.vid is not None else None
+                found.append(make(name, port.device, usb_id=usb_id))
+    if replay:
+        name = os.path.splitext(os.path.basename(replay[len('replay://'):].partition('?')[0]))[0]
+        found.append(make(f"replay-{name}", replay))
+    if not found:
+        found.append(make('default', SERIAL_PORT, scan=True))
+    with devices_lock:
+        devices.clear()
+        for device in found:
+            devices[device.name] = device
+    return found
+
+# --- 시리얼 연결 감시 쓰레드 ---
+def serial_listener(stop_event=None):
+    """모든 장치의 연결을 한 쓰레드에서 감시 (미연결 포트마다 쓰레드를 두지 않음, 연결된 장치만 전용 리더 사용)
+
+    미연결 장치가 있으면 DISCOVERY_POLL_SEC마다 포트 목록 변경만 확인하고, 포트가 다시 나타나면 바로 연결
+    """
+    scanner = PortScanner()
+    flushed_at = 0.0
+    while stop_event is None or not stop_event.is_set():
+        listener_wake.clear()
+        with devices_lock:
+            targets = list(devices.values())
+        now = time.monotonic()
+        waiting = [d for d in targets if d.serial_inst is None and not d.paused]
+        if waiting:
+            scanner.poll(now)
+            # 다른 장치가 사용 중(플래시 중 포함)이거나 설정해 둔 포트는 검색 대상에서 제외
+            claimed = {d.active_port for d in targets if d.is_connected or d.paused} | {d.port for d in targets}
+            for device in waiting:
+                if now >= device.retry_at and device.connect(scanner, claimed - {device.port}, stop_event):
+                    claimed.add(device.active_port)
+        # 디스크 로그는 주기적으로 배치 기록
+        if now - flushed_at >= 1.0:
+            flushed_at = now
+            for device in targets:
+                if device.store:
+                    device.store.flush()
+                if device.capture:
+                    device.capture.flush()
+        # 연결이 끊기면 disconnect()가 깨워 즉시 재탐색
+        listener_wake.wait(DISCOVERY_POLL_SEC if waiting else 1.0)
+
+def close_stores():
+    """종료 시 대기 중인 디스크 로그·캡처 기록"""
+    with devices_lock:
+        targets = list(devices.values())
+    for device in targets:
+        if device.store:
+            device.store.close()
+        if device.capture:
+            device.capture.close()
+
+load_devices()
+
+# --- 멀티 프로세스 서빙 (수집 프로세스 ↔ 웹 워커) ---
+# 수집 프로세스: 시리얼 리더 + 공유 링 기록 + 제어 소켓, 웹 워커: 공유 링을 읽어 sync/stream 응답, TX·리셋 등은 제어 소켓으로
+_CONTROL_METHODS = frozenset({'send', 'reboot', 'status', 'history', 'oldest_id', 'search', 'series_query', 'commands',
+                              'start_flash', 'flash_status', 'metrics'})
+_CONTROL_ERRORS = {'TxQueueFull': TxQueueFull, 'FlashBusy': FlashBusy, 'ValueError': ValueError, 'error': re.error}
+control_client = None  # 웹 워커에서만 설정 (ControlClient)
+
+def publish_shared(run_dir):
+    """수집 프로세스: 장치마다 공유 링을 만들어 LogRing에 연결하고 manifest.json(제어 소켓·인증 키 포함) 기록"""
+    os.makedirs(run_dir, exist_ok=True)
+    entries = []
+    with devices_lock:
+        targets = list(devices.values())
+    for dev in targets:
+        ring = os.path.join(run_dir, f"{dev.name}.ring")
+        with dev.log_queue.cond:
+            dev.log_queue.mirror = SharedLogWriter(ring, dev.log_queue.capacity, start_id=dev.log_queue.last_id)
+        dev.log_queue.mirror.set_connected(dev.is_connected)
+        entries.append({"name": dev.name, "port": dev.port, "framing": dev.framing, "ring": ring})
+    manifest = {"pid": os.getpid(), "control": os.path.join(run_dir, 'control.sock'),
+                "authkey": os.urandom(16).hex(), "devices": entries}
+    path = os.path.join(run_dir, 'manifest.json')
+    with os.fdopen(os.open(path + '.tmp', os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+def open_control(manifest):
+    """수집 프로세스: 제어 소켓 열기 (워커 fork 전에 bind, accept는 control_server 쓰레드에서)"""
+    if os.path.exists(manifest['control']):
+        os.unlink(manifest['control'])
+    return Listener(manifest['control'], family='AF_UNIX', authkey=bytes.fromhex(manifest['authkey']))
+
+def close_shared(listener, run_dir=None):
+    """종료 시 제어 소켓·공유 링을 먼저 닫은 뒤 임시 run_dir 삭제
+
+    (디렉터리를 먼저 지우면 multiprocessing 종료자가 이미 없는 control.sock을 지우다 FileNotFoundError 출력)
+    """
+    listener.close()
+    with devices_lock:
+        targets = list(devices.values())
+    for dev in targets:
+        with dev.log_queue.cond:
+            mirror, dev.log_queue.mirror = dev.log_queue.mirror, None
+        if mirror:
+            mirror.close()
+    if run_dir:
+        shutil.rmtree(run_dir, True)
+
+def control_server(listener, owned, stop_event=None):
+    """수집 프로세스: 웹 워커 연결마다 쓰레드 1개로 owned(이름 → SerialDevice) 장치에 대한 요청 처리"""
+    while stop_event is None or not stop_event.is_set():
+        try:
+            conn = listener.accept()
+        except AuthenticationError:
+            continue
+        except OSError:
+            return  # 소켓 닫힘
+        threading.Thread(target=_serve_control, args=(conn, owned), daemon=True).start()
+
+def _serve_control(conn, owned):
+    with conn:
+        while True:
             try:
-                new_inst = serial.Serial(port, BAUD_RATE, timeout=0.1)
-                new_inst.dtr = False
-                new_inst.rts = False
-                with serial_lock:
-                    serial_inst = new_inst
-                    is_connected = True
-                print(f"📡 Serial Connected: {port}")
-                
-                # 연결 직후 ESP32 안정화 대기
-                time.sleep(1.0)
-                print("📡 [AUTO] Serial connection established")
+                method, name, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = ('ok', _control_call(owned, method, name, args))
             except Exception as e:
-                if time.time() % 5 < 0.2:
-                    print(f"⌛ Serial port {port} error: {e}", flush=True)
-                with serial_lock:
-                    is_connected = False
-                    serial_inst = None
-                time.sleep(1)
-                continue
-        
-        # 2. 데이터 읽기 및 명령 전송
-        try:
-            chunk = None
-            with serial_lock:
-                if serial_inst and serial_inst.in_waiting:
-                    chunk = serial_inst.read(serial_inst.in_waiting)
-            
-            if chunk:
-                buffer += chunk
-            
-            if b"\n" in buffer:
-                lines = buffer.split(b"\n")
-                buffer = lines.pop()
-                for l in lines:
-                    text = l.decode('utf-8', errors='replace').rstrip('\r\n')
-                    log_sequence += 1
-                    log_queue.append({"id": log_sequence, "text": text, "time": time.strftime("%H:%M:%S")})
-                    
-                    # 자동 재부팅 감지 비활성화 - HARD RESET 버튼으로만 리셋
+                reply = ('error', type(e).__name__, str(e))
+            conn.send(reply)
 
-        except Exception as e:
-            print(f"❌ Serial Error: {e}", flush=True)
-            with serial_lock:
-                is_connected = False
-                if serial_inst:
-                    try: serial_inst.close()
-                    except: pass
-                serial_inst = None
-            # 리셋 후 USB 재연결 대기 (포트 번호 바뀜 대응)
-            time.sleep(2)
-        
-        time.sleep(0.01)
+def _control_call(owned, method, name, args):
+    if method not in _CONTROL_METHODS:
+        raise ValueError(f"unknown control method: {method}")
+    if method == 'metrics':
+        return render_metrics(list(owned.values()))
+    dev = owned.get(name)
+    if dev is None:
+        raise ValueError(f"unknown device: {name}")
+    if method == 'search':
+        if dev.search_index is None:
+            raise ValueError("search is not available for binary framing")
+        return dev.search_index.search(**args[0])
+    return getattr(dev, method)(*args)
+
+class ControlClient:
+    """웹 워커 → 수집 프로세스 요청 (요청 쓰레드마다 연결 1개, 끊기면 한 번 다시 연결)"""
+
+    def __init__(self, address, authkey):
+        self.address = address
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def call(self, method, name=None, *args):
+        for attempt in (0, 1):
+            conn = getattr(self._local, 'conn', None)
+            try:
+                if conn is None:
+                    conn = self._local.conn = Client(self.address, family='AF_UNIX', authkey=self.authkey)
+                conn.send((method, name, args))
+                reply = conn.recv()
+                break
+            except (EOFError, OSError):
+                self._local.conn = None
+                if attempt:
+                    raise
+        if reply[0] == 'ok':
+            return reply[1]
+        raise _CONTROL_ERRORS.get(reply[1], RuntimeError)(reply[2])
+
+class _RemoteSearch:
+    """SearchIndex.search()를 수집 프로세스에 위임"""
+
+    def __init__(self, control, name):
+        self.control = control
+        self.name = name
+
+    def search(self, query, **options):
+        return self.control.call('search', self.name, dict(options, query=query))
+
+class RemoteDevice:
+    """웹 워커 쪽 장치: 로그는 공유 링에서 직접 읽고 TX/리셋/검색/상태/히스토리는 수집 프로세스에 요청
+
+    Flask/ASGI 라우트가 쓰는 SerialDevice 속성과 같은 이름을 제공 (metrics/store 없음)
+    """
+
+    metrics = None
+    store = None
+
+    def __init__(self, entry, control):
+        self.name = entry['name']
+        self.port = entry['port']
+        self.framing = entry['framing']
+        self.log_queue = SharedLogRing(entry['ring'])
+        self.search_index = _RemoteSearch(control, self.name) if self.framing == 'text' else None
+        self.expects = ExpectHub() if self.framing == 'text' else None  # 이 워커의 대기는 공유 링을 읽어 검사
+        self.sync_cache = ResponseCache()
+        self.async_wake = AsyncBroadcast()
+        self._control = control
+        self._seen = None
+
+    @property
+    def is_connected(self):
+        return self.log_queue.connected
+
+    @property
+    def serial_inst(self):
+        """라우트의 연결 여부 확인용 (실제 포트는 수집 프로세스에 있음)"""
+        return True if self.is_connected else None
+
+    def status(self):
+        return self._control.call('status', self.name)
+
+    def history(self, from_id, to_id, limit=None):
+        return self._control.call('history', self.name, from_id, to_id, limit)
+
+    def oldest_id(self):
+        return self._control.call('oldest_id', self.name)
+
+    def send(self, data, kind='line'):
+        return self._control.call('send', self.name, data, kind)
+
+    def reboot(self):
+        return self._control.call('reboot', self.name)
+
+    def commands(self):
+        return self._control.call('commands', self.name)
+
+    def series_query(self, name=None, since=None, until=None, points=300):
+        return self._control.call('series_query', self.name, name, since, until, points)
+
+    def start_flash(self):
+        return self._control.call('start_flash', self.name)
+
+    def flash_status(self, wait_sec=0):
+        return self._control.call('flash_status', self.name, wait_sec)
+
+    def notify(self):
+        with self.log_queue.cond:
+            self.log_queue.cond.notify_all()
+        self.async_wake.wake()
+
+    def poll_changes(self):
+        """공유 링 헤더가 바뀌었으면(새 로그·연결 상태) 이 프로세스의 스트림·expect 대기자를 깨움"""
+        seen = (self.log_queue.last_id, self.log_queue.connected)
+        if seen != self._seen:
+            self._seen = seen
+            self.notify()
+            hub = self.expects
+            if hub and hub.waits:
+                for record in self.log_queue.since(hub.fed_id)[0]:
+                    hub.feed(record)
+            elif hub:
+                hub.fed_id = seen[0]
+
+def attach_shared(run_dir):
+    """웹 워커: manifest.json의 장치를 RemoteDevice로 등록하고 공유 링 감시 쓰레드 시작"""
+    global control_client
+    with open(os.path.join(run_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    control_client = ControlClient(manifest['control'], bytes.fromhex(manifest['authkey']))
+    found = [RemoteDevice(entry, control_client) for entry in manifest['devices']]
+    with devices_lock:
+        devices.clear()
+        for device in found:
+            devices[device.name] = device
+    threading.Thread(target=shared_watcher, args=(manifest['pid'],), daemon=True, name="shared-watcher").start()
+    return found
+
+def shared_watcher(owner_pid, stop_event=None):
+    """웹 워커: SHM_POLL_SEC마다 공유 링 헤더만 확인 (락 없음), 수집 프로세스가 끝나면 워커도 종료"""
+    checked_at = time.monotonic()
+    while stop_event is None or not stop_event.is_set():
+        with devices_lock:
+            targets = list(devices.values())
+        for dev in targets:
+            dev.poll_changes()
+        if time.monotonic() - checked_at >= 1.0:
+            checked_at = time.monotonic()
+            try:
+                os.kill(owner_pid, 0)
+            except ProcessLookupError:
+                print("❌ Ingest process exited - stopping web worker", flush=True)
+                os._exit(1)
+        time.sleep(SHM_POLL_SEC)
+
+def serve_workers(count, host, port, run_dir, asgi=False):
+    """수집 프로세스에서 웹 워커 count개를 fork (리스닝 소켓 하나를 공유해 커널이 연결을 분배)
+
+    리더/제어 쓰레드를 시작하기 전에 호출 (fork 시 다른 쓰레드의 락 상태를 물려받지 않도록)
+    """
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # 수락한 연결이 물려받음 (헤더/본문 분할 전송 지연 방지)
+    sock.bind((host, port))
+    sock.listen(128)
+    pids = []
+    for _ in range(count):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                attach_shared(run_dir)
+                if asgi:
+                    import uvicorn
+                    uvicorn.run(asgi_app, fd=sock.fileno(), log_level='warning')
+                else:
+                    from werkzeug.serving import make_server
+                    make_server(host, port, app, threaded=True, fd=sock.fileno()).serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                os._exit(0)  # 부모의 atexit(close_stores 등)를 실행하지 않음
+        pids.append(pid)
+    sock.close()
+    return pids
 
 # --- 웹 대시보드 템플릿 (Premium UI) ---
 INDEX_HTML = '''
@@ -215,13 +3101,13 @@ INDEX_HTML = '''
             flex: 1;
             overflow-y: auto;
             padding: 15px 20px;
-            display: flex;
-            flex-direction: column;
-            gap: 1px;
             scroll-behavior: auto;
             position: relative;
             z-index: 1;
         }
+        /* 가상화 뷰포트: spacer가 전체 높이를 차지하고, 보이는 줄만 rows에 그림 */
+        #console-spacer { position: relative; }
+        #console-rows { position: absolute; top: 0; left: 0; right: 0; will-change: transform; }
 
         .log-line {
             display: flex;
@@ -229,11 +3115,13 @@ INDEX_HTML = '''
             padding: 1px 8px;
             border-radius: 4px;
             transition: background 0.2s;
-            animation: fadeIn 0.2s ease-out;
+            white-space: nowrap;
         }
+        .log-line.log-new { animation: fadeIn 0.35s ease-out; }
         .log-line:hover { background: var(--log-hover); }
-        .log-time { color: var(--text-color); opacity: 0.6; min-width: 80px; font-size: 12px; }
-        .log-text { word-break: break-all; white-space: pre-wrap; color: var(--text-color); }
+        .log-time { color: var(--text-color); opacity: 0.6; min-width: 80px; font-size: 12px; flex-shrink: 0; }
+        .log-text { white-space: pre; overflow: hidden; text-overflow: ellipsis; color: var(--text-color); }
+        .log-hex { font-variant-ligatures: none; opacity: 0.9; }
 
         @keyframes fadeIn {
             from { opacity: 0; transform: translateY(-2px); }
@@ -259,6 +3147,29 @@ INDEX_HTML = '''
         .btn-primary { background: var(--accent-color); color: white; border: none; }
         [data-theme="retro"] .btn-primary { color: black; background: #00ff00; }
         .btn-primary:hover { opacity: 0.9; }
+        #device-select { display: none; }
+
+        /* 송신 입력창 */
+        #tx-bar {
+            display: flex;
+            gap: 10px;
+            padding: 8px 20px;
+            background: var(--card-bg);
+            border-top: 1px solid #30363d;
+            z-index: 10;
+        }
+        [data-theme="light"] #tx-bar { border-top: 1px solid #d0d7de; }
+        [data-theme="retro"] #tx-bar { border-top: 1px solid #00ff00; }
+        #tx-input {
+            flex: 1;
+            background: var(--bg-color);
+            color: var(--text-color);
+            border: 1px solid #30363d;
+            border-radius: 6px;
+            padding: 6px 10px;
+            font-family: inherit;
+            font-size: 13px;
+        }
     </style>
 </head>
 <body>
@@ -266,22 +3177,179 @@ INDEX_HTML = '''
         <div style="display:flex; align-items:center; gap:15px;">
             <h3 style="margin:0; color:var(--accent-color);">ESP32 CONSOLE</h3>
             <div id="status-badge" class="status-badge offline">CONNECTING...</div>
+            <select class="btn" id="device-select" onchange="selectDevice(this.value)"></select>
         </div>
         <div class="controls">
             <button class="btn" id="theme-btn" onclick="toggleTheme()">THEME: DARK</button>
             <button class="btn" id="scroll-toggle" onclick="toggleAutoScroll()">AUTO-SCROLL: ON</button>
+            <button class="btn" id="anim-toggle" onclick="toggleAnimation()">ANIMATION: OFF</button>
             <button class="btn" onclick="clearConsole()">CLEAR</button>
             <button class="btn btn-primary" id="reboot-btn" onclick="rebootESP()">HARD RESET</button>
         </div>
     </div>
-    <div id="console"></div>
+    <div id="console"><div id="console-spacer"><div id="console-rows"></div></div></div>
+    <form id="tx-bar" onsubmit="sendLine(event)">
+        <input id="tx-input" placeholder="Send to device (Enter)" autocomplete="off">
+        <button class="btn" type="submit">SEND</button>
+    </form>
 
     <script>
         let lastId = 0;
+        // 장치 선택 (?device=이름, 없으면 기본 장치)
+        const deviceName = new URLSearchParams(location.search).get('device');
+        const apiBase = deviceName ? `/api/${encodeURIComponent(deviceName)}` : '/api';
+        const rebootUrl = deviceName ? `/${encodeURIComponent(deviceName)}/reboot` : '/reboot';
         let autoScroll = true;
         let rebootInProgress = false;
         const consoleEl = document.getElementById('console');
-        
+        const spacerEl = document.getElementById('console-spacer');
+        const rowsEl = document.getElementById('console-rows');
+
+        // --- 가상화 뷰포트: 로그는 배열에 보관하고 화면에 보이는 줄만 프레임당 한 번 그림 ---
+        const MAX_ROWS = 200000;    // 브라우저에 보관할 최대 줄 수 (넘으면 오래된 줄부터 한꺼번에 버림)
+        const OVERSCAN = 20;        // 화면 위아래로 미리 그려 둘 줄 수
+        const HISTORY_PAGE = 500;   // 맨 위로 스크롤 시 서버(/history)에서 더 가져올 줄 수
+        let rows = [];              // {id, time, text, color, key, fresh}
+        let rowSeq = 0;
+        let rowHeight = 0;
+        let renderPending = false;
+        let renderedKey = '';
+        let historyDone = false;
+        let clearedAt = 0;          // CLEAR 시점의 마지막 id (이전 로그 조회의 하한)
+        let loadingHistory = false;
+        let animate = localStorage.getItem('esp_animate') === 'on';
+
+        function scheduleRender() {
+            if (renderPending) return;
+            renderPending = true;
+            requestAnimationFrame(render);
+        }
+
+        // 바이너리 프레임(base64 "data") → hex/ASCII 덤프 (화면에 그려지는 줄만 변환)
+        function frameBytes(b64) {
+            const raw = atob(b64);
+            const bytes = new Uint8Array(raw.length);
+            for (let i = 0; i < raw.length; i++) bytes[i] = raw.charCodeAt(i);
+            return bytes;
+        }
+
+        function hexChunk(bytes, start, width) {
+            let hex = '', ascii = '';
+            for (let i = start; i < start + width; i++) {
+                if (i < bytes.length) {
+                    const b = bytes[i];
+                    hex += (b < 16 ? '0' : '') + b.toString(16) + ' ';
+                    ascii += b >= 32 && b < 127 ? String.fromCharCode(b) : '.';
+                } else {
+                    hex += '   ';
+                }
+            }
+            return hex + '|' + ascii + '|';
+        }
+
+        function hexLine(b64) {
+            const bytes = frameBytes(b64);
+            const width = Math.min(bytes.length, 32);
+            return `[${bytes.length}B] ` + hexChunk(bytes, 0, width) + (bytes.length > width ? ' …' : '');
+        }
+
+        function hexDump(b64) {
+            const bytes = frameBytes(b64);
+            const lines = [];
+            for (let off = 0; off < bytes.length && off < 4096; off += 16) {
+                lines.push(off.toString(16).padStart(4, '0') + '  ' + hexChunk(bytes, off, 16));
+            }
+            return lines.join('\\n');
+        }
+
+        function makeRow(row) {
+            const div = document.createElement('div');
+            div.className = row.fresh ? 'log-line log-new' : 'log-line';
+            row.fresh = false;
+            const time = document.createElement('span');
+            time.className = 'log-time';
+            time.textContent = row.time;
+            const text = document.createElement('span');
+            text.className = row.data ? 'log-text log-hex' : 'log-text';
+            if (row.text === undefined) row.text = hexLine(row.data);
+            text.textContent = row.text;
+            if (row.color) text.style.color = row.color;
+            if (row.data) text.title = hexDump(row.data);
+            else if (row.text.length > 120) text.title = row.text;
+            div.append(time, text);
+            return div;
+        }
+
+        function measureRow() {
+            const probe = makeRow({ time: 'SYSTEM', text: 'X' });
+            rowsEl.appendChild(probe);
+            const height = probe.getBoundingClientRect().height || 18;
+            probe.remove();
+            renderedKey = '';
+            return height;
+        }
+
+        function render() {
+            renderPending = false;
+            if (!rowHeight) rowHeight = measureRow();
+            spacerEl.style.height = `${rows.length * rowHeight}px`;
+            if (autoScroll) consoleEl.scrollTop = consoleEl.scrollHeight;
+            const top = consoleEl.scrollTop - spacerEl.offsetTop;
+            const start = Math.max(0, Math.floor(top / rowHeight) - OVERSCAN);
+            const end = Math.min(rows.length, Math.ceil((top + consoleEl.clientHeight) / rowHeight) + OVERSCAN);
+            // 보이는 범위가 그대로면 DOM을 건드리지 않음 (일시정지 중 텍스트 선택 유지)
+            const key = end > start ? `${start}:${end}:${rows[start].key}:${rows[end - 1].key}` : '';
+            if (key !== renderedKey) {
+                renderedKey = key;
+                const fragment = document.createDocumentFragment();
+                for (let i = start; i < end; i++) fragment.appendChild(makeRow(rows[i]));
+                rowsEl.style.transform = `translateY(${start * rowHeight}px)`;
+                rowsEl.replaceChildren(fragment);
+            }
+            if (!autoScroll && top < rowHeight * OVERSCAN) loadOlder();
+        }
+
+        function pushRows(batch) {
+            for (const row of batch) {
+                row.key = ++rowSeq;
+                rows.push(row);
+            }
+            if (rows.length > MAX_ROWS * 1.1) {
+                const removed = rows.length - MAX_ROWS;
+                rows = rows.slice(removed);
+                if (!autoScroll) consoleEl.scrollTop -= removed * rowHeight;
+            }
+            scheduleRender();
+        }
+
+        // 버퍼 맨 위까지 스크롤하면 이전 로그를 서버에서 페이지 단위로 가져옴
+        async function loadOlder() {
+            const firstId = rows.length ? rows[0].id : 0;
+            if (loadingHistory || historyDone || !firstId || firstId <= clearedAt + 1) return;
+            loadingHistory = true;
+            try {
+                const from = Math.max(clearedAt + 1, firstId - HISTORY_PAGE);
+                const res = await fetch(`${apiBase}/history?from_id=${from}&to_id=${firstId - 1}`);
+                const data = await res.json();
+                if (!rows.length || rows[0].id !== firstId) return;
+                if (!data.logs || !data.logs.length) {
+                    historyDone = true;
+                    return;
+                }
+                const older = data.logs.map(msg => ({ id: msg.id, time: msg.time, text: msg.text, data: msg.data, key: ++rowSeq }));
+                rows = older.concat(rows);
+                consoleEl.scrollTop += older.length * rowHeight;
+                scheduleRender();
+            } catch (e) {
+                console.error("History error", e);
+            } finally {
+                loadingHistory = false;
+            }
+        }
+
+        consoleEl.addEventListener('scroll', scheduleRender, { passive: true });
+        window.addEventListener('resize', scheduleRender);
+
         // 테마 설정
         const themes = ['dark', 'retro', 'light'];
         let currentThemeIndex = 0;
@@ -305,17 +3373,58 @@ INDEX_HTML = '''
             
             const btn = document.getElementById('theme-btn');
             if(btn) btn.textContent = `THEME: ${theme.toUpperCase()}`;
+            // 테마마다 글꼴이 달라 줄 높이를 다시 잼
+            rowHeight = 0;
+            scheduleRender();
         }
         
         // 초기화 시 실행
         initTheme();
 
+        // 장치가 2개 이상이면 선택 목록 표시
+        async function loadDevices() {
+            try {
+                const res = await fetch('/api/devices');
+                const data = await res.json();
+                if (data.devices.length < 2) return;
+                const select = document.getElementById('device-select');
+                select.innerHTML = '';
+                data.devices.forEach((d, index) => {
+                    const opt = document.createElement('option');
+                    opt.value = d.name;
+                    opt.textContent = `${d.name} (${d.connected ? 'ONLINE' : 'OFFLINE'})`;
+                    opt.selected = deviceName ? d.name === deviceName : index === 0;
+                    select.appendChild(opt);
+                });
+                select.style.display = 'inline-block';
+            } catch (e) {
+                console.error("Device list error", e);
+            }
+        }
+
+        function selectDevice(name) {
+            location.search = `?device=${encodeURIComponent(name)}`;
+        }
+
+        loadDevices();
+
         function toggleAutoScroll() {
             autoScroll = !autoScroll;
             document.getElementById('scroll-toggle').textContent = `AUTO-SCROLL: ${autoScroll ? 'ON' : 'OFF'}`;
         }
 
-        function clearConsole() { consoleEl.innerHTML = ''; }
+        function toggleAnimation() {
+            animate = !animate;
+            localStorage.setItem('esp_animate', animate ? 'on' : 'off');
+            document.getElementById('anim-toggle').textContent = `ANIMATION: ${animate ? 'ON' : 'OFF'}`;
+        }
+        document.getElementById('anim-toggle').textContent = `ANIMATION: ${animate ? 'ON' : 'OFF'}`;
+
+        function clearConsole() {
+            rows = [];
+            clearedAt = lastId;
+            scheduleRender();
+        }
 
         async function rebootESP() {
             if(rebootInProgress || !confirm('ESP32를 강제 리셋하시겠습니까?')) return;
@@ -325,178 +3434,942 @@ INDEX_HTML = '''
             try {
                 const ctrl = new AbortController();
                 const t = setTimeout(() => ctrl.abort(), 1000);
-                const res = await fetch('/reboot', { method: 'POST', signal: ctrl.signal });
+                const res = await fetch(rebootUrl, { method: 'POST', signal: ctrl.signal });
                 clearTimeout(t);
                 const data = await res.json();
-                const div = document.createElement('div');
-                div.className = 'log-line';
                 if(data.success) {
-                    div.innerHTML = `<span class="log-time">SYSTEM</span><span class="log-text" style="color:#3fb950;">>>> Reboot command sent. Device restarting...</span>`;
+                    appendSystemLine('>>> Reboot command sent. Device restarting...', '#3fb950');
                 } else {
-                    div.innerHTML = `<span class="log-time">SYSTEM</span><span class="log-text" style="color:#f85149;">>>> Reboot failed: ${escapeHtml(data.error || data.message || '')}</span>`;
+                    appendSystemLine(`>>> Reboot failed: ${data.error || data.message || ''}`, '#f85149');
                 }
-                consoleEl.appendChild(div);
             } finally {
                 rebootInProgress = false;
                 if(btn) { btn.disabled = false; btn.textContent = 'HARD RESET'; }
             }
         }
 
+        function setBadge(connected) {
+            const badge = document.getElementById('status-badge');
+            if (badge) {
+                badge.textContent = connected ? 'ONLINE' : 'OFFLINE';
+                badge.className = `status-badge ${connected ? 'online' : 'offline'}`;
+            }
+        }
+
         async function sync() {
             try {
-                const res = await fetch(`/api/sync?last_id=${lastId}`);
-                const data = await res.json();
-                
-                // 상태 업데이트
-                const badge = document.getElementById('status-badge');
-                if (badge) {
-                    badge.textContent = data.connected ? 'ONLINE' : 'OFFLINE';
-                    badge.className = `status-badge ${data.connected ? 'online' : 'offline'}`;
-                }
+                const res = await fetch(`${apiBase}/sync?last_id=${lastId}`);
+                applySync(await res.json());
+            } catch (e) {
+                console.error("Sync error", e);
+            }
+        }
 
-                // 서버가 재시작되어 sequence가 초기화된 경우 처리
-                if (data.last_id < lastId) {
-                    console.log("Server restarted, resetting lastId");
-                    lastId = 0;
-                    return; // 다음 주기부터 다시 가져옴
-                }
+        function applySync(data) {
+            // 상태 업데이트
+            setBadge(data.connected);
+            // sequence가 다시 시작되면 이전 CLEAR 지점은 의미 없음
+            if (data.reset || data.last_id < lastId) clearedAt = 0;
 
-                if (data.logs && data.logs.length > 0) {
-                    // 로그를 순차적으로 추가하여 부드러운 애니메이션 효과 연출
-                    data.logs.forEach((msg, index) => {
-                        setTimeout(() => {
-                            const div = document.createElement('div');
-                            div.className = 'log-line';
-                            div.innerHTML = `<span class="log-time">${msg.time}</span><span class="log-text">${escapeHtml(msg.text)}</span>`;
-
-                            // 초기 상태: 투명하고 아래에서 오는 효과
-                            div.style.opacity = '0';
-                            div.style.transform = 'translateY(8px)';
-                            div.style.transition = 'opacity 0.35s ease-out, transform 0.35s ease-out';
-
-                            consoleEl.appendChild(div);
-
-                            // 애니메이션 트리거 (다음 프레임에)
-                            requestAnimationFrame(() => {
-                                div.style.opacity = '1';
-                                div.style.transform = 'translateY(0)';
-                            });
-
-                            // 줄 수 관리 (메모리 최적화)
-                            while(consoleEl.children.length > 1000) {
-                                const firstChild = consoleEl.firstChild;
-                                if(firstChild) consoleEl.removeChild(firstChild);
-                            }
-
-                            // 부드러운 스크롤 (마지막 로그에만 적용)
-                            if(autoScroll && index === data.logs.length - 1) {
-                                setTimeout(() => {
-                                    consoleEl.scrollTo({
-                                        top: consoleEl.scrollHeight,
-                                        behavior: 'smooth'
-                                    });
-                                }, 50);
-                            }
-                        }, index * 20); // 20ms 간격으로 빠르게 순차 출력 (섞임 방지 최적화)
-                    });
-                }
-                
-                // 로그 유무와 상관없이 항상 최신 ID로 갱신
-                lastId = data.last_id;
+            // 서버가 재시작되어 sequence가 초기화된 경우 처리
+            if (data.last_id < lastId && !data.reset) {
+                console.log("Server restarted, resetting lastId");
+                lastId = 0;
+                return; // 다음 주기부터 다시 가져옴
+            }
 
-            } catch (e) {
-                console.error("Sync error", e);
+            if (data.logs && data.logs.length > 0) {
+                // 한 번에 배열에 넣고 다음 프레임에 한 번만 그림 (줄마다 DOM 갱신하지 않음)
+                const batch = data.logs.map(msg => ({ id: msg.id, time: msg.time, text: msg.text, data: msg.data }));
+                if (animate && autoScroll) batch.slice(-OVERSCAN * 2).forEach(row => { row.fresh = true; });
+                pushRows(batch);
             }
+            
+            // 로그 유무와 상관없이 항상 최신 ID로 갱신
+            lastId = data.last_id;
         }
 
-        function escapeHtml(text) {
-            const div = document.createElement('div');
-            div.textContent = text;
-            return div.innerHTML;
+        // 서버 푸시 스트림 (미지원 브라우저는 기존 폴링으로 대체)
+        function startStream() {
+            if (!window.EventSource) {
+                setInterval(sync, 120);
+                return;
+            }
+            // 재접속 시 브라우저가 Last-Event-ID 헤더로 커서를 전달
+            const es = new EventSource(`${apiBase}/stream?last_id=${lastId}`);
+            es.onmessage = (e) => applySync(JSON.parse(e.data));
+            es.onerror = () => setBadge(false);
+        }
+
+        function appendSystemLine(text, color) {
+            pushRows([{ time: 'SYSTEM', text, color }]);
+        }
+
+        // 장치로 한 줄 전송 (서버 송신 대기열 경유)
+        async function sendLine(event) {
+            event.preventDefault();
+            const input = document.getElementById('tx-input');
+            const data = input.value;
+            if (!data) return;
+            try {
+                const res = await fetch(`${apiBase}/send`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ data })
+                });
+                const result = await res.json();
+                if (result.success) {
+                    input.value = '';
+                } else {
+                    appendSystemLine(`>>> Send failed: ${result.message || ''}`, '#f85149');
+                }
+            } catch (e) {
+                appendSystemLine(`>>> Send failed: ${e}`, '#f85149');
+            }
         }
 
-        setInterval(sync, 120);
+        startStream();
     </script>
 </body>
 </html>
 '''
 
+# --- 요청 처리 (Flask/ASGI 공용) ---
+_SSE_RETRY = b"retry: 1000\n\n"
+_SSE_KEEPALIVE = b": keep-alive\n\n"
+_SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+def _record_filter_from(args):
+    """요청의 level=E,W / tag=wifi,main 파라미터로 레코드 필터 생성"""
+    levels = args.get('level')
+    tags = args.get('tag')
+    return record_filter(levels.split(',') if levels else None, tags.split(',') if tags else None)
+
+def devices_summary():
+    """전체 장치 상태 요약 (집계 뷰)"""
+    with devices_lock:
+        targets = list(devices.values())
+    return {
+        "devices": [d.status() for d in targets],
+        "connected": sum(d.is_connected for d in targets),
+        "count": sum(len(d.log_queue) for d in targets),
+    }
+
+def status_summary(dev):
+    status = dev.status()
+    return {key: status[key] for key in ("status", "count", "last_id", "connected")}
+
+def expect_begin(dev, payload):
+    """expect 요청 등록 후 커서(after_id) 이후 이미 수신된 줄 검사 → (ExpectWait, 대기 시간 초)
+
+    payload: {"patterns": [정규식, ...] 또는 문자열, "after_id": N(기본: 현재 마지막 id), "timeout": 초,
+              "exact": true(정규식 대신 문자열), "all": true(모든 패턴이 나올 때까지)}
+    잘못된 요청은 ValueError
+    """
+    if dev.expects is None:
+        raise ValueError("expect is not available for binary framing")
+    patterns = payload.get('patterns', payload.get('pattern'))
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    if not patterns or not isinstance(patterns, list) or not all(isinstance(p, str) and p for p in patterns):
+        raise ValueError("patterns is required")
+    if len(patterns) > EXPECT_MAX_PATTERNS:
+        raise ValueError(f"too many patterns (max {EXPECT_MAX_PATTERNS})")
+    if payload.get('exact'):
+        patterns = [re.escape(p) for p in patterns]
+    try:
+        timeout = min(max(float(payload.get('timeout', EXPECT_TIMEOUT_SEC)), 0.0), EXPECT_MAX_TIMEOUT_SEC)
+        last_id = dev.log_queue.last_id
+        after_id = payload.get('after_id')
+        after_id = last_id if after_id is None else min(int(after_id), last_id)  # 서버 재시작으로 커서가 앞서면 지금부터
+    except (TypeError, ValueError):
+        raise ValueError("timeout and after_id must be numbers") from None
+    try:
+        wait = dev.expects.register(patterns, after_id, bool(payload.get('all')))
+    except re.error as e:
+        raise ValueError(f"Invalid regex: {e}") from e
+    # 등록 후에 읽어야 등록 전후에 들어온 줄을 놓치지 않음 (겹친 줄은 같은 매칭이라 무해)
+    records, gap = dev.log_queue.since(after_id)
+    if gap:
+        from_id = max(gap['from_id'], gap['to_id'] - EXPECT_MAX_BACKLOG + 1)
+        while from_id <= gap['to_id'] and not (wait.done() and not wait.need_all):
+            logs = dev.history(from_id, gap['to_id'], HISTORY_MAX_LINES)
+            if not logs:
+                break
+            dev.expects.scan(wait, ((log['id'], log['text'], log['ts']) for log in logs))
+            from_id = logs[-1]['id'] + 1
+    dev.expects.scan(wait, ((r.id, r.text, r.timestamp) for r in records))
+    return wait, timeout
+
+def expect_finish(dev, wait, started):
+    """대기 해제 후 응답 dict (다음 요청의 after_id는 match.id 또는 last_id)"""
+    dev.expects.cancel(wait)
+    result = wait.result()
+    result["last_id"] = dev.log_queue.last_id
+    result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+def reboot_device(dev):
+    """리셋 명령을 송신 대기열에 넣고 (HTTP 상태, 응답 dict) 반환"""
+    if not dev.serial_inst:
+        return 400, {"success": False, "message": "No serial connection"}
+    # 즉시 200 반환 후, 실제 전송은 writer 쓰레드에서 수행 (버튼이 RESETTING...에서 멈추지 않음)
+    try:
+        cmd = dev.reboot()
+    except TxQueueFull as e:
+        return 503, {"success": False, "message": str(e)}
+    return 200, {"success": True, "command_id": cmd.id}
+
+def sync_response(dev, args, headers):
+    """/api/sync 응답 (HTTP 상태, 헤더 dict, 본문 bytes) - args/headers는 MultiDict/Headers 호환 객체"""
+    started = time.perf_counter()
+    status, out, body = _sync_response(dev, args, headers)
+    metrics = dev.metrics
+    if metrics:
+        metrics.sync_seconds.observe(time.perf_counter() - started)
+        metrics.inc('sync_requests_total', str(status))
+        cursor = args.get('last_id', 0, type=int)
+        metrics.sync_lag.observe(max(dev.log_queue.last_id - cursor, 0) if cursor else len(dev.log_queue))
+    return status, out, body
+
+def _sync_response(dev, args, headers):
+    try:
+        log_queue = dev.log_queue
+        current_last_id = int(args.get('last_id', 0))
+        limit = args.get('limit', type=int)
+        levels, tags = args.get('level'), args.get('tag')
+        encoding = negotiate_encoding(headers.get('Accept-Encoding'))
+        # 같은 상태·같은 커서 요청은 한 번 만든 (압축된) 응답을 공유
+        state = (log_queue.last_id, log_queue.first_id, dev.is_connected)
+        key = (current_last_id, limit, levels, tags, encoding)
+        response = dev.sync_cache.get(state, key, lambda: _build_sync_response(
+            dev, state, key, current_last_id, limit, levels, tags, encoding))
+    except Exception as e:
+        body = json.dumps({"connected": False, "last_id": 0, "logs": [], "error": str(e)}).encode()
+        return 200, {'Content-Type': 'application/json'}, body
+    etag = f'W/"{response.etag}"'
+    if parse_etags(headers.get('If-None-Match')).contains_weak(response.etag):
+        return 304, {'ETag': etag}, b""
+    out = {'Content-Type': 'application/json', 'ETag': etag, 'Vary': 'Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if response.encoding:
+        out['Content-Encoding'] = response.encoding
+    return 200, out, response.body
+
+def _build_sync_response(dev, state, key, current_last_id, limit, levels, tags, encoding):
+    """/api/sync 본문 생성: 로그는 수집 시 인코딩해 둔 JSON 조각을 이어 붙임"""
+    log_queue = dev.log_queue
+    # level=E,W / tag=wifi 필터는 파싱된 필드만 비교 (텍스트 재스캔 없음)
+    predicate = record_filter(levels.split(',') if levels else None, tags.split(',') if tags else None)
+    # 슬라이스는 state를 찍은 시점의 head_id까지만: 그 사이 추가된 줄은 다음 폴링에서 (중복 전달 방지)
+    head_id, first_id, connected = state
+    if predicate:
+        scanned, gap = log_queue.since(current_last_id, limit, until=head_id)
+        fragments = [r.json for r in scanned if predicate(r)]
+        scanned_last = scanned[-1].id if scanned else None
+    else:
+        # 커서 이후 로그만 링 버퍼에서 바로 슬라이스 (limit 지정 시 페이지 단위)
+        fragments, scanned_last, gap = log_queue.encoded_since(current_last_id, limit, until=head_id)
+    body = encode_envelope({
+        "connected": connected,
+        "last_id": scanned_last if scanned_last is not None and limit is not None else head_id,
+        "head_id": head_id,
+        "first_id": first_id,
+        "gap": gap,
+        "more": scanned_last is not None and scanned_last < head_id,
+        "status": "Connected" if connected else "Disconnected",
+        "count": head_id - first_id + 1,
+    }, fragments)
+    etag = '%08x' % zlib.crc32(repr((_ETAG_EPOCH, dev.name, state, key)).encode())
+    if encoding and len(body) >= COMPRESS_MIN_BYTES:
+        return EncodedResponse(compress_body(body, encoding), etag, encoding)
+    return EncodedResponse(body, etag, None)
+
+class StreamCursor:
+    """SSE 스트림 1개의 커서·필터 상태 (Flask 쓰레드 모드와 asyncio 모드가 공유)"""
+
+    def __init__(self, dev, cursor=0, matcher=None, predicate=None):
+        self.dev = dev
+        self.cursor = cursor
+        self.matcher = matcher
+        self.predicate = predicate
+        self.sent_connected = None
+        self.sent_at = time.monotonic()
+
+    @classmethod
+    def from_request(cls, dev, args, headers):
+        """Last-Event-ID 또는 last_id 커서와 q/level/tag 필터로 생성 (잘못된 정규식·바이너리 장치의 q는 ValueError)"""
+        try:
+            cursor = int(headers.get('Last-Event-ID') or args.get('last_id', 0))
+        except ValueError:
+            cursor = 0
+        # q/level/tag 지정 시 조건에 맞는 줄만 전송하는 필터 스트림
+        matcher = None
+        if args.get('q'):
+            if dev.search_index is None:
+                raise ValueError("q filter is not available for binary framing")
+            try:
+                matcher = compile_matcher(args['q'], args.get('regex') == '1', args.get('case') != '1')
+            except re.error as e:
+                raise ValueError(f"Invalid regex: {e}") from e
+        return cls(dev, cursor, matcher, _record_filter_from(args))
+
+    def ready(self):
+        """새 로그, 연결 상태 변경, sequence 역행(서버 재시작) 중 하나라도 있으면 True"""
+        return self.dev.log_queue.last_id != self.cursor or self.dev.is_connected != self.sent_connected
+
+    def idle_timeout(self):
+        """다음 keep-alive까지 남은 시간 (초)"""
+        return max(0.0, self.sent_at + STREAM_HEARTBEAT_SEC - time.monotonic())
+
+    def poll(self):
+        """보낼 SSE 데이터: 새 이벤트, 오래 조용했으면 keep-alive, 둘 다 아니면 None"""
+        event = self._next_event() if self.ready() else None
+        now = time.monotonic()
+        if event is None and now - self.sent_at >= STREAM_HEARTBEAT_SEC:
+            event = _SSE_KEEPALIVE
+        if event is not None:
+            self.sent_at = now
+        return event
+
+    def _next_event(self):
+        log_queue = self.dev.log_queue
+        with log_queue.cond:
+            # 서버 재시작 등으로 sequence가 커서보다 작으면 처음부터 다시 전송
+            reset = self.cursor > log_queue.last_id
+            if reset:
+                self.cursor = 0
+            new_logs, gap = log_queue.since(self.cursor)
+            last_id = log_queue.last_id
+            connected = self.dev.is_connected
+        if self.dev.metrics:
+            self.dev.metrics.stream_lag.observe(last_id - self.cursor)
+        if self.predicate:
+            new_logs = [log for log in new_logs if self.predicate(log)]
+        if self.matcher:
+            new_logs = [log for log in new_logs if self.matcher(log.text)]
+        # 필터에 걸리지 않은 줄도 커서는 넘김 (같은 줄을 다시 검사하지 않음)
+        self.cursor = last_id
+        if not new_logs and connected == self.sent_connected and not reset:
+            return None
+        self.sent_connected = connected
+        payload = encode_envelope({"connected": connected, "last_id": last_id, "gap": gap, "reset": reset},
+                                  [log.json for log in new_logs])
+        return b"id: %d\ndata: %s\n\n" % (last_id, payload)
+
+# --- Flask 라우트 ---
+def _get_device(name):
+    device = devices.get(name)
+    if device is None:
+        abort(404, description=f"Unknown device: {name}")
+    return device
+
 @app.route('/')
 def index():
     return render_template_string(INDEX_HTML)
 
+@app.route('/api/devices')
+def api_devices():
+    return jsonify(devices_summary())
+
 @app.route('/api/sync')
 @app.route('/sync') # 하위 호환성 유지
-def api_sync():
+@app.route('/api/<device>/sync')
+def api_sync(device=None):
+    dev = _get_device(device) if device else default_device()
+    status, headers, body = sync_response(dev, request.args, request.headers)
+    return Response(body, status=status, headers=headers)
+
+@app.route('/api/stream')
+@app.route('/api/<device>/stream')
+def api_stream(device=None):
+    """Server-Sent Events 로그 스트림 (재접속 시 Last-Event-ID 또는 last_id 커서부터 재개)"""
+    dev = _get_device(device) if device else default_device()
     try:
-        current_last_id = int(request.args.get('last_id', 0))
-        # 새 로그만 필터링
-        new_logs = [log for log in log_queue if log['id'] > current_last_id]
-        return jsonify({
-            "connected": is_connected,
-            "last_id": log_sequence,
-            "logs": new_logs,
-            "status": "Connected" if is_connected else "Disconnected",
-            "count": len(log_queue)
-        })
-    except Exception as e:
-        return jsonify({"connected": False, "last_id": 0, "logs": [], "error": str(e)})
+        stream = StreamCursor.from_request(dev, request.args, request.headers)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    cond = dev.log_queue.cond
 
-@app.route('/status') # 하위 호환성 유지
-def api_status():
+    def generate():
+        if dev.metrics:
+            dev.metrics.stream_opened()
+        try:
+            yield _SSE_RETRY
+            while True:
+                with cond:
+                    cond.wait_for(stream.ready, timeout=stream.idle_timeout())
+                event = stream.poll()
+                if event:
+                    yield event
+        finally:
+            if dev.metrics:
+                dev.metrics.stream_opened(-1)
+
+    return Response(generate(), mimetype='text/event-stream', headers=_SSE_HEADERS)
+
+@app.route('/api/history')
+@app.route('/api/<device>/history')
+def api_history(device=None):
+    """디스크 로그 범위 조회 (from_id~to_id, 최대 HISTORY_MAX_LINES줄씩)"""
+    dev = _get_device(device) if device else default_device()
+    from_id = request.args.get('from_id', 1, type=int)
+    to_id = request.args.get('to_id', dev.log_queue.last_id, type=int)
+    limit = min(request.args.get('limit', HISTORY_MAX_LINES, type=int), HISTORY_MAX_LINES)
+    logs = dev.history(from_id, to_id, limit)
     return jsonify({
-        "status": "Connected" if is_connected else "Disconnected",
-        "count": len(log_queue),
-        "last_id": log_sequence,
-        "connected": is_connected
+        "logs": logs,
+        "from_id": from_id,
+        "to_id": to_id,
+        "first_id": dev.oldest_id(),
+        "last_id": logs[-1]['id'] if logs else from_id - 1,
+        "more": bool(logs) and len(logs) == limit and logs[-1]['id'] < to_id,
     })
 
-def _do_reboot_sequence():
-    """백그라운드에서 REBOOT 1회 전송 (확실히 flush)"""
-    global serial_inst, log_queue
-    print("🔄 _do_reboot_sequence() called")
-    with serial_lock:
-        if not serial_inst:
-            print("❌ No serial connection for reboot")
-            return
-        try:
-            serial_inst.write(b"REBOOT\n")
-            serial_inst.flush()
-            log_queue.clear()
-            print("✅ REBOOT sent (once).")
-        except Exception as e:
-            print(f"❌ Reboot send failed: {e}")
-            return
+@app.route('/api/frames')
+@app.route('/api/<device>/frames')
+def api_frames(device=None):
+    """last_id 이후 레코드를 바이너리로 묶어 전송 (base64/JSON 없이 프레임 원본)
 
-        # DTR/RTS 핀 제어로 ESP32 하드웨어 리셋
-        try:
-            print("🔌 Performing hardware reset via DTR/RTS")
-            # ESP32 리셋 시퀀스: DTR=Low, RTS=High -> DTR=High, RTS=Low
-            serial_inst.setDTR(False)
-            serial_inst.setRTS(True)
-            time.sleep(0.1)
-            serial_inst.setDTR(True)
-            serial_inst.setRTS(False)
-            time.sleep(0.1)
-            serial_inst.setDTR(False)
-            serial_inst.setRTS(False)
-            print("✅ Hardware reset sequence completed")
-        except Exception as e:
-            print(f"❌ Hardware reset failed: {e}")
+    본문: 레코드마다 FRAME_HEADER(id, 수신 epoch ns, 길이) + 바이트 (텍스트 장치는 UTF-8 줄)
+    X-Last-Id: 다음 요청의 last_id, X-Gap: 버퍼에서 밀려나 빠진 'from-to' id 범위
+    """
+    dev = _get_device(device) if device else default_device()
+    last_id = request.args.get('last_id', 0, type=int)
+    limit = min(request.args.get('limit', HISTORY_MAX_LINES, type=int), HISTORY_MAX_LINES)
+    logs, gap = dev.log_queue.since(last_id, limit)
+    parts = []
+    for log in logs:
+        data = log.text if isinstance(log.text, bytes) else log.text.encode('utf-8')
+        parts.append(FRAME_HEADER.pack(log.id, log.ts_ns + _WALL_OFFSET_NS, len(data)))
+        parts.append(data)
+    headers = {'X-Last-Id': str(logs[-1].id if logs else last_id), 'Cache-Control': 'no-store'}
+    if gap:
+        headers['X-Gap'] = f"{gap['from_id']}-{gap['to_id']}"
+    return Response(b''.join(parts), mimetype='application/octet-stream', headers=headers)
+
+@app.route('/api/search')
+@app.route('/api/<device>/search')
+def api_search(device=None):
+    """메모리 버퍼 검색 (q=문자열, regex=1, case=1 대소문자 구분, from_id/to_id, since/until=epoch 초, context=N)"""
+    dev = _get_device(device) if device else default_device()
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify({"error": "q is required"}), 400
+    if dev.search_index is None:
+        return jsonify({"error": "search is not available for binary framing"}), 400
+    started = time.perf_counter()
+    try:
+        matches, more = dev.search_index.search(
+            query,
+            regex=request.args.get('regex') == '1',
+            ignore_case=request.args.get('case') != '1',
+            from_id=request.args.get('from_id', type=int),
+            to_id=request.args.get('to_id', type=int),
+            since=request.args.get('since', type=float),
+            until=request.args.get('until', type=float),
+            limit=min(request.args.get('limit', 100, type=int), SEARCH_MAX_RESULTS),
+            context=min(request.args.get('context', 0, type=int), SEARCH_MAX_CONTEXT),
+        )
+    except re.error as e:
+        return jsonify({"error": f"Invalid regex: {e}"}), 400
+    return jsonify({
+        "matches": matches,
+        "ids": [m['id'] for m in matches],
+        "count": len(matches),
+        "more": more,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+    })
+
+@app.route('/api/series')
+@app.route('/api/<device>/series')
+def api_series(device=None):
+    """추출된 수치 시계열 (name 없으면 목록, name=이름&since/until=epoch 초&points=N이면 구간별 min/max/avg)"""
+    dev = _get_device(device) if device else default_device()
+    name = request.args.get('name')
+    if not name:
+        return jsonify({"series": dev.series_query()})
+    points = min(request.args.get('points', 300, type=int), SERIES_MAX_POINTS)
+    try:
+        result = dev.series_query(name, request.args.get('since', type=float),
+                                  request.args.get('until', type=float), points)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if result is None:
+        return jsonify({"error": f"unknown series: {name}"}), 404
+    return jsonify(result)
+
+@app.route('/api/expect', methods=['POST'])
+@app.route('/api/<device>/expect', methods=['POST'])
+def api_expect(device=None):
+    """long-poll: 패턴 목록 중 하나가 after_id 이후 줄에 나오거나 timeout이 지나면 응답 (JSON 형식은 expect_begin 참고)"""
+    dev = _get_device(device) if device else default_device()
+    started = time.perf_counter()
+    try:
+        wait, timeout = expect_begin(dev, request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def generate():
+        # 대기 중 주기적으로 공백(JSON 앞 공백은 무해)을 보내 끊긴 연결은 쓰기 실패 → 응답 종료로 감지
+        deadline = time.monotonic() + timeout
+        while not wait.event.wait(min(EXPECT_KEEPALIVE_SEC, max(deadline - time.monotonic(), 0.0))):
+            if time.monotonic() >= deadline:
+                break
+            yield b" "
+        yield json.dumps(expect_finish(dev, wait, started)).encode()
+
+    response = Response(generate(), mimetype='application/json')
+    # 시작 전에 닫힌 제너레이터는 finally가 실행되지 않으므로 응답 종료 시점에 해제
+    response.call_on_close(lambda: dev.expects.cancel(wait))
+    return response
+
+@app.route('/api/flash', methods=['GET', 'POST'])
+@app.route('/api/<device>/flash', methods=['GET', 'POST'])
+def api_flash(device=None):
+    """POST: 리더를 멈추고 포트를 플래셔에 넘긴 뒤 바로 재연결 ({"wait": true}면 끝날 때까지 대기), GET: 마지막 작업 (wait=초)
+
+    플래셔 명령은 설정(FLASH_COMMAND, 장치별 "flash")으로만 지정 (요청으로 임의 명령을 실행하지 않음)
+    """
+    dev = _get_device(device) if device else default_device()
+    max_wait = FLASH_TIMEOUT_SEC + FLASH_REATTACH_SEC + FLASH_BOOT_WAIT_SEC
+    if request.method == 'GET':
+        job = dev.flash_status(min(request.args.get('wait', 0, type=float), max_wait))
+        if job is None:
+            return jsonify({"error": "no flash job"}), 404
+        return jsonify(job)
+    payload = request.get_json(silent=True) or {}
+    try:
+        job = dev.start_flash()
+    except FlashBusy as e:
+        return jsonify({"error": str(e)}), 409
+    if not payload.get('wait'):
+        return jsonify(job), 202
+    return jsonify(dev.flash_status(max_wait))
+
+@app.route('/status') # 하위 호환성 유지
+@app.route('/<device>/status')
+def api_status(device=None):
+    dev = _get_device(device) if device else default_device()
+    return jsonify(status_summary(dev))
 
 @app.route('/reboot', methods=['POST'])
-def reboot():
-    global serial_inst
-    if not serial_inst:
+@app.route('/<device>/reboot', methods=['POST'])
+def reboot(device=None):
+    dev = _get_device(device) if device else default_device()
+    status, payload = reboot_device(dev)
+    return jsonify(payload), status
+
+@app.route('/api/send', methods=['POST'])
+@app.route('/api/<device>/send', methods=['POST'])
+def api_send(device=None):
+    """장치로 한 줄 전송 (JSON {"data": "...", "eol": "\\n"}), 송신 대기열에 넣고 즉시 반환"""
+    dev = _get_device(device) if device else default_device()
+    payload = request.get_json(silent=True) or request.form
+    data = payload.get('data')
+    eol = payload.get('eol', '\n')
+    if data is None:
+        return jsonify({"success": False, "message": "data is required"}), 400
+    if not isinstance(data, str) or not isinstance(eol, str):
+        return jsonify({"success": False, "message": "data and eol must be strings"}), 400
+    if not dev.serial_inst:
         return jsonify({"success": False, "message": "No serial connection"}), 400
-    # 즉시 200 반환 후, 실제 전송은 백그라운드에서 수행 (버튼이 RESETTING...에서 멈추지 않음)
-    threading.Thread(target=_do_reboot_sequence, daemon=True).start()
-    return jsonify({"success": True})
+    try:
+        cmd = dev.send((data + eol).encode('utf-8'))
+    except TxQueueFull as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+    return jsonify({"success": True, "command": cmd.to_dict()}), 202
+
+@app.route('/api/commands')
+@app.route('/api/<device>/commands')
+def api_commands(device=None):
+    """최근 송신 명령과 구간별 타이밍"""
+    dev = _get_device(device) if device else default_device()
+    return jsonify(dev.commands())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus 지표 (--no-metrics로 끄면 404)"""
+    if not METRICS_ENABLED:
+        abort(404)
+    if control_client:
+        return Response(control_client.call('metrics'), mimetype='text/plain; version=0.0.4')
+    with devices_lock:
+        targets = list(devices.values())
+    return Response(render_metrics(targets), mimetype='text/plain; version=0.0.4')
 
 @app.route('/favicon.ico')
 def favicon():
     return open('terminal-icon.svg', 'rb').read(), 200, {'Content-Type': 'image/svg+xml'}
 
+# --- ASGI 서빙 (asyncio, --asgi) ---
+# 스트림 접속은 쓰레드 없이 이벤트 루프에서 대기하고, 전용 처리기가 없는 라우트는 Flask 앱으로 위임
+_INDEX_HTML_BYTES = INDEX_HTML.encode('utf-8')
+
+def _asgi_request(scope):
+    """ASGI scope → (쿼리 MultiDict, Headers) - Flask의 request.args/headers와 같은 인터페이스"""
+    args = MultiDict(parse_qsl(scope.get('query_string', b'').decode('latin-1'), keep_blank_values=True))
+    headers = Headers([(k.decode('latin-1'), v.decode('latin-1')) for k, v in scope.get('headers', ())])
+    return args, headers
+
+async def _asgi_respond(send, status, headers, body=b""):
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]})
+    await send({'type': 'http.response.body', 'body': body})
+
+async def _asgi_json(send, payload, status=200):
+    await _asgi_respond(send, status, {'Content-Type': 'application/json'}, json.dumps(payload).encode())
+
+async def _asgi_wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+async def _asgi_index(scope, receive, send):
+    await _asgi_respond(send, 200, {'Content-Type': 'text/html; charset=utf-8'}, _INDEX_HTML_BYTES)
+
+async def _asgi_favicon(scope, receive, send):
+    with open('terminal-icon.svg', 'rb') as f:
+        await _asgi_respond(send, 200, {'Content-Type': 'image/svg+xml'}, f.read())
+
+async def _asgi_devices(scope, receive, send):
+    await _asgi_json(send, devices_summary())
+
+async def _asgi_sync(scope, receive, send, dev):
+    status, headers, body = sync_response(dev, *_asgi_request(scope))
+    await _asgi_respond(send, status, headers, body)
+
+async def _asgi_status(scope, receive, send, dev):
+    await _asgi_json(send, status_summary(dev))
+
+async def _asgi_reboot(scope, receive, send, dev):
+    status, payload = reboot_device(dev)
+    await _asgi_json(send, payload, status)
+
+async def _asgi_stream(scope, receive, send, dev):
+    """SSE 스트림: 리더 쓰레드의 wake()로 깨어나며 접속당 쓰레드를 쓰지 않음"""
+    try:
+        stream = StreamCursor.from_request(dev, *_asgi_request(scope))
+    except ValueError as e:
+        return await _asgi_json(send, {"error": str(e)}, 400)
+    headers = dict(_SSE_HEADERS, **{'Content-Type': 'text/event-stream'})
+    await send({'type': 'http.response.start', 'status': 200,
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in headers.items()]})
+    await send({'type': 'http.response.body', 'body': _SSE_RETRY, 'more_body': True})
+    disconnected = asyncio.ensure_future(_asgi_wait_disconnect(receive))
+    if dev.metrics:
+        dev.metrics.stream_opened()
+    try:
+        while True:
+            waiter = dev.async_wake.current()
+            if not stream.ready():
+                await asyncio.wait((waiter, disconnected), timeout=stream.idle_timeout(),
+                                   return_when=asyncio.FIRST_COMPLETED)
+            if disconnected.done():
+                break
+            event = stream.poll()
+            if event:
+                await send({'type': 'http.response.body', 'body': event, 'more_body': True})
+    finally:
+        disconnected.cancel()
+        if dev.metrics:
+            dev.metrics.stream_opened(-1)
+
+async def _asgi_body(receive):
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return bytes(body)
+
+async def _asgi_expect(scope, receive, send, dev):
+    """expect long-poll: 대기마다 쓰레드를 잡지 않음 (이미 수신된 줄 검사만 실행기 쓰레드에서)"""
+    started = time.perf_counter()
+    try:
+        payload = json.loads(await _asgi_body(receive) or b'{}')
+    except ValueError:
+        payload = {}
+    loop = asyncio.get_running_loop()
+    try:
+        wait, timeout = await loop.run_in_executor(None, expect_begin, dev, payload if isinstance(payload, dict) else {})
+    except ValueError as e:
+        return await _asgi_json(send, {"error": str(e)}, 400)
+    # 클라이언트가 끊으면 시간 초과까지 기다리지 않고 바로 대기 해제 (합친 정규식에서도 빠짐)
+    disconnected = asyncio.ensure_future(_asgi_wait_disconnect(receive))
+    waiter = asyncio.ensure_future(wait.wait_async(timeout))
+    try:
+        await asyncio.wait((waiter, disconnected), return_when=asyncio.FIRST_COMPLETED)
+        gone = disconnected.done()
+    finally:
+        disconnected.cancel()
+        waiter.cancel()
+        result = expect_finish(dev, wait, started)
+    if not gone:
+        await _asgi_json(send, result)
+
+def _wsgi_environ(scope, body):
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': '',
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': (scope.get('client') or ('',))[0],
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', ()):
+        key = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if key == 'CONTENT_TYPE':
+            environ[key] = value
+        elif key != 'CONTENT_LENGTH':
+            key = 'HTTP_' + key
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def _asgi_wsgi(scope, receive, send):
+    """전용 처리기가 없는 라우트(history/search/send 등)는 Flask 앱을 실행기 쓰레드에서 처리"""
+    environ = _wsgi_environ(scope, await _asgi_body(receive))
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'] = int(status.split(' ', 1)[0])
+        started['headers'] = headers
+
+    def run():
+        result = app.wsgi_app(environ, start_response)
+        try:
+            return b"".join(result)
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    data = await asyncio.get_running_loop().run_in_executor(None, run)
+    await send({'type': 'http.response.start', 'status': started['status'],
+                'headers': [(k.lower().encode('latin-1'), v.encode('latin-1')) for k, v in started['headers']]})
+    await send({'type': 'http.response.body', 'body': data})
+
+async def _asgi_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            loop = asyncio.get_running_loop()
+            for dev in list(devices.values()):
+                dev.async_wake.bind(loop)
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            for dev in list(devices.values()):
+                dev.async_wake.bind(None)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# (메서드, 경로 패턴, 처리기) - device 그룹이 있는 패턴은 처리기에 SerialDevice 전달
+_ASGI_ROUTES = [
+    ('GET', re.compile(r'/'), _asgi_index),
+    ('GET', re.compile(r'/favicon\.ico'), _asgi_favicon),
+    ('GET', re.compile(r'/api/devices'), _asgi_devices),
+    ('GET', re.compile(r'/sync'), _asgi_sync),
+    ('GET', re.compile(r'/api/(?:(?P<device>[^/]+)/)?sync'), _asgi_sync),
+    ('GET', re.compile(r'/api/(?:(?P<device>[^/]+)/)?stream'), _asgi_stream),
+    ('GET', re.compile(r'/(?:(?P<device>[^/]+)/)?status'), _asgi_status),
+    ('POST', re.compile(r'/(?:(?P<device>[^/]+)/)?reboot'), _asgi_reboot),
+    ('POST', re.compile(r'/api/(?:(?P<device>[^/]+)/)?expect'), _asgi_expect),
+]
+
+async def asgi_app(scope, receive, send):
+    """ASGI 진입점 (uvicorn serial_web_server:asgi_app 또는 --asgi)"""
+    if scope['type'] == 'lifespan':
+        return await _asgi_lifespan(receive, send)
+    if scope['type'] != 'http':
+        return
+    for method, pattern, handler in _ASGI_ROUTES:
+        match = pattern.fullmatch(scope['path'])
+        if not match or scope['method'] != method:
+            continue
+        if 'device' not in pattern.groupindex:
+            return await handler(scope, receive, send)
+        name = match['device']
+        dev = devices.get(name) if name else default_device()
+        if dev is not None:
+            return await handler(scope, receive, send, dev)
+        break  # 알 수 없는 장치는 Flask의 404 응답 사용
+    await _asgi_wsgi(scope, receive, send)
+
+# --- expect 클라이언트 (pytest 등 테스트 코드용, 표준 라이브러리만 사용) ---
+class MonitorClient:
+    """실행 중인 서버의 장치 1개를 테스트에서 사용 (포트를 점유하지 않으므로 웹 화면으로 계속 볼 수 있음)
+
+        dut = MonitorClient('http://localhost:8080', 'rack1-a')
+        dut.start()                        # 이 시점 이후의 출력만 대상 (테스트 시작 전에 호출)
+        dut.expect('Hello world!')          # 정규식, 매칭된 줄 이후로 커서 이동
+        dut.expect([r'IP: (\\S+)', 'panic'], timeout=60)['groups']
+    """
+
+    def __init__(self, url='http://localhost:8080', device=None):
+        self.url = url.rstrip('/')
+        self.device = f"/{quote(device, safe='')}" if device else ''
+        self.cursor = None  # 다음 expect의 after_id (None이면 서버의 현재 위치부터)
+
+    def _call(self, path, payload=None, timeout=10.0):
+        data = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.url + path, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            return json.load(resp)
+
+    def start(self):
+        """커서를 현재 마지막 줄로 (이후 expect는 이 시점 이후 출력에서 찾음)"""
+        self.cursor = self._call(f"{self.device}/status")['last_id']
+        return self.cursor
+
+    def expect(self, patterns, timeout=EXPECT_TIMEOUT_SEC, exact=False, expect_all=False):
+        """patterns(정규식 1개 또는 목록) 중 하나(expect_all이면 전부)가 나올 때까지 대기 → 매칭 dict, 시간 초과는 TimeoutError"""
+        payload = {"patterns": patterns, "timeout": timeout, "exact": exact, "all": expect_all}
+        if self.cursor is not None:
+            payload["after_id"] = self.cursor
+        result = self._call(f"/api{self.device}/expect", payload, timeout=timeout + 10)
+        if not result['matched']:
+            raise TimeoutError(f"not found within {timeout}s: {patterns!r} (last_id={result['last_id']})")
+        if expect_all:
+            self.cursor = max(m['id'] for m in result['matches'])
+            return result['matches']
+        self.cursor = result['match']['id']
+        return result['match']
+
+    def expect_exact(self, patterns, timeout=EXPECT_TIMEOUT_SEC):
+        return self.expect(patterns, timeout, exact=True)
+
+    def write(self, data):
+        """장치로 한 줄 전송 (송신 대기열에 넣고 반환)"""
+        return self._call(f"/api{self.device}/send", {"data": data})
+
+    def flash(self):
+        """서버의 플래시 작업 실행 후 결과 dict (포트 해제 → 플래셔 → 재연결, 구간별 시간 포함)"""
+        timeout = FLASH_TIMEOUT_SEC + FLASH_REATTACH_SEC + FLASH_BOOT_WAIT_SEC + 10
+        return self._call(f"/api{self.device}/flash", {"wait": True}, timeout=timeout)
+
+def _server_reachable(url, timeout=2.0):
+    """모니터 서버가 HTTP 요청을 받는지 (오류 응답도 살아 있는 것으로 봄)"""
+    try:
+        urllib.request.urlopen(f"{url}/api/devices", timeout=timeout).close()
+    except urllib.error.HTTPError:
+        pass
+    except urllib.error.URLError:
+        return False
+    except OSError:
+        pass
+    return True
+
+def flash_via_server(url, device=None):
+    """--flash: 실행 중인 서버에 플래시 요청
+
+    종료 코드: 0 성공, 1 실패(또는 응답 없음 - 플래시 상태를 알 수 없으므로 포트를 건드리지 않음),
+    3 서버 없음(응답 전에 종료된 경우 포함)·서버에 플래셔 없음 - build_and_upload.sh가 직접 플래시
+    """
+    try:
+        job = MonitorClient(url, device or None).flash()
+    except urllib.error.HTTPError as e:
+        print(f"❌ Flash request failed: {e.code} {e.read().decode('utf-8', errors='replace')}")
+        return 1
+    except urllib.error.URLError as e:
+        print(f"⚠️ No monitor server at {url}: {e.reason}")
+        return 3
+    except OSError as e:
+        # 응답 전에 끊김: 서버가 종료되는 중이었으면(다시 접속 불가) 직접 플래시
+        if isinstance(e, ConnectionError) and not _server_reachable(url):
+            print(f"⚠️ Monitor server at {url} went away: {e!r}")
+            return 3
+        # 서버는 살아 있는데 응답이 없음 (시간 초과 등) - 플래시가 진행 중일 수 있으므로 포트를 건드리지 않음
+        print(f"❌ No answer from monitor server at {url}: {e!r} (see [FLASH] lines in the dashboard)")
+        return 1
+    if job['status'] == 'missing':
+        print(f"⚠️ Monitor server cannot run the flasher: {job['error'] or 'command not found'}")
+        return 3
+    phases = ', '.join(f"{k} {job['phases_ms'][k]:.0f}ms" for k in FLASH_PHASES if k in job['phases_ms'])
+    print(f"{'✅' if job['status'] == 'ok' else '❌'} Flash {job['status']} (exit {job['returncode']}): {phases}")
+    if job['error']:
+        print(f"   {job['error']}")
+    return 0 if job['status'] == 'ok' else 1
+
 if __name__ == '__main__':
-    threading.Thread(target=serial_listener, daemon=True).start()
-    app.run(host='0.0.0.0', port=8080, debug=False)
+    parser = argparse.ArgumentParser(description="ESP32 Serial Web Monitor")
+    parser.add_argument('--config', help="장치 목록 JSON 파일 ({\"devices\": [{\"name\", \"port\", \"baud\"}]})")
+    parser.add_argument('--discover', action='store_true', help="USB 시리얼 포트마다 장치 자동 등록")
+    parser.add_argument('--log-dir', default=LOG_DIR, help="디스크 로그 저장 위치 (''이면 저장 안 함)")
+    parser.add_argument('--record', metavar='DIR', help="원시 시리얼 바이트를 DIR/<장치>-<시각>.cap 에 녹화")
+    parser.add_argument('--replay', metavar='FILE', help="캡처 파일을 장치처럼 재생 (보드 없이 재현·프로파일링)")
+    parser.add_argument('--replay-speed', type=float, default=1.0, help="재생 배속 (0이면 최대 속도)")
+    parser.add_argument('--memory-lines', type=int, default=MEMORY_RETAIN_LINES,
+                        help="링에서 밀려난 줄을 압축 블록으로 메모리에 보관할 최대 줄 수 (0이면 보관 안 함)")
+    parser.add_argument('--series', action='append', default=[], metavar='REGEX',
+                        help="시계열 추출 규칙 추가 (이름 있는 숫자 그룹, 예: 'rssi=(?P<rssi>-?\\d+)', 여러 번 지정 가능)")
+    parser.add_argument('--no-metrics', action='store_true', help="/metrics 계측 끄기")
+    parser.add_argument('--asgi', action='store_true', help="asyncio(uvicorn) 서버로 실행 - 다수의 동시 스트림 접속용")
+    parser.add_argument('--workers', type=int, default=0,
+                        help="웹 워커 프로세스 수 (0이면 한 프로세스에서 수집·서빙, N이면 이 프로세스는 수집만)")
+    parser.add_argument('--shm-dir', help="공유 로그 링·제어 소켓 위치 (--workers 시 기본: /dev/shm 임시 디렉터리)")
+    parser.add_argument('--attach', metavar='DIR', help="웹 워커로만 실행: --shm-dir DIR로 실행 중인 수집 프로세스에 연결")
+    parser.add_argument('--flash', nargs='?', const='', metavar='DEVICE',
+                        help="실행 중인 서버(--http-port)에 플래시를 요청하고 결과 출력 (서버가 없거나 서버에 플래셔가 없으면 종료 코드 3)")
+    parser.add_argument('--flash-cmd', help=f"플래셔 명령 (기본: '{FLASH_COMMAND}', {{port}}/{{baud}}/{{name}} 치환)")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--http-port', type=int, default=8080)
+    args = parser.parse_args()
+    if args.flash is not None:
+        sys.exit(flash_via_server(f"http://127.0.0.1:{args.http_port}", args.flash))
+    METRICS_ENABLED = not args.no_metrics
+    if args.flash_cmd:
+        FLASH_COMMAND = args.flash_cmd
+    MEMORY_RETAIN_LINES = args.memory_lines
+    replay = f"replay://{args.replay}?speed={args.replay_speed:g}" if args.replay else None
+    if args.asgi:
+        try:
+            import uvicorn
+        except ImportError:
+            sys.exit("❌ --asgi requires uvicorn (pip install uvicorn)")
+    workers = []
+    if args.attach:
+        attach_shared(args.attach)
+        print(f"🔌 Attached to {args.attach}: {', '.join(devices)}")
+    else:
+        load_devices(args.config, args.discover, args.log_dir, args.record, replay, args.series)
+        print(f"🔌 Devices: {', '.join(devices)}")
+        control = None
+        if args.workers or args.shm_dir:
+            run_dir = args.shm_dir
+            if not run_dir:
+                run_dir = tempfile.mkdtemp(prefix='esp-monitor-', dir='/dev/shm' if os.path.isdir('/dev/shm') else None)
+            control = open_control(publish_shared(run_dir))
+            atexit.register(close_shared, control, None if args.shm_dir else run_dir)
+            print(f"🧩 Shared log rings: {run_dir} (extra web workers: --attach {run_dir})")
+        if args.workers:
+            workers = serve_workers(args.workers, args.host, args.http_port, run_dir, args.asgi)
+            print(f"🌐 {len(workers)} web workers on {args.host}:{args.http_port}")
+        if control:
+            threading.Thread(target=control_server, args=(control, dict(devices)), daemon=True).start()
+        atexit.register(close_stores)
+        threading.Thread(target=serial_listener, daemon=True).start()
+
+    if workers:
+        signal.signal(signal.SIGTERM, signal.default_int_handler)  # 종료 시 워커도 함께 정리
+        try:
+            for pid in workers:
+                os.waitpid(pid, 0)
+        except KeyboardInterrupt:
+            for pid in workers:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+    elif args.asgi:
+        uvicorn.run(asgi_app, host=args.host, port=args.http_port, log_level='warning')
+    else:
+        app.run(host=args.host, port=args.http_port, debug=False)
@@ -0,0 +1,924 @@
+import asyncio
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import tty
+
+import pytest
+from serial.tools.list_ports_common import ListPortInfo
+
+import serial_web_server as sws
+
+
+@pytest.fixture
+def loop_device(monkeypatch: pytest.MonkeyPatch) -> sws.SerialDevice:
+    monkeypatch.setattr(sws, 'devices', {})
+    return sws.add_device(sws.SerialDevice('rack-a', 'loop://'))
+
+
+@pytest.fixture
+def ring():
+    return sws.LogRing(4)
+
+
+def test_log_ring_since_wraps_around(ring: sws.LogRing) -> None:
+    for i in range(10):
+        ring.append(f'line {i}')
+    logs, gap = ring.since(6)
+    assert [log.id for log in logs] == [7, 8, 9, 10]
+    assert gap is None
+    assert len(ring) == 4
+
+
+def test_log_ring_reports_gap_for_evicted_cursor(ring: sws.LogRing) -> None:
+    for i in range(10):
+        ring.append(f'line {i}')
+    logs, gap = ring.since(2)
+    assert [log.id for log in logs] == [7, 8, 9, 10]
+    assert gap == {'from_id': 3, 'to_id': 6}
+
+
+def test_log_ring_limit_paging(ring: sws.LogRing) -> None:
+    for i in range(3):
+        ring.append(f'line {i}')
+    logs, _ = ring.since(0, limit=2)
+    assert [log.id for log in logs] == [1, 2]
+    logs, _ = ring.since(logs[-1].id, limit=2)
+    assert [log.id for log in logs] == [3]
+
+
+def test_log_ring_clear_keeps_sequence(ring: sws.LogRing) -> None:
+    ring.append('a')
+    ring.clear()
+    assert len(ring) == 0
+    assert ring.append('b').id == 2
+
+
+def test_log_ring_seals_evicted_lines_into_compressed_blocks() -> None:
+    blocks = sws.LogBlocks(max_lines=12, block_lines=4, cache_blocks=1)
+    ring = sws.LogRing(4, blocks=blocks)
+    for i in range(1, 23):
+        ring.append(f'I ({i}) app: line {i}')
+    # 링 4줄(19~22) + 압축 블록(5~16, 한도 12줄) + 열린 블록(17~18), 1~4 블록은 보관 한도로 제거
+    assert ring.first_id == 19 and ring.oldest_id == 5
+    assert all(isinstance(b.data, bytes) for b in blocks._blocks)
+    logs = ring.history(5, 20)
+    assert [log['id'] for log in logs] == list(range(5, 21))
+    assert logs[0]['text'] == 'I (5) app: line 5' and logs[0]['tag'] == 'app'
+    assert [log['id'] for log in ring.history(1, 30, limit=3)] == [5, 6, 7]
+    assert len(blocks._cache) == 1
+    # 링 조회(tail)는 그대로 링 범위만
+    assert ring.since(0)[1] == {"from_id": 1, "to_id": 18}
+
+    ring.clear()
+    assert [log['id'] for log in ring.history(17, 22)] == list(range(17, 23))
+
+
+def test_api_sync_limit_returns_page_cursor(loop_device: sws.SerialDevice) -> None:
+    for i in range(5):
+        loop_device.append_log(f'line {i}')
+    data = sws.app.test_client().get('/api/sync?last_id=1&limit=2').get_json()
+    assert [log['id'] for log in data['logs']] == [2, 3]
+    assert data['last_id'] == 3
+    assert data['head_id'] == 5
+    assert data['more'] is True
+
+
+def test_api_sync_slices_up_to_state_snapshot(loop_device: sws.SerialDevice,
+                                               monkeypatch: pytest.MonkeyPatch) -> None:
+    for i in range(3):
+        loop_device.append_log(f'line {i}')
+    build = sws._build_sync_response
+
+    def racing_build(dev, state, *args):
+        # state를 찍은 뒤 본문을 만들기 전에 줄이 추가되는 경합
+        dev.append_log('late line')
+        return build(dev, state, *args)
+
+    monkeypatch.setattr(sws, '_build_sync_response', racing_build)
+    client = sws.app.test_client()
+    data = client.get('/api/sync?last_id=0').get_json()
+    assert [log['id'] for log in data['logs']] == [1, 2, 3]
+    assert data['last_id'] == 3
+    monkeypatch.setattr(sws, '_build_sync_response', build)
+    data = client.get('/api/sync?last_id=3').get_json()
+    assert [log['id'] for log in data['logs']] == [4]
+    assert data['last_id'] == 4
+
+
+def _sse_events(response, count):
+    """스트리밍 응답에서 SSE 이벤트 count개를 (id, data) 목록으로 읽음 (retry·keep-alive 제외)"""
+    events = []
+    for chunk in response.response:
+        if chunk.startswith(b'id: '):
+            head, data = chunk.split(b'\n', 1)
+            events.append((int(head[4:]), json.loads(data[len(b'data: '):])))
+            if len(events) == count:
+                break
+    response.close()
+    return events
+
+
+def test_api_stream_resumes_from_cursor_and_reports_gaps(loop_device: sws.SerialDevice,
+                                                          monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(loop_device, 'log_queue', sws.LogRing(4))
+    for i in range(10):
+        loop_device.append_log(f'line {i}')
+    client = sws.app.test_client()
+    # Last-Event-ID가 last_id 쿼리보다 우선
+    [(event_id, data)] = _sse_events(client.get('/api/stream?last_id=1', headers={'Last-Event-ID': '8'}), 1)
+    assert event_id == data['last_id'] == 10
+    assert [log['id'] for log in data['logs']] == [9, 10] and data['gap'] is None
+    # 커서가 링의 first_id보다 뒤처지면 전달할 수 없는 범위를 gap으로 알림
+    [(_, data)] = _sse_events(client.get('/api/stream?last_id=2'), 1)
+    assert data['gap'] == {'from_id': 3, 'to_id': 6}
+    assert [log['id'] for log in data['logs']] == [7, 8, 9, 10]
+    # 서버 재시작 등으로 커서가 last_id보다 크면 reset 후 링 전체 재전송
+    [(_, data)] = _sse_events(client.get('/api/stream', headers={'Last-Event-ID': '50'}), 1)
+    assert data['reset'] is True
+    assert [log['id'] for log in data['logs']] == [7, 8, 9, 10]
+
+
+def test_line_framer_splits_across_chunks() -> None:
+    framer = sws.LineFramer()
+    assert framer.feed(b'I (1) a', now=0) == []
+    assert framer.feed(b'bc\r\nsecond\nthi', now=0) == [b'I (1) abc\r', b'second']
+    assert framer.pending == 3
+    assert framer.feed(b'rd\n', now=0) == [b'third']
+    assert framer.pending == 0
+
+
+def test_line_framer_enforces_max_line() -> None:
+    framer = sws.LineFramer(max_line=4)
+    assert framer.feed(b'abcdefghij', now=0) == [b'abcd', b'efgh']
+    assert framer.feed(b'k\nabcdefg\n', now=0) == [b'ijk', b'abcd', b'efg']
+
+
+def test_line_framer_flushes_partial_line_when_idle() -> None:
+    framer = sws.LineFramer(idle_flush=0.3)
+    framer.feed(b'esp> ', now=10.0)
+    assert framer.flush_idle(now=10.1) == []
+    assert framer.flush_idle(now=10.4) == [b'esp> ']
+    assert framer.pending == 0
+
+
+def _wait_for(predicate, timeout: float = 5.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_serial_listener_reads_loopback_port(loop_device: sws.SerialDevice) -> None:
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: loop_device.serial_inst is not None)
+        with loop_device.write_lock:
+            loop_device.serial_inst.write(b'I (12) boot: hello\r\nsecond\n')
+        assert _wait_for(lambda: len(loop_device.log_queue) == 2)
+        assert [log.text for log in loop_device.log_queue] == ['I (12) boot: hello', 'second']
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+        loop_device.disconnect()
+
+
+def test_reader_flushes_partial_line_on_idle_deadline(loop_device: sws.SerialDevice,
+                                                      monkeypatch: pytest.MonkeyPatch) -> None:
+    # read 대기 주기가 길어도 부분 줄은 PARTIAL_FLUSH_SEC 뒤에 출력
+    monkeypatch.setattr(sws, 'SERIAL_READ_TIMEOUT', 2.0)
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: loop_device.serial_inst is not None)
+        time.sleep(0.1)  # 리더가 빈 포트에서 대기 중일 때 프롬프트 도착
+        with loop_device.write_lock:
+            loop_device.serial_inst.write(b'esp> ')
+        sent = time.monotonic()
+        assert _wait_for(lambda: len(loop_device.log_queue) == 1)
+        assert sws.PARTIAL_FLUSH_SEC <= time.monotonic() - sent < 1.0
+        assert next(iter(loop_device.log_queue)).text == 'esp> '
+        assert _wait_for(lambda: loop_device.serial_inst.timeout == 2.0)
+    finally:
+        stop.set()
+        listener.join(timeout=3)
+        loop_device.disconnect()
+
+
+def _usb_port(device: str, vid: int, pid: int, serial_number: str) -> ListPortInfo:
+    port = ListPortInfo(device, skip_link_detection=True)
+    port.vid, port.pid, port.serial_number = vid, pid, serial_number
+    return port
+
+
+def test_find_port_follows_usb_identity(monkeypatch: pytest.MonkeyPatch) -> None:
+    ports = [_usb_port('/dev/ttyACM0', 0x303a, 0x1001, 'A'), _usb_port('/dev/ttyACM1', 0x303a, 0x1001, 'B')]
+    monkeypatch.setattr(sws.serial.tools.list_ports, 'comports', lambda: ports)
+    scanner = sws.PortScanner()
+    assert scanner.poll()
+    device = sws.SerialDevice('b', '/dev/ttyACM0', usb_id=sws.parse_usb_id('303a:1001:B'))
+    # 설정 포트 이름에 다른 보드가 올라와도 식별자가 같은 포트로만 연결
+    assert device.find_port(scanner) == '/dev/ttyACM1'
+    assert device.find_port(scanner, claimed={'/dev/ttyACM1'}) is None
+
+
+def test_listener_reattaches_when_port_reappears(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    link = tmp_path / 'ttyBOARD'
+
+    def plug():
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        os.symlink(os.ttyname(slave), link)
+        return master, slave
+
+    monkeypatch.setattr(sws, 'devices', {})
+    device = sws.add_device(sws.SerialDevice('board', str(link)))
+    master, slave = plug()
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: device.is_connected)
+        os.write(master, b'first boot\n')
+        assert _wait_for(lambda: device.log_queue.last_id == 1)
+        # 리셋: 포트가 사라졌다가 새 pty로 다시 나타남
+        link.unlink()
+        os.close(master)
+        os.close(slave)
+        assert _wait_for(lambda: not device.is_connected)
+        master, slave = plug()
+        # 설정된 대기 없이 포트 재등장 직후 다시 연결 (이전에는 2초 + 1초 + 폴링 1초)
+        assert _wait_for(lambda: device.is_connected, timeout=0.5)
+        os.write(master, b'ESP-ROM:esp32s3-20210327\n')
+        assert _wait_for(lambda: device.log_queue.last_id == 2)
+        assert device.log_queue.get(2).text == 'ESP-ROM:esp32s3-20210327'
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+        device.disconnect()
+        os.close(master)
+        os.close(slave)
+
+
+def test_flash_hands_port_to_flasher_and_reattaches(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    stub = tmp_path / 'flasher.py'
+    stub.write_text("import sys\n"
+                    "with open(sys.argv[1], 'wb', buffering=0) as port:\n"
+                    "    port.write(b'SYNC')\n"
+                    "print('Connecting....')\n"
+                    "print('Writing at 0x00010000... (50 %)\\rWriting at 0x00020000... (100 %)')\n"
+                    "print('Hard resetting via RTS pin...')\n")
+    master, slave = os.openpty()
+    tty.setraw(slave)
+    monkeypatch.setattr(sws, 'devices', {})
+    device = sws.add_device(sws.SerialDevice('board', os.ttyname(slave),
+                                             flash_command=f'{sys.executable} {stub} {{port}}'))
+    stop = threading.Event()
+    threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True).start()
+    try:
+        assert _wait_for(lambda: device.is_connected)
+        os.write(master, b'before flash\n')
+        assert _wait_for(lambda: device.log_queue.last_id == 1)
+        client = sws.app.test_client()
+        assert client.post('/api/board/flash').status_code == 202
+        assert client.post('/api/board/flash').status_code == 409
+        # 재연결 직후 보드의 부트 로그
+        assert _wait_for(lambda: device.flash_job.phase == 'first_line')
+        os.write(master, b'ESP-ROM:esp32s3-20210327\n')
+        job = client.get('/api/board/flash?wait=10').get_json()
+        assert (job['status'], job['returncode'], job['output_lines']) == ('ok', 0, 3)
+        assert set(job['phases_ms']) == set(sws.FLASH_PHASES)
+        assert os.read(master, 64) == b'SYNC'  # 플래셔가 포트를 직접 사용
+        texts = [log.text for log in device.log_queue]
+        assert texts[0] == 'before flash' and texts[-1] == 'ESP-ROM:esp32s3-20210327'
+        assert 'Writing at 0x00020000... (100 %)' in ''.join(texts)
+        assert device.log_queue.get(job['first_boot_id']).text == texts[-1]
+    finally:
+        stop.set()
+        device.disconnect()
+        os.close(master)
+        os.close(slave)
+
+
+def test_flash_via_server_falls_back_when_server_cannot_flash(loop_device: sws.SerialDevice,
+                                                              monkeypatch: pytest.MonkeyPatch) -> None:
+    from werkzeug.serving import make_server
+    monkeypatch.setattr(sws, 'FLASH_REATTACH_SEC', 0.1)
+    monkeypatch.setattr(loop_device, 'flash_command', 'no-such-flasher-for-tests {port}')
+    server = make_server('127.0.0.1', 0, sws.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}'
+    try:
+        # 서버 환경에 플래셔가 없으면 스크립트가 직접 플래시하도록 종료 코드 3
+        assert sws.flash_via_server(url, 'rack-a') == 3
+        assert loop_device.flash_job.status == 'missing'
+
+        def no_answer(self):
+            raise TimeoutError('timed out')
+
+        # 서버가 살아 있는데 응답이 없으면 플래시 상태를 알 수 없으므로 실패 (트레이스백 없이)
+        with monkeypatch.context() as m:
+            m.setattr(sws.MonitorClient, 'flash', no_answer)
+            assert sws.flash_via_server(url, 'rack-a') == 1
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert sws.flash_via_server(url, 'rack-a') == 3  # 서버 없음
+
+    def reset_by_server(self):
+        raise ConnectionResetError('connection reset by peer')
+
+    # 응답 전에 끊겼고 서버도 사라졌으면 (종료 중) 직접 플래시
+    monkeypatch.setattr(sws.MonitorClient, 'flash', reset_by_server)
+    assert sws.flash_via_server(url, 'rack-a') == 3
+
+
+def test_device_routes_are_scoped_per_device(loop_device: sws.SerialDevice) -> None:
+    other = sws.add_device(sws.SerialDevice('rack-b', 'loop://'))
+    other.append_log('from b')
+    client = sws.app.test_client()
+    assert client.get('/api/rack-b/sync').get_json()['logs'][0]['text'] == 'from b'
+    assert client.get('/api/sync').get_json()['logs'] == []
+    assert [d['name'] for d in client.get('/api/devices').get_json()['devices']] == ['rack-a', 'rack-b']
+    assert client.get('/api/missing/sync').status_code == 404
+
+
+def _fill_store(store: sws.LogStore, first_id: int, count: int) -> None:
+    for record_id in range(first_id, first_id + count):
+        store.append(sws.LogRecord(record_id, f'line {record_id}', 0))
+
+
+def test_log_store_reads_ranges_across_segments(tmp_path) -> None:
+    store = sws.LogStore(str(tmp_path), segment_bytes=2048, index_interval=8)
+    _fill_store(store, 1, 500)
+    logs = store.read_range(123, 300)
+    assert [log['id'] for log in logs] == list(range(123, 301))
+    assert len(store.read_range(490, 10_000, limit=5)) == 5
+    assert len(list(tmp_path.glob('*.log'))) > 1
+    store.close()
+
+
+def test_log_store_resumes_sequence_and_drops_torn_tail(tmp_path) -> None:
+    store = sws.LogStore(str(tmp_path), index_interval=8)
+    _fill_store(store, 1, 20)
+    store.close()
+    segment = next(tmp_path.glob('*.log'))
+    with open(segment, 'ab') as f:
+        f.write(b'{"id": 21, "te')
+    device = sws.SerialDevice('persist', 'loop://', store=sws.LogStore(str(tmp_path), index_interval=8))
+    assert device.log_queue.last_id == 20
+    assert device.append_log('after restart').id == 21
+    assert device.history(19, 21)[-1]['text'] == 'after restart'
+    device.store.close()
+
+
+def test_log_store_retention_drops_oldest_segments(tmp_path) -> None:
+    store = sws.LogStore(str(tmp_path), segment_bytes=1024, max_bytes=4096)
+    _fill_store(store, 1, 500)
+    store.flush()
+    assert store.first_id > 1
+    assert store.read_range(1, 500)[0]['id'] == store.first_id
+    store.close()
+
+
+def test_log_store_ages_out_segments_without_new_writes(tmp_path) -> None:
+    store = sws.LogStore(str(tmp_path), segment_bytes=1024, max_age=3600)
+    _fill_store(store, 1, 100)
+    store.flush()
+    segments = sorted(tmp_path.glob('*.log'))
+    assert len(segments) > 2 and store.first_id == 1
+    stale = time.time() - 7200
+    for path in segments[:-1]:
+        os.utime(path, (stale, stale))
+    # 새 줄이 없어도 주기적 flush에서 보존 기간이 지난 세그먼트 삭제 (기록 중인 마지막 세그먼트는 유지)
+    store.flush()
+    assert [p.name for p in tmp_path.glob('*.log')] == [segments[-1].name]
+    assert store.read_range(1, 100)[0]['id'] == store.first_id > 1
+    store.close()
+
+
+def test_log_record_parses_esp_idf_line() -> None:
+    record = sws.LogRecord.parse(1, '\x1b[0;32mI (1234) wifi: connected\x1b[0m')
+    assert (record.level, record.tick, record.tag) == ('I', 1234, 'wifi')
+    assert record.text == 'I (1234) wifi: connected'
+    assert sws.LogRecord.parse(2, 'plain text').level is None
+
+
+def test_api_sync_filters_by_level_and_tag(loop_device: sws.SerialDevice) -> None:
+    for line in ('I (1) wifi: up', 'E (2) wifi: lost', 'E (3) heap: low', 'raw'):
+        loop_device.append_log(line)
+    client = sws.app.test_client()
+    data = client.get('/api/sync?level=E').get_json()
+    assert [log['tag'] for log in data['logs']] == ['wifi', 'heap']
+    data = client.get('/api/sync?level=E,I&tag=wifi').get_json()
+    assert [log['id'] for log in data['logs']] == [1, 2]
+    assert data['last_id'] == 4
+    assert loop_device.status()['levels']['E'] == 2
+
+
+def test_regex_literals_extracts_required_runs() -> None:
+    assert sws._regex_literals(r'wifi: connected to \w+ rssi=-?\d+') == ['wifi: connected to ', ' rssi=']
+    assert sws._regex_literals(r'boot.*done') == ['boot', 'done']
+    assert sws._regex_literals(r'(heap|stack) low') == []
+    # 클래스 안의 ']' ('^' 바로 뒤, 이스케이프)에서 클래스를 끝내면 클래스 일부가 리터럴로 잘못 잡힘
+    assert sws._regex_literals(r'[^]]key]tail') == ['key]tail']
+    assert sws._regex_literals(r'[a\]bc]def') == ['def']
+    assert sws._regex_literals(r'[]x]yz') == []
+    # {m,n} 안의 숫자와 \x·\u·\N{...}·8진수 이스케이프 인자는 리터럴이 아님 ({0,n}이면 앞 글자도 선택)
+    assert sws._regex_literals(r'boot\d{1,3}done') == ['boot', 'done']
+    assert sws._regex_literals(r'xyzab{0,2}cdef') == ['xyza', 'cdef']
+    assert sws._regex_literals(r'abc\x41def') == ['abc', 'def']
+    assert sws._regex_literals(r'abc\u0041def\N{DIGIT ONE}ghi\101jkl') == ['abc', 'def', 'ghi', 'jkl']
+
+
+def test_search_index_matches_brace_quantifier_regex(loop_device: sws.SerialDevice) -> None:
+    loop_device.append_log('I (1) app: boot42done')
+    loop_device.append_log('I (2) app: idle')
+    data = sws.app.test_client().get('/api/search', query_string={'q': r'boot\d{1,3}done', 'regex': '1'}).get_json()
+    assert [m['id'] for m in data['matches']] == [1]
+
+
+def test_search_index_matches_with_context(loop_device: sws.SerialDevice) -> None:
+    for i in range(50):
+        loop_device.append_log(f'I ({i}) wifi: rssi={-40 - i}' if i % 10 == 0 else f'I ({i}) main: tick')
+    client = sws.app.test_client()
+    data = client.get('/api/search?q=WIFI:&context=1').get_json()
+    assert data['ids'] == [1, 11, 21, 31, 41]
+    assert [r['id'] for r in data['matches'][1]['before']] == [10]
+    assert [r['id'] for r in data['matches'][1]['after']] == [12]
+    data = client.get('/api/search?q=rssi%3D-6%5Cd&regex=1').get_json()
+    assert data['ids'] == [21]
+    assert client.get('/api/search?q=(&regex=1').status_code == 400
+
+
+def test_series_extractor_downsamples_from_precomputed_tiers() -> None:
+    extractor = sws.SeriesExtractor((r'rssi=(?P<rssi>-?\d+) heap=(?P<heap>\d+)',), points=16, tiers=((1, 8), (10, 64)))
+    start = 1_700_000_000
+    for i in range(120):
+        ts_ns = (start + i) * 1_000_000_000 - sws._WALL_OFFSET_NS
+        extractor.add(sws.LogRecord.parse(i, f'I ({i}) wifi: rssi=-{i % 30} heap={1000 + i}', ts_ns))
+    extractor.add(sws.LogRecord.parse(120, 'I (120) wifi: rssi unavailable'))
+    assert {s['name']: s['count'] for s in extractor.names()} == {'rssi': 120, 'heap': 120}
+    # 2분 구간 4버킷 → 10초 단계의 버킷을 30초씩 합침
+    result = extractor.query('heap', start, start + 120, points=4)
+    assert (result['source'], result['step'], result['count']) == ('10s', 30.0, [30, 30, 30, 30])
+    assert result['min'] == [1000, 1030, 1060, 1090] and result['max'] == [1029, 1059, 1089, 1119]
+    assert result['avg'][0] == 1014.5
+    # 1초 단계보다 짧은 버킷은 원본 점에서 계산
+    result = extractor.query('rssi', start + 115, start + 117, points=4)
+    assert result['source'] == 'raw' and result['min'] == [-25, -26]
+    assert extractor.query('missing', start, start + 1) is None
+    with pytest.raises(ValueError):
+        sws.SeriesExtractor((r'rssi=\d+',))
+
+
+def test_series_extractor_prefilter_skips_quantifier_digits() -> None:
+    extractor = sws.SeriesExtractor((r'cpu\d{1,2} load=(?P<load>\d+)',), points=16, tiers=((1, 8),))
+    # 사전 필터 리터럴은 규칙의 필수 문자열에서만 ('{1,2}'의 숫자가 섞이면 매칭 줄을 건너뜀)
+    assert [literal for _, literal in extractor.rules] == [' load=']
+    extractor.add(sws.LogRecord.parse(1, 'I (1) sys: cpu12 load=40'))
+    assert extractor.names()[0]['count'] == 1
+
+
+def test_api_series_lists_and_queries(loop_device: sws.SerialDevice) -> None:
+    loop_device.series = sws.SeriesExtractor(sws.SERIES_RULES)
+    for heap in (5000, 4000, 4500):
+        loop_device.append_log(f'- Flash: 8MB, Min Heap: {heap} bytes')
+    client = sws.app.test_client()
+    assert [s['name'] for s in client.get('/api/rack-a/series').get_json()['series']] == ['min_heap']
+    data = client.get('/api/rack-a/series?name=min_heap&points=1').get_json()
+    assert (min(data['min']), max(data['max']), sum(data['count'])) == (4000, 5000, 3)
+    assert client.get('/api/rack-a/series?name=rssi').status_code == 404
+    assert client.get('/api/rack-a/series?name=min_heap&since=10&until=5').status_code == 400
+
+
+def test_expect_hub_resolves_many_waits_in_one_pass() -> None:
+    hub = sws.ExpectHub()
+    waits = [hub.register([f'worker {i} (?P<state>done|failed)', 'panic'], 0) for i in range(200)]
+    backref = hub.register([r'(\w+) \1'], 0)
+    both = hub.register(['boot', '(?i)READY'], 0, need_all=True)
+    hub.feed(sws.LogRecord.parse(1, 'boot ok'))
+    assert hub.solo == [r'(\w+) \1']  # 역참조 패턴만 따로 검사, 나머지는 합친 정규식 1개
+    for i, text in enumerate(['worker 7 done', 'hello hello', 'system ready'], 2):
+        hub.feed(sws.LogRecord.parse(i, text))
+    assert waits[7].result()['match']['named'] == {'state': 'done'}
+    assert backref.result()['match']['id'] == 3
+    assert [m['id'] for m in both.result()['matches']] == [1, 4]
+    assert not waits[8].event.is_set() and len(hub.waits) == 199
+    hub.feed(sws.LogRecord.parse(5, 'Guru Meditation: panic'))
+    assert all(w.event.is_set() for w in waits) and hub.waits == [] and hub.patterns == {}
+
+
+def test_api_expect_scans_from_cursor_and_long_polls(loop_device: sws.SerialDevice) -> None:
+    client = sws.app.test_client()
+    for line in ('I (1) boot: start', 'I (2) wifi: got ip 10.0.0.7', 'Hello world!'):
+        loop_device.append_log(line)
+    # 커서 이후 이미 수신된 줄에서 찾음
+    data = client.post('/api/rack-a/expect', json={'patterns': [r'got ip (\S+)'], 'after_id': 0}).get_json()
+    assert (data['match']['id'], data['match']['groups']) == (2, ['10.0.0.7'])
+    assert client.post('/api/rack-a/expect', json={'patterns': 'Hello', 'timeout': 0.05}).get_json()['timeout']
+    # 대기 중에 수신된 줄로 응답
+    timer = threading.Timer(0.1, loop_device.append_log, ('W (9) app: ready (3 tasks)',))
+    timer.start()
+    data = client.post('/api/rack-a/expect', json={'patterns': ['ready (3', 'never'], 'exact': True,
+                                                   'after_id': 3, 'timeout': 5}).get_json()
+    timer.join()
+    assert (data['matched'], data['match']['index'], data['match']['id']) == (True, 0, 4)
+    assert loop_device.expects.waits == []
+    assert client.post('/api/rack-a/expect', json={'patterns': ['(']}).status_code == 400
+
+
+def test_expect_wait_is_released_when_client_goes_away(loop_device: sws.SerialDevice,
+                                                       monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sws, 'EXPECT_KEEPALIVE_SEC', 0.05)
+    # Flask: 응답을 끝까지 읽지 않고 닫아도 (연결 끊김) 대기 해제
+    response = sws.app.test_client().post('/api/rack-a/expect', json={'patterns': ['never'], 'timeout': 30})
+    assert len(loop_device.expects.waits) == 1
+    response.close()
+    assert loop_device.expects.waits == []
+
+    # ASGI: http.disconnect를 받으면 시간 초과를 기다리지 않고 해제, 응답은 보내지 않음
+    async def run():
+        messages = [{'type': 'http.request', 'body': b'{"patterns": ["never"], "timeout": 30}', 'more_body': False}]
+        gone = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await gone.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {'type': 'http', 'method': 'POST', 'path': '/api/rack-a/expect', 'query_string': b'', 'headers': []}
+        task = asyncio.ensure_future(sws.asgi_app(scope, receive, send))
+        for _ in range(100):
+            if loop_device.expects.waits:
+                break
+            await asyncio.sleep(0.01)
+        assert len(loop_device.expects.waits) == 1
+        gone.set()
+        await asyncio.wait_for(task, 2)
+        return sent
+
+    assert asyncio.run(run()) == []
+    assert loop_device.expects.waits == []
+
+
+def test_monitor_client_expects_over_http(loop_device: sws.SerialDevice) -> None:
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, sws.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        loop_device.append_log('old output')
+        dut = sws.MonitorClient(f'http://127.0.0.1:{server.server_port}', 'rack-a')
+        assert dut.start() == 1
+        loop_device.append_log('Hello world!')
+        assert dut.expect_exact('Hello world!')['id'] == 2
+        threading.Timer(0.1, loop_device.append_log, ('Min Heap: 1234 bytes',)).start()
+        assert dut.expect(r'Min Heap: (\d+)', timeout=5)['groups'] == ['1234']
+        with pytest.raises(TimeoutError):
+            dut.expect('old output', timeout=0.05)
+    finally:
+        server.shutdown()
+
+
+def test_search_index_skips_evicted_lines() -> None:
+    device = sws.SerialDevice('small', 'loop://')
+    device.log_queue = sws.LogRing(8)
+    device.search_index = sws.SearchIndex(device.log_queue)
+    for i in range(30):
+        device.append_log(f'panic {i}')
+    matches, more = device.search_index.search('panic', limit=100)
+    assert [m['id'] for m in matches] == list(range(23, 31))
+    assert more is False
+
+
+def test_api_sync_compresses_and_revalidates(loop_device: sws.SerialDevice) -> None:
+    for i in range(100):
+        loop_device.append_log(f'I ({i}) wifi: scan result {i}')
+    client = sws.app.test_client()
+    first = client.get('/api/sync?last_id=0', headers={'Accept-Encoding': 'gzip'})
+    assert first.headers['Content-Encoding'] == 'gzip'
+    data = json.loads(gzip.decompress(first.data))
+    assert [log['id'] for log in data['logs']] == list(range(1, 101))
+    again = client.get('/api/sync?last_id=0', headers={'Accept-Encoding': 'gzip',
+                                                        'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 304
+    loop_device.append_log('I (100) wifi: new')
+    changed = client.get('/api/sync?last_id=0', headers={'If-None-Match': first.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.get_json()['last_id'] == 101
+
+
+def test_send_goes_through_writer_with_timings(loop_device: sws.SerialDevice) -> None:
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: loop_device.serial_inst is not None)
+        client = sws.app.test_client()
+        response = client.post('/api/send', json={'data': 'help'})
+        assert response.status_code == 202
+        command_id = response.get_json()['command']['id']
+        # loop:// 포트는 보낸 바이트를 그대로 돌려주므로 그 줄이 첫 응답이 된다
+        assert _wait_for(lambda: len(loop_device.log_queue) == 1)
+        assert _wait_for(lambda: loop_device.tx_history[-1].status == 'answered')
+        command = client.get('/api/commands').get_json()['commands'][-1]
+        assert command['id'] == command_id
+        assert command['enqueue_to_write_ms'] >= 0
+        assert command['write_to_response_ms'] >= 0
+        assert next(iter(loop_device.log_queue)).text == 'help'
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+        loop_device.disconnect()
+
+
+def test_reset_is_tracked_before_pins_and_pending_fail_on_disconnect(loop_device: sws.SerialDevice) -> None:
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: loop_device.serial_inst is not None)
+        # loop:// 는 REBOOT 줄을 DTR/RTS 시퀀스 도중에 바로 돌려줌 → 그 줄이 리셋 명령의 응답
+        assert sws.app.test_client().post('/rack-a/reboot').status_code == 200
+        reset = loop_device.tx_history[-1]
+        assert _wait_for(lambda: reset.status == 'answered')
+        # 응답 전에 포트가 닫히면 대기 중인 명령은 끝난 상태로
+        pending = sws.TxCommand(99, 'line', b'')
+        loop_device._await_response(pending)
+        stop.set()
+        loop_device.disconnect()
+        assert _wait_for(lambda: pending.status == 'disconnected')
+        assert loop_device._awaiting == []
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+        loop_device.disconnect()
+
+
+def test_send_rejects_when_queue_is_full(loop_device: sws.SerialDevice, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(loop_device, 'tx_queue', sws.queue.Queue(maxsize=1))
+    monkeypatch.setattr(loop_device, 'serial_inst', object())
+    client = sws.app.test_client()
+    assert client.post('/api/send', json={'data': 'a'}).status_code == 202
+    assert client.post('/api/send', json={'data': 'b'}).status_code == 503
+
+
+def test_stale_writer_requeues_command_for_new_connection(loop_device: sws.SerialDevice,
+                                                          monkeypatch: pytest.MonkeyPatch) -> None:
+    old, new = object(), object()
+    monkeypatch.setattr(loop_device, 'serial_inst', old)
+    first, second = loop_device.send(b'a\n'), loop_device.send(b'b\n')
+    get = loop_device.tx_queue.get
+
+    def get_then_reconnect(*args, **kwargs):
+        # 이전 연결의 writer가 명령을 꺼낸 직후 새 연결로 바뀌는 경합
+        cmd = get(*args, **kwargs)
+        loop_device.serial_inst = new
+        return cmd
+
+    monkeypatch.setattr(loop_device.tx_queue, 'get', get_then_reconnect)
+    loop_device.write_loop(old)
+    assert first.status == 'queued'
+    assert [loop_device.tx_queue.get_nowait(), loop_device.tx_queue.get_nowait()] == [first, second]
+
+
+def test_api_send_rejects_non_string_fields(loop_device: sws.SerialDevice, monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(loop_device, 'serial_inst', object())
+    client = sws.app.test_client()
+    assert client.post('/api/send', json={'data': 5}).status_code == 400
+    assert client.post('/api/send', json={'data': 'a', 'eol': None}).status_code == 400
+    assert loop_device.tx_queue.empty()
+
+
+async def _asgi_get(path, query=b'', headers=()):
+    sent = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query,
+             'headers': [(k.encode(), v.encode()) for k, v in headers]}
+    await sws.asgi_app(scope, receive, send)
+    return sent[0]['status'], dict(sent[0]['headers']), b''.join(m.get('body', b'') for m in sent[1:])
+
+
+def test_asgi_serves_native_and_flask_routes(loop_device: sws.SerialDevice) -> None:
+    for i in range(3):
+        loop_device.append_log(f'I ({i}) main: line {i}')
+    status, headers, body = asyncio.run(_asgi_get('/api/rack-a/sync', b'last_id=1'))
+    assert status == 200
+    assert [log['id'] for log in json.loads(body)['logs']] == [2, 3]
+    status, _, _ = asyncio.run(_asgi_get('/api/rack-a/sync', b'last_id=1',
+                                         [('If-None-Match', headers[b'etag'].decode())]))
+    assert status == 304
+    # 전용 처리기가 없는 라우트와 알 수 없는 장치는 Flask 앱으로 위임
+    status, _, body = asyncio.run(_asgi_get('/api/rack-a/history', b'from_id=3'))
+    assert status == 200
+    assert [log['id'] for log in json.loads(body)['logs']] == [3]
+    assert asyncio.run(_asgi_get('/api/nope/sync'))[0] == 404
+
+
+def test_asgi_stream_wakes_from_reader_thread(loop_device: sws.SerialDevice) -> None:
+    async def scenario():
+        inbox = asyncio.Queue()
+        events = asyncio.Queue()
+
+        async def send(message):
+            await events.put(message)
+
+        scope = {'type': 'http', 'method': 'GET', 'path': '/api/stream', 'query_string': b'q=boot',
+                 'headers': []}
+        task = asyncio.create_task(sws.asgi_app(scope, inbox.get, send))
+        assert (await events.get())['status'] == 200
+        assert (await events.get())['body'] == b'retry: 1000\n\n'
+        assert b'"connected":false' in (await events.get())['body']
+        # 필터에 걸리지 않는 줄은 보내지 않고, 다른 쓰레드에서 추가된 줄로 깨어나야 함
+        threading.Thread(target=lambda: [loop_device.append_log('noise'),
+                                         loop_device.append_log('boot done')]).start()
+        body = (await asyncio.wait_for(events.get(), 2))['body']
+        assert body.startswith(b'id: 2\n') and b'boot done' in body and b'noise' not in body
+        await inbox.put({'type': 'http.disconnect'})
+        await asyncio.wait_for(task, 2)
+
+    asyncio.run(scenario())
+
+
+def test_metrics_endpoint_reports_ingest_and_clients(loop_device: sws.SerialDevice, monkeypatch) -> None:
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        assert _wait_for(lambda: loop_device.serial_inst is not None)
+        with loop_device.write_lock:
+            loop_device.serial_inst.write(b'I (1) boot: a\nI (2) boot: b\n')
+        assert _wait_for(lambda: loop_device.metrics.rx_lines == 2)
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+    # 리더가 stop을 보고 스스로 연결을 닫을 때까지 대기 (serial_lock 보유 횟수: 연결 1 + 해제 1)
+    assert _wait_for(lambda: loop_device.serial_inst is None)
+    client = sws.app.test_client()
+    client.get('/api/sync?last_id=1')
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'esp_monitor_rx_bytes_total{device="rack-a"} 28' in text
+    assert 'esp_monitor_sync_requests_total{device="rack-a",code="200"} 1' in text
+    assert 'esp_monitor_sync_lag_lines_bucket{device="rack-a",le="1"} 1' in text
+    assert 'esp_monitor_lock_hold_seconds_count{device="rack-a",lock="serial"} 2' in text
+    monkeypatch.setattr(sws, 'METRICS_ENABLED', False)
+    assert client.get('/metrics').status_code == 404
+
+
+def _run_listener_until(predicate) -> bool:
+    stop = threading.Event()
+    listener = threading.Thread(target=sws.serial_listener, args=(stop,), daemon=True)
+    listener.start()
+    try:
+        return _wait_for(predicate)
+    finally:
+        stop.set()
+        listener.join(timeout=2)
+        for device in sws.devices.values():
+            device.disconnect()
+
+
+def test_capture_replays_through_ingest_path(tmp_path, monkeypatch: pytest.MonkeyPatch) -> None:
+    path = str(tmp_path / 'board.cap')
+    monkeypatch.setattr(sws, 'devices', {})
+    recorder = sws.add_device(sws.SerialDevice('rec', 'loop://', capture=sws.CaptureWriter(path, index_interval=2)))
+    chunks = [b'I (1) boot: fi', b'rst\r\nI (2) wifi: second\n', b'third\n', b'E (4) app: fourth\n']
+
+    def recorded():
+        if recorder.serial_inst is None:
+            return False
+        if not chunks:
+            return recorder.log_queue.last_id == 4
+        with recorder.write_lock:
+            recorder.serial_inst.write(chunks.pop(0))
+        time.sleep(0.05)  # 청크마다 따로 읽히도록
+        return False
+
+    assert _run_listener_until(recorded)
+    recorder.capture.close()
+    expected = [log.text for log in recorder.log_queue]
+
+    monkeypatch.setattr(sws, 'devices', {})
+    player = sws.add_device(sws.SerialDevice('play', f'replay://{path}?speed=0'))
+    assert _run_listener_until(lambda: player.log_queue.last_id == 4)
+    assert [log.text for log in player.log_queue] == expected
+    assert player.log_queue.get(4).level == 'E'
+
+    reader = sws.CaptureReader(path)
+    reader.seek(from_id=3)
+    assert reader.next_record()[1] == b'third\n'
+    reader.seek(from_ns=reader.index[-1][0])
+    assert reader.next_record()[1] == b'third\n'
+    reader.close()
+
+
+@pytest.mark.parametrize('framing, encode', [('slip', sws.slip_encode), ('cobs', sws.cobs_encode)])
+def test_frame_splitter_decodes_across_chunks(framing: str, encode) -> None:
+    frames = [b'\x00\xc0\xdb\xdd\xdc', bytes(range(256)) * 3, b'plain', b'\x00' * 10]
+    stream = b''.join(encode(f) for f in frames)
+    splitter = sws.FrameSplitter(framing)
+    out = []
+    for i in range(0, len(stream), 7):
+        out += splitter.feed(stream[i:i + 7])
+    assert out == frames
+    assert splitter.pending == 0 and splitter.errors == 0
+
+
+def test_binary_device_keeps_frames_as_bytes(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sws, 'devices', {})
+    dev = sws.add_device(sws.SerialDevice('bin', 'loop://', framing='cobs'))
+    frames = [b'\x01\x00\x02', b'\xff' * 300]
+
+    def received():
+        if dev.serial_inst is None:
+            return False
+        if frames:
+            with dev.write_lock:
+                dev.serial_inst.write(b''.join(sws.cobs_encode(f) for f in frames) + b'\x05\x00')
+            frames.clear()
+        return dev.log_queue.last_id == 2 and dev.metrics.frame_errors == 1  # 0x05 code는 프레임 길이를 넘음
+
+    assert _run_listener_until(received)
+    assert [log.text for log in dev.log_queue] == [b'\x01\x00\x02', b'\xff' * 300]
+
+    client = sws.app.test_client()
+    logs = client.get('/api/bin/sync').get_json()['logs']
+    assert sws.base64.b64decode(logs[0]['data']) == b'\x01\x00\x02' and logs[1]['len'] == 300
+    assert client.get('/api/bin/search?q=x').status_code == 400
+    assert client.get('/api/bin/stream?q=x').status_code == 400
+
+    resp = client.get('/api/bin/frames?last_id=1')
+    assert resp.headers['X-Last-Id'] == '2'
+    record_id, _, length = sws.FRAME_HEADER.unpack_from(resp.data)
+    assert (record_id, length) == (2, 300) and resp.data[sws.FRAME_HEADER.size:] == b'\xff' * 300
+
+
+def test_shared_log_ring_reads_wrapped_records_without_locks(tmp_path) -> None:
+    path = str(tmp_path / 'dev.ring')
+    writer = sws.SharedLogWriter(path, slots=8, data_bytes=600)
+    reader = sws.SharedLogRing(path)
+    fragments = [sws.LogRecord.parse(i, f'I ({i}) app: line {i:03}', 0).json for i in range(1, 21)]
+    for i, fragment in enumerate(fragments, 1):
+        writer.append(i, fragment)
+    # 데이터 영역(600B)에 온전히 남은 최근 레코드만 보임 (슬롯 8개보다 적음)
+    first = 20 - 600 // len(fragments[-1]) + 1
+    assert reader.first_id == first and reader.last_id == 20
+    records, gap = reader.since(0)
+    assert [r.id for r in records] == list(range(first, 21)) and gap == {"from_id": 1, "to_id": first - 1}
+    assert records[-1].text == 'I (20) app: line 020' and records[-1].tag == 'app'
+    fragments, last, gap = reader.encoded_since(18, limit=1)
+    assert last == 19 and gap is None and b'line 019' in fragments[0]
+    writer.clear(20)
+    assert len(reader) == 0 and reader.since(20) == ([], None)
+
+
+def test_remote_device_serves_from_shared_ring_and_routes_commands(tmp_path, monkeypatch) -> None:
+    monkeypatch.setattr(sws, 'devices', {})
+    owner = sws.add_device(sws.SerialDevice('rack-a', 'loop://'))
+    manifest = sws.publish_shared(str(tmp_path))
+    listener = sws.open_control(manifest)
+    threading.Thread(target=sws.control_server, args=(listener, {'rack-a': owner}), daemon=True).start()
+    owner.append_log('I (1) wifi: connected')
+    try:
+        remote = sws.RemoteDevice(manifest['devices'][0], sws.ControlClient(
+            manifest['control'], bytes.fromhex(manifest['authkey'])))
+        monkeypatch.setattr(sws, 'devices', {'rack-a': remote})
+        client = sws.app.test_client()
+        data = client.get('/api/rack-a/sync?last_id=0&level=I').get_json()
+        assert [log['text'] for log in data['logs']] == ['I (1) wifi: connected']
+        assert client.get('/api/rack-a/search?q=wifi').get_json()['ids'] == [1]
+        assert client.post('/api/rack-a/send', json={'data': 'x'}).status_code == 400  # 수집 프로세스 쪽 미연결
+
+        owner.is_connected = True
+        owner.notify()
+        assert remote.serial_inst
+        resp = client.post('/api/rack-a/send', json={'data': 'help'})
+        assert resp.status_code == 202 and owner.tx_queue.get_nowait().data == b'help\n'
+        assert client.get('/api/rack-a/commands').get_json()['queued'] == 0
+
+        # expect는 워커가 공유 링을 읽어 검사 (shared_watcher의 poll_changes)
+        wait, _ = sws.expect_begin(remote, {'patterns': ['ready'], 'after_id': 1})
+        owner.append_log('I (2) app: ready')
+        remote.poll_changes()
+        assert wait.event.is_set() and wait.result()['match']['id'] == 2
+    finally:
+        listener.close()